@@ -0,0 +1,166 @@
+"""
+Check the browser pool with fake browsers, that start in ``--start-delay`` seconds.
+
+    python benchmarks/browser_pool.py --size 4
+
+Exit status is 1, if browsers are not reused, recycled or replaced as they should be, failure
+to start a browser doesn't reach waiting ones, or a browser is started after ``close()``.
+"""
+
+import argparse
+from concurrent.futures import wait
+import sys
+import threading
+import time
+
+from aeroport.browserpool import BrowserPool, BrowserPoolError
+
+
+class FakeBrowser(object):
+
+    def __init__(self, number: int):
+        self.number = number
+        self.broken = False
+        self.quitted = False
+
+    @property
+    def url(self) -> str:
+        if self.broken:
+            raise ConnectionError("Browser is not responding")
+        return "about:blank"
+
+    def quit(self):
+        self.quitted = True
+
+
+class FakeFactory(object):
+
+    def __init__(self, start_delay: float):
+        self.start_delay = start_delay
+        self.started = []
+        self.fail = False
+        self._lock = threading.Lock()
+
+    def __call__(self) -> FakeBrowser:
+        time.sleep(self.start_delay)
+        if self.fail:
+            raise RuntimeError("Browser can't start")
+        with self._lock:
+            browser = FakeBrowser(len(self.started))
+            self.started.append(browser)
+        return browser
+
+    @property
+    def alive(self) -> int:
+        return sum(1 for browser in self.started if not browser.quitted)
+
+
+def check_reuse(size: int, delay: float) -> list:
+    errors = []
+    factory = FakeFactory(delay)
+    pool = BrowserPool(factory, size, max_pages=0)
+    futures = [pool.executor.submit(pool.run, lambda browser: time.sleep(delay)) for _ in range(size * 10)]
+    wait(futures)
+    if len(factory.started) > size:
+        errors.append("{} browsers started for pool of {}".format(len(factory.started), size))
+    pool.close()
+    if factory.alive:
+        errors.append("{} browsers are alive after close()".format(factory.alive))
+    return errors
+
+
+def check_recycling(delay: float) -> list:
+    errors = []
+    factory = FakeFactory(delay)
+    pool = BrowserPool(factory, 1, max_pages=3)
+    for _ in range(7):
+        pool.run(lambda browser: None)
+    if len(factory.started) != 3 or factory.alive != 1:
+        errors.append("7 pages of 3 per browser took {} browsers, {} alive".format(
+            len(factory.started), factory.alive))
+
+    pool.run(lambda browser: setattr(browser, "broken", True))
+    pool.run(lambda browser: None)
+    if not factory.started[-2].quitted or factory.alive != 1:
+        errors.append("Broken browser is not replaced")
+
+    unhealthy = set()
+    pool = BrowserPool(factory, 1, health_check=lambda browser: browser.number not in unhealthy)
+    first = pool.run(lambda browser: browser.number)
+    unhealthy.add(first)
+    if pool.run(lambda browser: browser.number) == first:
+        errors.append("Browser, rejected by health check, is not replaced")
+    pool.close()
+    return errors
+
+
+def check_failure(delay: float) -> list:
+    errors = []
+    factory = FakeFactory(delay)
+    factory.fail = True
+    pool = BrowserPool(factory, 1, wait_timeout=BrowserPool.WAIT_INTERVAL * 10)
+    results = {}
+    starting = threading.Thread(target=lambda: results.update(starting=_run(pool)))
+    waiting = threading.Thread(target=lambda: results.update(waiting=_run(pool)))
+    started = time.monotonic()
+    starting.start()
+    time.sleep(delay / 4)
+    waiting.start()
+    starting.join()
+    waiting.join()
+    if not isinstance(results["waiting"], BrowserPoolError):
+        errors.append("Waiting checkout got {!r} instead of failure to start browser".format(results["waiting"]))
+    elif time.monotonic() - started > BrowserPool.WAIT_INTERVAL * 2 + delay:
+        errors.append("Waiting checkout failed only in {:.1f}s".format(time.monotonic() - started))
+
+    factory.fail = False
+    if _run(pool) != "ok":
+        errors.append("Pool doesn't recover after browser starts again")
+    pool.close()
+    return errors
+
+
+def check_close(delay: float) -> list:
+    errors = []
+    factory = FakeFactory(delay)
+    pool = BrowserPool(factory, 2)
+    started = threading.Thread(target=_run, args=(pool, ))
+    started.start()
+    time.sleep(delay / 2)
+    pool.close()
+    started.join()
+    if not isinstance(_run(pool), BrowserPoolError):
+        errors.append("Checkout succeeds after close()")
+    if factory.alive:
+        errors.append("{} browsers started during close() are alive".format(factory.alive))
+    return errors
+
+
+def _run(pool: BrowserPool):
+    try:
+        return pool.run(lambda browser: "ok")
+    except Exception as e:
+        return e
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=4, help="Number of browsers in the pool")
+    parser.add_argument("--start-delay", type=float, default=0.05, help="Start time of the browser, seconds")
+    args = parser.parse_args()
+
+    errors = []
+    for check in (check_reuse, check_recycling, check_failure, check_close):
+        started = time.perf_counter()
+        found = check(args.size, args.start_delay) if check is check_reuse else check(args.start_delay)
+        print("{:<18} {:>6.2f}s {}".format(check.__name__, time.perf_counter() - started, "FAIL" if found else "ok"))
+        errors.extend(found)
+    if errors:
+        for error in errors:
+            print("FAIL: {}".format(error))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Synthetic YML feeds and the origin to parse them, shared by YML benchmarks.
+"""
+
+from aeroport.payload import Field, Payload
+from aeroport.yml import YmlFeedItemTypes, YmlOrigin
+from aeroport.ymlschema import Attr, ItemSchema, Mapping, OwnText, SchemaItemAdapter, Text
+
+
+class Offer(Payload):
+    original_id = Field()
+    available = Field()
+    name = Field()
+    price = Field()
+    category_id = Field()
+    pictures = Field()
+    params = Field()
+
+
+class Category(Payload):
+    original_id = Field()
+    parent_id = Field()
+    name = Field()
+
+
+class OfferAdapter(SchemaItemAdapter):
+    SCHEMA = ItemSchema(Offer, (
+        Attr("original_id", "id", cast=int),
+        Attr("available", "available", default="true"),
+        Text("name", "name"),
+        Text("price", "price", cast=float),
+        Text("category_id", "categoryId", cast=int),
+        Text("pictures", "picture", many=True),
+        Mapping("params", "param", "name"),
+    ))
+
+
+class CategoryAdapter(SchemaItemAdapter):
+    SCHEMA = ItemSchema(Category, (
+        Attr("original_id", "id", cast=int),
+        Attr("parent_id", "parentId", cast=int),
+        OwnText("name"),
+    ))
+
+
+class Airline(object):
+    name = "benchmark"
+
+
+class FeedOrigin(YmlOrigin):
+    """
+    Parses local feed files, without file cache and destination.
+    """
+
+    name = "feed"
+    default_destination = None
+    ADAPTER_MAPPING = {
+        YmlFeedItemTypes.offer: OfferAdapter,
+        YmlFeedItemTypes.category: CategoryAdapter,
+    }
+
+    def __init__(self, **options):
+        super().__init__(Airline())
+        self.set_options(**options)
+
+    def _init_file_url_cache(self):
+        return None
+
+
+def write_feed(path: str, num_offers: int, num_categories: int = 1000):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        f.write('<yml_catalog date="2017-01-01 00:00"><shop><name>Benchmark</name>\n<categories>\n')
+        for i in range(1, num_categories + 1):
+            f.write('<category id="{}" parentId="{}">Category {}</category>\n'.format(i, i // 10, i))
+        f.write("</categories>\n<offers>\n")
+        for i in range(1, num_offers + 1):
+            f.write(
+                '<offer id="{0}" available="true"><name>Offer {0}</name><price>{1}.50</price>'
+                '<categoryId>{2}</categoryId><picture>http://example.com/{0}/1.jpg</picture>'
+                '<picture>http://example.com/{0}/2.jpg</picture><param name="color">red</param>'
+                '<param name="size">{3}</param><description>{4}</description></offer>\n'.format(
+                    i, i % 1000, i % num_categories + 1, i % 50, "Long description " * 10,
+                )
+            )
+        f.write("</offers>\n</shop></yml_catalog>\n")
@@ -0,0 +1,206 @@
+"""
+Check distributed flights: several worker processes against one PostgreSQL database.
+
+    AEROPORT_SETTINGS_MODULE=my.settings python benchmarks/flight_workers.py -n 20 -w 3
+
+Settings must point ``DATABASE`` at PostgreSQL 9.6 or newer. Queue is kept in a separate
+``flightrecord_harness`` table, which is dropped at the end (unless ``--keep``). Flights just
+sleep for ``--duration`` seconds, which is longer than the lease, so that they land only if
+heartbeats extend it. Every worker also tries to queue the same origin at start.
+
+One of the workers is killed with SIGKILL while it runs flights. Exit status is 1, if some
+flight doesn't land, runs on two workers at once, lands more than once, or flights of the
+killed worker are not queued again and landed by the others. With ``--no-kill`` it checks
+the graceful stop (SIGTERM) instead: flights of the stopped worker are queued again at once,
+without counting the attempt.
+"""
+
+import argparse
+import asyncio
+from collections import defaultdict
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+
+from sunhead.conf import settings
+
+from aeroport.__main__ import DEFAULT_ENVIRONMENT_VARIABLE, GLOBAL_CONFIG_MODULE
+
+settings.configure(None, DEFAULT_ENVIRONMENT_VARIABLE, GLOBAL_CONFIG_MODULE)
+
+from aeroport.db import create_tables, drop_tables  # noqa: E402 (needs configured settings)
+from aeroport.dispatch import FlightRecord, FlightStatuses  # noqa: E402
+from aeroport.worker import FlightQueue, FlightWorker, migrate  # noqa: E402
+
+
+AIRLINE = "harness"
+DUPLICATE_ORIGIN = "duplicate"
+
+
+class HarnessFlightRecord(FlightRecord):
+
+    class Meta:
+        db_table = "flightrecord_harness"
+
+
+class HarnessWorker(FlightWorker):
+    """
+    Worker, whose flights sleep and report their start and end to the parent.
+    """
+
+    def __init__(self, events, duration: float, **kwargs):
+        super().__init__(**kwargs)
+        self._events = events
+        self._duration = duration
+
+    async def run_flight_record(self, flight_record: FlightRecord):
+        self._events.put((str(flight_record.uuid), self.worker_id, "start", time.time()))
+        await asyncio.sleep(self._duration)
+        self._events.put((str(flight_record.uuid), self.worker_id, "end", time.time()))
+
+
+def run_worker(worker_id: str, events, args):
+    loop = asyncio.get_event_loop()
+    flight_queue = FlightQueue(HarnessFlightRecord)
+    worker = HarnessWorker(
+        events, args.duration, concurrency=args.concurrency, lease_timeout=args.lease,
+        heartbeat_interval=args.lease / 3, poll_interval=0.2, max_attempts=3,
+        worker_id=worker_id, queue=flight_queue,
+    )
+    loop.add_signal_handler(signal.SIGTERM, worker.stop)
+    loop.run_until_complete(flight_queue.enqueue(AIRLINE, DUPLICATE_ORIGIN))
+    loop.run_until_complete(worker.run())
+
+
+def drain_events(events, collected: list):
+    while True:
+        try:
+            collected.append(events.get_nowait())
+        except queue.Empty:
+            return
+
+
+def check_runs(collected: list, records: list, victim: str, stopped_at: float, killed: bool) -> list:
+    errors = []
+    runs = defaultdict(list)  # Flight uuid -> [worker, start, end]
+    for flight_uuid, worker_id, event, ts in sorted(collected, key=lambda item: item[3]):
+        if event == "start":
+            runs[flight_uuid].append([worker_id, ts, None])
+        else:
+            for run in runs[flight_uuid]:
+                if run[0] == worker_id and run[2] is None:
+                    run[2] = ts
+
+    for record in records:
+        flight_uuid = str(record.uuid)
+        flight_runs = runs.get(flight_uuid, [])
+        if record.status != FlightStatuses.landed.value:
+            errors.append("Flight {} ({}) is not landed, status {}".format(flight_uuid, record.origin, record.status))
+        landed = [run for run in flight_runs if run[2] is not None]
+        if len(landed) != 1:
+            errors.append("Flight {} landed {} times".format(flight_uuid, len(landed)))
+        intervals = sorted((start, end or stopped_at) for _, start, end in flight_runs)
+        for (_, first_end), (second_start, _) in zip(intervals, intervals[1:]):
+            if second_start < first_end:
+                errors.append("Flight {} ran on two workers at once".format(flight_uuid))
+        if any(worker_id == victim for worker_id, _, _ in flight_runs):
+            if any(worker_id == victim for worker_id, _, _ in landed):
+                errors.append("Flight {} landed on the stopped worker".format(flight_uuid))
+            expected_attempts = 2 if killed else 1
+            if record.attempts != expected_attempts:
+                errors.append("Flight {} of the stopped worker took {} attempts instead of {}".format(
+                    flight_uuid, record.attempts, expected_attempts))
+
+    if not any(run[0] == victim for flight_runs in runs.values() for run in flight_runs):
+        errors.append("Worker {} was stopped before it ran any flight".format(victim))
+    duplicates = [record for record in records if record.origin == DUPLICATE_ORIGIN]
+    if len(duplicates) != 1:
+        errors.append("Origin, queued by every worker at once, is queued {} times".format(len(duplicates)))
+    return errors
+
+
+async def fetch_records(flight_queue: FlightQueue) -> list:
+    return await flight_queue._execute("SELECT * FROM {table} ORDER BY id".format(table=flight_queue._table))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", dest="num", type=int, default=20, help="Number of flights")
+    parser.add_argument("-w", dest="workers", type=int, default=3, help="Number of worker processes")
+    parser.add_argument("-c", dest="concurrency", type=int, default=2, help="Flights at once per worker")
+    parser.add_argument("--duration", type=float, default=4.0, help="Flight duration, seconds")
+    parser.add_argument("--lease", type=float, default=3.0, help="Lease timeout, seconds")
+    parser.add_argument("--no-kill", dest="kill", action="store_false", help="Stop the worker with SIGTERM")
+    parser.add_argument("--keep", action="store_true", help="Don't drop the queue table")
+    args = parser.parse_args()
+    if args.workers < 2:
+        parser.error("At least 2 workers are needed")
+
+    loop = asyncio.get_event_loop()
+    flight_queue = FlightQueue(HarnessFlightRecord)
+    drop_tables(models=[HarnessFlightRecord])
+    create_tables(models=[HarnessFlightRecord])
+    migrate(HarnessFlightRecord)
+    for i in range(args.num):
+        loop.run_until_complete(flight_queue.enqueue(AIRLINE, "origin-{}".format(i), priority=i % 3))
+
+    context = multiprocessing.get_context("spawn")
+    events = context.Queue()
+    worker_ids = ["worker-{}".format(i) for i in range(args.workers)]
+    processes = {
+        worker_id: context.Process(target=run_worker, args=(worker_id, events, args)) for worker_id in worker_ids
+    }
+    for process in processes.values():
+        process.start()
+
+    victim = worker_ids[0]
+    collected = []
+    started = time.monotonic()
+    stopped_at = None
+    # Flights must not outlive max attempts of lease expiry, with some time for the queue to drain
+    deadline = started + (args.num + 1) * args.duration / args.workers / args.concurrency \
+        + 3 * (args.lease + args.duration) + 30
+    try:
+        while time.monotonic() < deadline:
+            time.sleep(0.2)
+            drain_events(events, collected)
+            if stopped_at is None and any(item[1] == victim and item[2] == "start" for item in collected):
+                # Let it hold the lease for a while, then stop it in the middle of the flight
+                time.sleep(args.duration / 2)
+                os.kill(processes[victim].pid, signal.SIGKILL if args.kill else signal.SIGTERM)
+                stopped_at = time.time()
+                print("{} {} at {:.1f}s".format(victim, "killed" if args.kill else "stopped", time.monotonic() - started))
+            records = loop.run_until_complete(fetch_records(flight_queue))
+            if stopped_at is not None and all(record.status == FlightStatuses.landed.value for record in records):
+                break
+    finally:
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in processes.values():
+            process.join()
+        drain_events(events, collected)
+
+    records = loop.run_until_complete(fetch_records(flight_queue))
+    errors = check_runs(collected, records, victim, stopped_at or time.time(), args.kill)
+    attempts = defaultdict(int)
+    for record in records:
+        attempts[record.attempts] += 1
+    print("{} flights in {:.1f}s, attempts: {}".format(
+        len(records), time.monotonic() - started, dict(sorted(attempts.items()))
+    ))
+    if not args.keep:
+        drop_tables(models=[HarnessFlightRecord])
+
+    if errors:
+        for error in errors:
+            print("FAIL: {}".format(error))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
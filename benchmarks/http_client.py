@@ -0,0 +1,144 @@
+"""
+Check and time the shared HTTP client against a local aiohttp server.
+
+    python benchmarks/http_client.py -n 500 --limit-per-host 8
+
+Server counts connections and requests in flight. Exit status is 1, if the shared session
+opens more connections than ``--limit-per-host``, doesn't reuse them, or can't be reopened
+after ``close()``.
+"""
+
+import argparse
+import asyncio
+import socket
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+from aeroport.httpclient import HttpClientManager
+
+
+class CountingServer(object):
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.peers = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.port = None
+        self._runner = None
+        self._server = None
+
+    async def handle(self, request):
+        self.peers.add(request.transport.get_extra_info("peername"))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        return web.Response(text="ok")
+
+    async def start(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        app = web.Application()
+        app.router.add_route("GET", "/", self.handle)
+        if hasattr(web, "AppRunner"):
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+        else:
+            # aiohttp 1.x
+            handler = app.make_handler()
+            self._server = await asyncio.get_event_loop().create_server(handler, "127.0.0.1", self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+        else:
+            self._server.close()
+            await self._server.wait_closed()
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:{}/".format(self.port)
+
+
+async def fetch(session, url: str) -> str:
+    async with session.get(url) as response:
+        return await response.text()
+
+
+async def run_shared(manager: HttpClientManager, url: str, num: int) -> float:
+    started = time.perf_counter()
+    await asyncio.gather(*[fetch(manager.session, url) for _ in range(num)])
+    return time.perf_counter() - started
+
+
+async def run_session_per_request(url: str, num: int) -> float:
+    async def fetch_once():
+        async with aiohttp.ClientSession() as session:
+            return await fetch(session, url)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[fetch_once() for _ in range(num)])
+    return time.perf_counter() - started
+
+
+async def check(num: int, limit_per_host: int, delay: float) -> list:
+    errors = []
+    server = CountingServer(delay)
+    await server.start()
+    manager = HttpClientManager(limit_per_host=limit_per_host)
+    try:
+        elapsed = await run_shared(manager, server.url, num)
+        print("{:<22} {:>8.0f} req/s {:>5} connections".format("shared session", num / elapsed, len(server.peers)))
+        if server.max_in_flight > limit_per_host:
+            errors.append("{} requests in flight, limit is {}".format(server.max_in_flight, limit_per_host))
+        if len(server.peers) > limit_per_host:
+            errors.append("{} connections opened, limit is {}".format(len(server.peers), limit_per_host))
+
+        opened = len(server.peers)
+        await run_shared(manager, server.url, num)
+        if len(server.peers) != opened:
+            errors.append("connections are not reused, {} more opened".format(len(server.peers) - opened))
+
+        session = manager.session
+        await manager.close()
+        if not session.closed:
+            errors.append("session is not closed by close()")
+        if manager.session.closed or await fetch(manager.session, server.url) != "ok":
+            errors.append("session is not reopened after close()")
+        await manager.close()
+
+        server.peers.clear()
+        elapsed = await run_session_per_request(server.url, num)
+        print("{:<22} {:>8.0f} req/s {:>5} connections".format("session per request", num / elapsed, len(server.peers)))
+    finally:
+        await manager.close()
+        await server.stop()
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", dest="num", type=int, default=500, help="Number of requests")
+    parser.add_argument("--limit-per-host", type=int, default=HttpClientManager.DEFAULT_LIMIT_PER_HOST)
+    parser.add_argument("--delay", type=float, default=0.005, help="Server response delay, seconds")
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    errors = loop.run_until_complete(check(args.num, args.limit_per_host, args.delay))
+    if errors:
+        for error in errors:
+            print("FAIL: {}".format(error))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Cost of making integer ids from non-numeric feed ids (``yml.to_int`` and ``yml.to_int_many``).
+
+    python benchmarks/id_hashing.py -n 200000
+"""
+
+import argparse
+import hashlib
+import random
+import time
+
+from aeroport import yml
+from aeroport.yml import set_id_hash, to_int, to_int_many
+
+
+def hexdigest_to_int(data) -> int:
+    # How ids were made before the memo and the digest slicing
+    if hasattr(data, "encode"):
+        data = data.encode()
+    return int(hashlib.md5(data).hexdigest()[:14], 16)
+
+
+def measure(func, ids: list) -> float:
+    best = None
+    for _ in range(3):
+        started = time.perf_counter()
+        func(ids)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(ids) * 1e9
+
+
+def run_uncached(ids: list):
+    yml._to_int_cached.cache_clear()
+    for value in ids:
+        to_int(value)
+
+
+def run_cached(ids: list):
+    for value in ids:
+        to_int(value)
+
+
+def run_many_uncached(ids: list):
+    yml._to_int_cached.cache_clear()
+    to_int_many(ids)
+
+
+def run_many_cached(ids: list):
+    to_int_many(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", dest="num", type=int, default=200000, help="Number of ids")
+    parser.add_argument("--repeated", type=int, default=500,
+                        help="Number of distinct ids in repeated run, like category ids of offers")
+    args = parser.parse_args()
+
+    ids = ["sku-{}-{:x}".format(i, random.getrandbits(40)) for i in range(args.num)]
+    repeated = [ids[i % args.repeated] for i in range(args.num)]
+
+    set_id_hash("md5")
+    mismatched = [value for value in ids[:1000] if to_int(value) != hexdigest_to_int(value)]
+    if to_int_many(repeated[:1000]) != [to_int(value) for value in repeated[:1000]]:
+        raise SystemExit("to_int_many() ids differ from to_int() ones")
+    if mismatched:
+        raise SystemExit("md5 ids differ from previous versions: {}".format(mismatched[:3]))
+
+    print("{:<22} {:>8}".format("run", "ns/id"))
+    print("{:<22} {:>8.0f}".format("hexdigest", measure(lambda values: [hexdigest_to_int(v) for v in values], ids)))
+    hashes = ["md5"] + (["xxh64"] if yml.xxhash is not None else [])
+    for name in hashes:
+        set_id_hash(name)
+        print("{:<22} {:>8.0f}".format("{} unique".format(name), measure(run_uncached, ids)))
+        print("{:<22} {:>8.0f}".format("{} repeated".format(name), measure(run_cached, repeated)))
+        print("{:<22} {:>8.0f}".format("{} many unique".format(name), measure(run_many_uncached, ids)))
+        print("{:<22} {:>8.0f}".format("{} many repeated".format(name), measure(run_many_cached, repeated)))
+    if yml.xxhash is None:
+        print("xxh64 is skipped, 'xxhash' package is not installed")
+
+
+if __name__ == "__main__":
+    main()
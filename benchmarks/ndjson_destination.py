@@ -0,0 +1,76 @@
+"""
+Throughput of NDJSONFileDestination against naive line-by-line ``json.dumps`` writing.
+
+    python benchmarks/ndjson_destination.py -n 300000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from aeroport.destinations.ndjson import NDJSONFileDestination
+from aeroport.payload import Field, Payload
+
+
+class Offer(Payload):
+    original_id = Field()
+    title = Field()
+    price = Field()
+    url = Field()
+    params = Field()
+
+
+def make_payload(i: int) -> Offer:
+    return Offer(
+        original_id=i, title="Some offer title", price=123.5, url="http://example.com/{}".format(i),
+        params={"color": "red", "sizes": [1, 2, 3]},
+    )
+
+
+async def run_naive(path: str, payloads) -> float:
+    started = time.perf_counter()
+    with open(os.path.join(path, "naive.ndjson"), "w") as f:
+        for payload in payloads:
+            f.write(json.dumps(payload.as_dict))
+            f.write("\n")
+    return time.perf_counter() - started
+
+
+async def run_destination(path: str, payloads, compression) -> float:
+    destination = NDJSONFileDestination(path=path, compression=compression)
+    started = time.perf_counter()
+    await destination.prepare()
+    for payload in payloads:
+        await destination.process_payload(payload)
+    await destination.release()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", dest="num", type=int, default=300000, help="Number of payloads")
+    args = parser.parse_args()
+
+    payloads = [make_payload(i) for i in range(args.num)]
+    loop = asyncio.get_event_loop()
+    runs = [
+        ("naive json", lambda path: run_naive(path, payloads)),
+        ("ndjson", lambda path: run_destination(path, payloads, None)),
+        ("ndjson gzip", lambda path: run_destination(path, payloads, "gzip")),
+    ]
+    for name, run in runs:
+        path = tempfile.mkdtemp()
+        try:
+            elapsed = loop.run_until_complete(run(path))
+            size = sum(os.path.getsize(os.path.join(path, filename)) for filename in os.listdir(path))
+        finally:
+            shutil.rmtree(path)
+        print("{:<12} {:>9.0f} payloads/s {:>8.1f} MB".format(name, args.num / elapsed, size / 1024 / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Crawl time of ScrapingOrigin with payloads extracted in the event loop against ``parse_workers``
+processes.
+
+    python benchmarks/parse_pool.py -n 100 --items 500 --delay 0.02 -w 1 -w 2 -w 4
+
+Pages are generated in memory and "downloaded" with ``--delay`` seconds of simulated network time.
+"""
+
+import argparse
+import asyncio
+import time
+
+from bs4 import BeautifulSoup
+
+from aeroport.abc import AbstractDestination, AbstractItemAdapter, AbstractUrlGenerator, UrlInfo
+from aeroport.payload import Field, Payload
+from aeroport.scraping import ScrapingOrigin
+
+
+class Product(Payload):
+    title = Field()
+    price = Field()
+
+
+class ProductAdapter(AbstractItemAdapter):
+
+    def extract_raw_items_from_html(self, html):
+        return BeautifulSoup(html, "html.parser").find_all("div", class_="item")
+
+    def adapt_raw_item(self, raw_item):
+        return Product(title=raw_item.h3.get_text(strip=True), price=int(raw_item.span.get_text()))
+
+
+class PageUrlGenerator(AbstractUrlGenerator):
+
+    def __init__(self, num: int):
+        self._urls = iter(range(num))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> UrlInfo:
+        try:
+            page = next(self._urls)
+        except StopIteration:
+            raise StopAsyncIteration
+        return UrlInfo(url="http://example.com/{}".format(page), kwargs={})
+
+
+class CollectingDestination(AbstractDestination):
+
+    def __init__(self):
+        super().__init__()
+        self.payloads = []
+
+    async def prepare(self):
+        pass
+
+    async def release(self):
+        pass
+
+    async def process_payload(self, payload):
+        self.payloads.append(dict(payload))
+
+
+class Airline(object):
+    name = "benchmark"
+
+
+class PageOrigin(ScrapingOrigin):
+
+    name = "pages"
+    default_destination = None
+
+    def __init__(self, items: int, delay: float, **options):
+        super().__init__(Airline())
+        self._items = items
+        self._delay = delay
+        self._destination = CollectingDestination()
+        self.set_options(**options)
+
+    @property
+    def fetch_concurrency(self) -> int:
+        return 8
+
+    async def get_html_from_url(self, url: str) -> str:
+        await asyncio.sleep(self._delay)
+        page = url.rsplit("/", 1)[1]
+        return "<html><body>{}</body></html>".format("".join(
+            "<div class='item'><h3> Product {}-{} </h3><span>{}</span><p>{}</p></div>".format(page, i, i, "x" * 200)
+            for i in range(self._items)
+        ))
+
+
+async def crawl(args, **options):
+    origin = PageOrigin(args.items, args.delay, preserve_order=True, **options)
+    started = time.perf_counter()
+    try:
+        await origin.crawl(PageUrlGenerator(args.num), (ProductAdapter(), ))
+    finally:
+        await origin.close()
+    return time.perf_counter() - started, origin.destination.payloads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", dest="num", type=int, default=100, help="Number of pages")
+    parser.add_argument("--items", type=int, default=500, help="Items on the page")
+    parser.add_argument("--delay", type=float, default=0.02, help="Download time of the page, seconds")
+    parser.add_argument("-w", dest="workers", type=int, action="append", help="Number of parse workers")
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    print("{:<12} {:>8} {:>10}".format("parsing", "seconds", "pages/s"))
+    elapsed, expected = loop.run_until_complete(crawl(args))
+    print("{:<12} {:>8.2f} {:>10.1f}".format("in loop", elapsed, args.num / elapsed))
+    for workers in args.workers or [1, 2, 4]:
+        elapsed, payloads = loop.run_until_complete(crawl(args, parse_workers=workers))
+        print("{:<12} {:>8.2f} {:>10.1f}".format("{} workers".format(workers), elapsed, args.num / elapsed))
+        if payloads != expected:
+            raise SystemExit("Payloads extracted by {} workers differ from ones extracted in loop".format(workers))
+
+
+if __name__ == "__main__":
+    main()
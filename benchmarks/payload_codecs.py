@@ -0,0 +1,66 @@
+"""
+Speed and size of payload codecs against SunHead's JSON serializer, which stream destination
+used before codecs. Codecs that need missing packages (msgpack) are skipped.
+
+    python benchmarks/payload_codecs.py -n 200000
+"""
+
+import argparse
+import time
+
+from sunhead.serializers.json import JSONSerializer
+
+from aeroport.codecs import CODECS, get_codec
+from aeroport.payload import Field, Payload
+
+
+class Offer(Payload):
+    original_id = Field()
+    price = Field()
+    name = Field()
+    category_id = Field()
+    params = Field()
+
+
+def make_payload() -> Offer:
+    return Offer(
+        original_id=72057594037927, price=1999.0, name="Samsung Galaxy S7 32Gb black", category_id=1234,
+        params={"color": "black", "memory": "32Gb", "vendor": "Samsung"},
+    )
+
+
+def measure(func, arg, num: int) -> float:
+    started = time.perf_counter()
+    for _ in range(num):
+        func(arg)
+    return (time.perf_counter() - started) / num * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", dest="num", type=int, default=200000, help="Number of encodings per codec")
+    args = parser.parse_args()
+
+    payload = make_payload()
+    serializer = JSONSerializer()
+    data = serializer.serialize(payload.as_dict)
+    print("{:<14} {:>8} {:>10} {:>10}".format("codec", "bytes", "encode us", "decode us"))
+    print("{:<14} {:>8} {:>10.2f} {:>10.2f}".format(
+        "sunhead json", len(data), measure(serializer.serialize, payload.as_dict, args.num),
+        measure(serializer.deserialize, data, args.num),
+    ))
+    for name in CODECS:
+        try:
+            codec = get_codec(name)
+        except ValueError as e:
+            print("{:<14} skipped: {}".format(name, e))
+            continue
+        data = codec.encode(payload)
+        assert codec.decode(data).as_dict == payload.as_dict, name
+        print("{:<14} {:>8} {:>10.2f} {:>10.2f}".format(
+            name, len(data), measure(codec.encode, payload, args.num), measure(codec.decode, data, args.num),
+        ))
+
+
+if __name__ == "__main__":
+    main()
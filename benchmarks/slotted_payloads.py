@@ -0,0 +1,74 @@
+"""
+Memory and speed of slot-backed payloads (``SLOTTED = True``) against default dict-backed ones.
+
+    python benchmarks/slotted_payloads.py -n 200000
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from aeroport.payload import Field, Payload
+
+
+class OfferFields(Payload):
+    # Without empty slots here slotted offers would get ``__dict__`` from this class
+    __slots__ = ()
+
+    original_id = Field()
+    price = Field()
+    name = Field()
+    category_id = Field()
+    url = Field()
+    available = Field()
+
+
+class Offer(OfferFields):
+    pass
+
+
+class SlottedOffer(OfferFields):
+    SLOTTED = True
+
+
+def fill(kls, num: int) -> list:
+    items = []
+    for i in range(num):
+        payload = kls()
+        payload["original_id"] = i
+        payload["price"] = 1.5
+        payload["name"] = "Offer name"
+        payload["category_id"] = 3
+        payload["url"] = "http://example.com/"
+        payload["available"] = True
+        items.append(payload)
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", dest="num", type=int, default=200000, help="Number of payloads")
+    args = parser.parse_args()
+
+    print("{:<14} {:>10} {:>10} {:>12} {:>9}".format("payload", "bytes", "fill us", "as_dict us", "__dict__"))
+    for kls in (Offer, SlottedOffer):
+        tracemalloc.start()
+        started = time.perf_counter()
+        items = fill(kls, args.num)
+        fill_time = time.perf_counter() - started
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        started = time.perf_counter()
+        for payload in items:
+            payload.as_dict
+        as_dict_time = time.perf_counter() - started
+        print("{:<14} {:>10.0f} {:>10.2f} {:>12.2f} {:>9}".format(
+            kls.__name__, memory / args.num, fill_time / args.num * 1e6, as_dict_time / args.num * 1e6,
+            "yes" if hasattr(items[0], "__dict__") else "no",
+        ))
+        del items
+
+
+if __name__ == "__main__":
+    main()
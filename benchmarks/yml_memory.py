@@ -0,0 +1,55 @@
+"""
+Check, that memory used for YML parsing doesn't grow with the size of the feed.
+
+    python benchmarks/yml_memory.py --small 10000 --large 500000 --max-growth 10
+
+Peak RSS of parsing the large feed is compared with the small one, every run in a fresh
+process. Exit status is 1, if it grows more than ``--max-growth`` megabytes for any engine.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from feeds import write_feed
+from yml_parsers import parse, run_isolated
+
+from aeroport.ymlparsers import PARSER_ENGINES, lxml_etree
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--small", type=int, default=10000, help="Number of offers in small feed")
+    parser.add_argument("--large", type=int, default=500000, help="Number of offers in large feed")
+    parser.add_argument("--max-growth", type=float, default=10, help="Allowed growth of peak RSS, MB")
+    args = parser.parse_args()
+    engines = [name for name in sorted(PARSER_ENGINES) if name != "lxml" or lxml_etree is not None]
+
+    tmp_dir = tempfile.mkdtemp()
+    failed = []
+    try:
+        small_file = os.path.join(tmp_dir, "small.yml")
+        large_file = os.path.join(tmp_dir, "large.yml")
+        write_feed(small_file, args.small)
+        write_feed(large_file, args.large)
+        print("{:<8} {:>10} {:>10} {:>8}".format("engine", "small MB", "large MB", "growth"))
+        for engine in engines:
+            _, _, small_rss = run_isolated(parse, small_file, engine)
+            _, _, large_rss = run_isolated(parse, large_file, engine)
+            growth = large_rss - small_rss
+            print("{:<8} {:>10.1f} {:>10.1f} {:>8.1f}".format(engine, small_rss, large_rss, growth))
+            if growth > args.max_growth:
+                failed.append(engine)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if failed:
+        print("FAIL: memory grows with feed size for {}".format(", ".join(failed)))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
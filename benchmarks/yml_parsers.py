@@ -0,0 +1,62 @@
+"""
+Speed and peak memory of YML parser engines on feeds of different size.
+
+    python benchmarks/yml_parsers.py -n 10000 -n 1000000
+
+Every run is made in a fresh process, so that peak RSS of one run doesn't hide the next one.
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+from feeds import FeedOrigin, write_feed
+
+from aeroport.ymlparsers import PARSER_ENGINES, lxml_etree
+
+
+def parse(feed_file: str, engine: str):
+    origin = FeedOrigin(parser_engine=engine)
+    started = time.perf_counter()
+    count = 0
+    for _ in origin.parse_feed(feed_file):
+        count += 1
+    elapsed = time.perf_counter() - started
+    # Kilobytes on Linux
+    return count, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_isolated(func, *args):
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", dest="sizes", type=int, action="append", help="Number of offers in feed")
+    args = parser.parse_args()
+    sizes = args.sizes or [10000, 1000000]
+    engines = [name for name in sorted(PARSER_ENGINES) if name != "lxml" or lxml_etree is not None]
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print("{:>9} {:<8} {:>10} {:>12}".format("offers", "engine", "items/s", "peak RSS MB"))
+        for size in sizes:
+            feed_file = os.path.join(tmp_dir, "feed_{}.yml".format(size))
+            write_feed(feed_file, size)
+            for engine in engines:
+                count, elapsed, peak_rss = run_isolated(parse, feed_file, engine)
+                print("{:>9} {:<8} {:>10.0f} {:>12.1f}".format(size, engine, count / elapsed, peak_rss))
+            os.remove(feed_file)
+    finally:
+        shutil.rmtree(tmp_dir)
+    if lxml_etree is None:
+        print("lxml is skipped, 'lxml' package is not installed")
+
+
+if __name__ == "__main__":
+    main()
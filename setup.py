@@ -50,6 +50,17 @@ setup(
         "sunhead",
         "splinter",
     ],
+    extras_require={
+        "speedups": [
+            "lxml",
+            "msgpack",
+            "numpy",
+            "orjson",
+            "psutil",
+            "xxhash",
+            "zstandard",
+        ],
+    },
     entry_points={
         'console_scripts': [
             'aeroport = aeroport.__main__:main',
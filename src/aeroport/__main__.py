@@ -5,15 +5,17 @@ Entry point for the application.
 from sunhead.cli.commands.runserver import Runserver
 from sunhead.cli.entrypoint import main as sunhead_main
 
-from aeroport.cli.commands import Airlines, Origins, Process, InitDB
+from aeroport.cli.commands import Airlines, Origins, Process, InitDB, Migrate, Worker
 
 
 commands = (
     Runserver("aeroport.web.server.AeroportHTTPServer"),
     InitDB(),
+    Migrate(),
     Airlines(),
     Origins(),
     Process(),
+    Worker(),
 )
 
 
@@ -6,7 +6,7 @@ Payload abstractions taken from Scrapy projects.
 
 from abc import ABCMeta, abstractmethod
 from collections import namedtuple, MutableMapping, AsyncIterable
-from typing import Tuple, Sequence, Optional, Dict
+from typing import List, Tuple, Sequence, Optional, Dict
 
 from sunhead.conf import settings
 from sunhead.utils import get_submodule_list, get_class_by_path
@@ -23,6 +23,67 @@ class AbstractField(dict):
     pass
 
 
+class SlottedItemMixin(object):
+    """
+    Mapping methods for payloads, which keep field values in ``__slots__`` instead of the dict.
+    ``InheritableFieldsMeta`` mixes it into every payload class with ``SLOTTED = True``.
+    Unset slot means missing field.
+    """
+
+    __slots__ = ()
+
+    SLOT_PREFIX = "_f_"
+    _slot_members = {}
+    _slot_getters = {}
+    _slot_setters = {}
+
+    def __init__(self, *args, **kwargs):
+        if args or kwargs:
+            for k, v in dict(*args, **kwargs).items():
+                self[k] = v
+
+    def __getitem__(self, key):
+        try:
+            return self._slot_getters[key](self)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            setter = self._slot_setters[key]
+        except KeyError:
+            raise KeyError("%s does not support field: %s" %
+                (self.__class__.__name__, key))
+        setter(self, value)
+
+    def __delitem__(self, key):
+        try:
+            self._slot_members[key].__delete__(self)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __len__(self):
+        return len(self.as_dict)
+
+    def __iter__(self):
+        return iter(self.as_dict)
+
+    keys = MutableMapping.keys
+
+    def __reduce__(self):
+        return self.__class__, (self.as_dict, )
+
+    @property
+    def as_dict(self):
+        values = {}
+        for name, getter in self._slot_getters.items():
+            try:
+                values[name] = getter(self)
+            except AttributeError:
+                pass
+        return values
+
+
 class InheritableFieldsMeta(ABCMeta):
     # This was ItemMeta from Scrapy
 
@@ -42,12 +103,42 @@ class InheritableFieldsMeta(ABCMeta):
 
         new_attrs['fields'] = fields
         new_attrs['_class'] = _class
-        return super().__new__(mcs, class_name, bases, new_attrs)
+
+        slotted = getattr(_class, 'SLOTTED', False)
+        if slotted:
+            bases = mcs._add_field_slots(bases, new_attrs, fields)
+
+        cls = super().__new__(mcs, class_name, bases, new_attrs)
+
+        if slotted:
+            cls._slot_members = {
+                name: getattr(cls, SlottedItemMixin.SLOT_PREFIX + name) for name in fields
+            }
+            cls._slot_getters = {name: member.__get__ for name, member in cls._slot_members.items()}
+            cls._slot_setters = {name: member.__set__ for name, member in cls._slot_members.items()}
+        return cls
+
+    @staticmethod
+    def _add_field_slots(bases, new_attrs, fields):
+        """
+        Declare slots for fields, that are not in base classes slots yet, and put
+        ``SlottedItemMixin`` to the class bases if it is not there.
+        """
+        slot_names = (SlottedItemMixin.SLOT_PREFIX + name for name in fields)
+        new_attrs['__slots__'] = tuple(
+            slot_name for slot_name in slot_names
+            if not any(hasattr(base, slot_name) for base in bases)
+        )
+        if not any(issubclass(base, SlottedItemMixin) for base in bases):
+            bases = (SlottedItemMixin, ) + tuple(bases)
+        return bases
 
 
 class DictItem(MutableMapping):
     # This was DictItem from Scrapy
 
+    __slots__ = ("_values", )
+
     fields = {}
 
     def __init__(self, *args, **kwargs):
@@ -94,6 +185,16 @@ class DictItem(MutableMapping):
 
 
 class AbstractPayload(DictItem, metaclass=InheritableFieldsMeta):
+    """
+    Set ``SLOTTED = True`` in payload class to keep its values in per-field slots instead
+    of the dict. It takes less memory and is faster to fill, but ``as_dict`` will build new
+    dict on every call. Payload has no ``__dict__`` only if its base payload classes are slotted
+    too, or declare ``__slots__ = ()``.
+    """
+
+    __slots__ = ()
+
+    SLOTTED = False
 
     @property
     def as_dict(self):
@@ -117,18 +218,46 @@ class AbstractDestination(object, metaclass=ABCMeta):
     async def process_payload(self, payload: AbstractPayload) -> None:
         pass
 
+    async def process_batch(self, batch: "aeroport.payload.PayloadBatch") -> None:
+        """
+        Process payloads collected column-wise. Destinations, that can consume columns or rows
+        directly, should override this, default one makes payloads one by one.
+        """
+        for payload in batch.iter_payloads():
+            await self.process_payload(payload)
+
+    @property
+    def ready(self) -> bool:
+        """
+        Whether destination is able to accept payloads right now.
+        """
+        return True
+
 
 class AbstractOrigin(object, metaclass=ABCMeta):
 
     def __init__(self, airline):
         self._destination = None
+        self._destination_prepared = False
         self._airline = airline
         self._settings = None
 
     async def set_destination(self, class_path: str, **init_kwargs):
         kls = get_class_by_path(class_path)
         self._destination = kls(**init_kwargs)
+        self._destination_prepared = False
         await self._destination.prepare()
+        self._destination_prepared = True
+
+    async def release_destination(self):
+        """
+        Release destination, that was prepared by ``set_destination``. Default destination
+        is not prepared by the origin, so it is not released either.
+        """
+        if not self._destination_prepared:
+            return
+        self._destination_prepared = False
+        await self._destination.release()
 
     def set_options(self, **options):
         """
@@ -164,6 +293,11 @@ class AbstractOrigin(object, metaclass=ABCMeta):
             raise ValueError("You must set destination first")
         await self.destination.process_payload(payload)
 
+    async def send_batch_to_destination(self, batch: "aeroport.payload.PayloadBatch"):
+        if self.destination is None:
+            raise ValueError("You must set destination first")
+        await self.destination.process_batch(batch)
+
     @property
     async def settings(self) -> Dict:
         if self._settings is None:
@@ -210,9 +344,12 @@ class AbstractAirline(object, metaclass=ABCMeta):
         result = tuple(origins)
         return result
 
-    def get_origin(self, origin_name) -> AbstractOrigin:
+    def get_origin_class(self, origin_name) -> type:
         origin_class_path = "{}.{}.Origin".format(self.origins_mount_point, origin_name)
-        kls = get_class_by_path(origin_class_path)
+        return get_class_by_path(origin_class_path)
+
+    def get_origin(self, origin_name) -> AbstractOrigin:
+        kls = self.get_origin_class(origin_name)
         origin = kls(airline=self)
         return origin
 
@@ -255,6 +392,30 @@ class AbstractUrlGenerator(AsyncIterable):
     async def __anext__(self) -> UrlInfo:
         pass
 
+    def mark_done(self, url_info: UrlInfo):
+        """
+        Called when the page from url is processed. Generators with state can remember it.
+        """
+
+    def mark_failed(self, url_info: UrlInfo):
+        """
+        Called when url could not be downloaded. It can be marked done later, if it succeeds on retry.
+        """
+
+    def add(self, url: str, priority: int = 0, kwargs: Optional[Dict] = None) -> bool:
+        """
+        Called with urls, that adapters found on the pages. Generators, that can visit them,
+        add them to their queue.
+
+        :return: Whether url was added.
+        """
+        return False
+
+    async def close(self):
+        """
+        Release resources, held by generator.
+        """
+
 
 class AbstractItemAdapter(object, metaclass=ABCMeta):
 
@@ -262,6 +423,29 @@ class AbstractItemAdapter(object, metaclass=ABCMeta):
         raw_items = self.extract_raw_items_from_html(html)
         return map(self.adapt_raw_item, raw_items)
 
+    def extract_payload_tuples(self, html) -> List[Tuple[type, Dict]]:
+        """
+        Payloads from the page as ``(payload_class, values)`` tuples, which are cheap to pass
+        between processes. Adapter must be picklable to be used this way.
+        """
+        return [
+            (payload.__class__, payload.as_dict)
+            for payload in self.gen_payload_from_html(html) if payload is not None
+        ]
+
+    def extract_links_from_html(self, html) -> Sequence:
+        """
+        Urls to visit, found on the page, as strings or ``UrlInfo``. They are added to the
+        scheme's url generator, if it can take them.
+        """
+        return []
+
+    def extract_from_html(self, html) -> Tuple[List[Tuple[type, Dict]], List]:
+        """
+        Payload tuples and links of the page at once, to be called in another process.
+        """
+        return self.extract_payload_tuples(html), list(self.extract_links_from_html(html))
+
     @abstractmethod
     def extract_raw_items_from_html(self, html) -> Sequence:
         return []
@@ -275,3 +459,15 @@ class AbstractDownloader(object, metaclass=ABCMeta):
     @abstractmethod
     async def get_html_from_url(self, url: str) -> str:
         pass
+
+    @property
+    def fetch_concurrency(self) -> int:
+        """
+        How many urls this downloader can fetch at the same time.
+        """
+        return 1
+
+    async def close(self):
+        """
+        Release resources, held by downloader.
+        """
@@ -4,12 +4,12 @@ Example origin. Will scrape repo list from configured user.
 
 from asyncio import ensure_future
 
-import aiohttp
 from bs4 import BeautifulSoup
 
 from aeroport.abc import AbstractOrigin
 from aeroport.airlines.air_example.payload import Repo
 from aeroport.destinations.console import ConsoleDestination
+from aeroport.httpclient import get_http_client
 
 
 START_PAGE = "https://github.com/anti1869?tab=repositories"
@@ -21,7 +21,7 @@ class Origin(AbstractOrigin):
         return ConsoleDestination()
 
     async def process(self):
-        async with aiohttp.get(START_PAGE) as response:
+        async with get_http_client().session.get(START_PAGE) as response:
             assert response.status == 200
             data = await response.read()
 
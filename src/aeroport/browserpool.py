@@ -0,0 +1,216 @@
+"""
+Pool of long-lived scriptable browsers. Starting PhantomJS takes seconds, so browsers are
+reused for many pages and replaced only when they are broken, served too many pages, or
+grew too much in memory.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class BrowserPoolError(Exception):
+    pass
+
+
+class PooledBrowser(object):
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.pages = 0
+        self.base_memory = get_browser_memory(browser)
+
+
+def get_browser_pid(browser) -> Optional[int]:
+    # Splinter browser -> selenium driver -> driver service process
+    try:
+        return browser.driver.service.process.pid
+    except AttributeError:
+        return None
+
+
+def get_browser_memory(browser) -> Optional[int]:
+    """
+    Resident memory of the browser process in bytes, if ``psutil`` is installed.
+    """
+    if psutil is None:
+        return None
+    pid = get_browser_pid(browser)
+    if pid is None:
+        return None
+    try:
+        return psutil.Process(pid).memory_info().rss
+    except psutil.Error:
+        return None
+
+
+class BrowserPool(object):
+    """
+    Up to ``size`` browsers, created by ``factory`` on demand. Work with the browser is done
+    with ``run(func)``, which must be called in the pool's ``executor`` (it blocks).
+    Optional ``health_check(browser)`` can reject browsers in addition to built-in check.
+
+    When all browsers are busy, ``run`` waits for one up to ``wait_timeout`` seconds. If
+    browser can't be started meanwhile, waiting ones fail too, instead of waiting in vain.
+    """
+
+    MAX_PAGES = 200
+    MAX_MEMORY_GROWTH = 256 * 1024 * 1024  # Checked only if psutil is installed
+    WAIT_TIMEOUT = 60
+    WAIT_INTERVAL = 1  # How often waiting ones check for failures and free slots
+
+    def __init__(self, factory: Callable, size: int, max_pages: int = MAX_PAGES,
+                 max_memory_growth: int = MAX_MEMORY_GROWTH, health_check: Optional[Callable] = None,
+                 wait_timeout: float = WAIT_TIMEOUT):
+        self._factory = factory
+        self._health_check = health_check
+        self._size = size
+        self._max_pages = max_pages
+        self._max_memory_growth = max_memory_growth
+        self._wait_timeout = wait_timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._num_created = 0
+        self._num_failures = 0
+        self._last_failure = None
+        self._closed = False
+        self.executor = ThreadPoolExecutor(max_workers=size)
+
+    def run(self, func: Callable):
+        """
+        Call ``func(browser)`` with checked out browser and return its result.
+        """
+        entry = self.checkout()
+        try:
+            return func(entry.browser)
+        finally:
+            entry.pages += 1
+            self.checkin(entry)
+
+    def checkout(self) -> PooledBrowser:
+        while True:
+            if self._closed:
+                raise BrowserPoolError("Browser pool is closed")
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                entry = self._create_or_wait()
+            if self.is_healthy(entry.browser):
+                return entry
+            logger.warning("Browser is not responding, replacing it")
+            self._discard(entry)
+
+    def _create_or_wait(self) -> PooledBrowser:
+        num_failures = self._num_failures
+        deadline = time.monotonic() + self._wait_timeout
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise BrowserPoolError("Browser pool is closed")
+                can_create = self._num_created < self._size
+                if can_create:
+                    self._num_created += 1
+            if can_create:
+                return self._start_browser()
+            try:
+                return self._idle.get(timeout=max(min(self.WAIT_INTERVAL, deadline - time.monotonic()), 0))
+            except queue.Empty:
+                pass
+            if self._num_failures != num_failures:
+                raise BrowserPoolError("Can't start browser") from self._last_failure
+            if self._closed:
+                raise BrowserPoolError("Browser pool is closed")
+            if time.monotonic() >= deadline:
+                raise BrowserPoolError("No browser is available in {} seconds".format(self._wait_timeout))
+
+    def _start_browser(self) -> PooledBrowser:
+        """
+        Start browser in the slot, that is already taken in ``_num_created``. Browser, that
+        started when the pool was closed meanwhile, quits at once.
+        """
+        try:
+            entry = PooledBrowser(self._factory())
+        except Exception as e:
+            with self._lock:
+                self._num_created -= 1
+                self._num_failures += 1
+                self._last_failure = e
+            raise
+        if self._closed:
+            self._discard(entry)
+            raise BrowserPoolError("Browser pool is closed")
+        return entry
+
+    def checkin(self, entry: PooledBrowser):
+        if self._closed:
+            self._discard(entry)
+        elif self.needs_recycling(entry):
+            logger.debug("Recycling browser after %s pages", entry.pages)
+            self._discard(entry)
+        else:
+            self._idle.put(entry)
+
+    def is_healthy(self, browser) -> bool:
+        try:
+            browser.url
+        except Exception:
+            return False
+        return self._health_check is None or self._health_check(browser)
+
+    def needs_recycling(self, entry: PooledBrowser) -> bool:
+        if self._max_pages and entry.pages >= self._max_pages:
+            return True
+        if entry.base_memory is not None and self._max_memory_growth:
+            memory = get_browser_memory(entry.browser)
+            if memory is not None and memory - entry.base_memory > self._max_memory_growth:
+                return True
+        return False
+
+    def _discard(self, entry: PooledBrowser):
+        with self._lock:
+            self._num_created -= 1
+        try:
+            entry.browser.quit()
+        except Exception:
+            logger.warning("Can't quit browser", exc_info=True)
+        # Somebody may wait for idle browser, while there is room for new one now
+        if not self._closed:
+            self._wake_waiter()
+
+    def _wake_waiter(self):
+        with self._lock:
+            if self._closed or self._num_created >= self._size:
+                return
+            self._num_created += 1
+        try:
+            entry = self._start_browser()
+        except Exception:
+            logger.warning("Can't start browser", exc_info=True)
+            return
+        self._idle.put(entry)
+
+    def close(self):
+        """
+        Quit all browsers. Browsers, that are in use now, quit when they are returned,
+        and no new ones are started.
+        """
+        with self._lock:
+            self._closed = True
+        self.executor.shutdown(wait=False)
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(entry)
@@ -0,0 +1,72 @@
+"""
+Checkpoints of long feed processing, so that restarted flight can continue where the
+previous one stopped instead of starting from the first item.
+"""
+
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+from aeroport.utils import json_dumps_bytes
+
+
+logger = logging.getLogger(__name__)
+
+
+class FeedCheckpoint(object):
+    """
+    Processing state of one feed file, kept in JSON file. Checkpoint is valid only for
+    the same feed file (its size and modification time are stored along), as items are
+    resumed by their position in the file.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str, feed_file: str):
+        self._path = path
+        stat = os.stat(feed_file)
+        self._feed_stat = [stat.st_size, stat.st_mtime]
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def load(self) -> Optional[Dict]:
+        if not os.path.isfile(self._path):
+            return None
+
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logger.warning("Can't read checkpoint %s, ignoring it", self._path, exc_info=True)
+            return None
+
+        if data.get("version") != self.VERSION or data.get("feed_stat") != self._feed_stat:
+            logger.info("Checkpoint %s was made for another feed file, ignoring it", self._path)
+            return None
+        return data["state"]
+
+    def save(self, state: Dict):
+        """
+        Atomically replace checkpoint with the new state.
+        """
+        dirname = os.path.dirname(self._path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        data = {
+            "version": self.VERSION,
+            "feed_stat": self._feed_stat,
+            "state": state,
+        }
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json_dumps_bytes(data))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path)
+
+    def remove(self):
+        if os.path.isfile(self._path):
+            os.remove(self._path)
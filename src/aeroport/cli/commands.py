@@ -4,6 +4,7 @@ Command line interface commands, available in this app.
 
 import argparse
 import asyncio
+import signal
 from typing import Any
 import logging
 
@@ -34,6 +35,8 @@ class InitDB(Command):
     def handler(self, options) -> None:
         """Drop and create tables"""
         from aeroport.db import create_tables, drop_tables, get_all_models
+        from aeroport.dispatch import FlightRecord
+        from aeroport.worker import migrate
         all_models = get_all_models()
         names = set(options["tables"].lower().split(","))
         selected_models = all_models if options["tables"].lower() == "all" \
@@ -41,6 +44,9 @@ class InitDB(Command):
 
         drop_tables(models=selected_models)
         create_tables(models=selected_models)
+        if FlightRecord in selected_models:
+            # Partial index of the flight queue can't be declared on the model
+            migrate()
 
     def get_parser(self):
         parser_command = argparse.ArgumentParser(description=self.handler.__doc__)
@@ -52,6 +58,20 @@ class InitDB(Command):
         return parser_command
 
 
+class Migrate(Command):
+    """
+    Update existing tables to the current models.
+    """
+
+    def handler(self, options) -> None:
+        """Add flight queue columns and indexes to existing flight records table"""
+        from aeroport.worker import migrate
+        migrate()
+
+    def get_parser(self):
+        return super().get_parser()
+
+
 class Airlines(Command):
     """
     List airlines, registered with this aeroport installation.
@@ -104,10 +124,18 @@ class Process(RunInLoopMixin, Command):
         # TODO: Better DB handling
 
         loop = asyncio.get_event_loop()
-        loop.run_until_complete(self._handler(options))
+        try:
+            loop.run_until_complete(self._handler(options))
+        except KeyboardInterrupt:
+            from aeroport.dispatch import get_flight_supervisor
+            from aeroport.httpclient import close_http_client
+            logger.warning("Interrupted, stopping the flight")
+            get_flight_supervisor().add_shutdown_hook(close_http_client)
+            loop.run_until_complete(get_flight_supervisor().shutdown())
 
     async def _handler(self, options):
         from aeroport.dispatch import process_origin, ProcessingException
+        from aeroport.httpclient import close_http_client
 
         try:
             origin_options = json.loads(options["options"]) if options["options"] else {}
@@ -123,6 +151,8 @@ class Process(RunInLoopMixin, Command):
             )
         except ProcessingException:
             quit(-1)
+        finally:
+            await close_http_client()
 
     def get_parser(self):
         parser_command = argparse.ArgumentParser(description=self.handler.__doc__)
@@ -149,3 +179,41 @@ class Process(RunInLoopMixin, Command):
             help="Origin processing options in JSON",
         )
         return parser_command
+
+
+class Worker(Command):
+    """
+    Run flights from the shared queue (distributed mode).
+    """
+
+    def handler(self, options) -> None:
+        """Run queued flights until stopped"""
+
+        from aeroport.dispatch import get_flight_supervisor
+        from aeroport.httpclient import close_http_client
+        from aeroport.worker import FlightWorker
+
+        overrides = {"concurrency": options["concurrency"]} if options.get("concurrency") else {}
+        worker = FlightWorker.from_settings(**overrides)
+        loop = asyncio.get_event_loop()
+        loop.add_signal_handler(signal.SIGTERM, worker.stop)
+        task = asyncio.ensure_future(worker.run())
+        try:
+            loop.run_until_complete(task)
+        except KeyboardInterrupt:
+            logger.warning("Interrupted, stopping the worker")
+            worker.stop()
+            loop.run_until_complete(task)
+        finally:
+            get_flight_supervisor().add_shutdown_hook(close_http_client)
+            loop.run_until_complete(get_flight_supervisor().shutdown())
+
+    def get_parser(self):
+        parser_command = argparse.ArgumentParser(description=self.handler.__doc__)
+        parser_command.add_argument(
+            "-c",
+            dest="concurrency",
+            type=int,
+            help="How many flights to run at once",
+        )
+        return parser_command
@@ -0,0 +1,248 @@
+"""
+Payload codecs. Turn payloads to bytes and back, so that they can be stored or sent
+somewhere and restored to the same payload classes by consumers.
+
+Codecs available by name:
+
+* ``json`` - ``[class path, payload.as_dict]`` as JSON;
+* ``msgpack`` - the same structure in msgpack (requires ``msgpack``);
+* ``schema`` - positional encoding, derived from payload ``fields``. Message carries only
+  schema id, bitmap of present fields and values, without any keys. Packed with msgpack
+  when it is installed, JSON array otherwise.
+"""
+
+from abc import ABCMeta, abstractmethod
+from collections import namedtuple
+import json
+import zlib
+from typing import Dict, Iterable, Iterator, Optional
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from sunhead.serializers.json import JSONSerializer
+from sunhead.utils import get_class_by_path
+
+from aeroport.abc import AbstractPayload
+from aeroport.payload import MISSING, PayloadBatch
+from aeroport.utils import json_dumps_bytes
+
+
+PayloadSchema = namedtuple("PayloadSchema", "id payload_class fields")
+
+
+def get_class_path(kls: type) -> str:
+    return "{}.{}".format(kls.__module__, kls.__name__)
+
+
+def _msgpack_default(obj):
+    # Reuse the same conversions for non-standard types, as JSON serialization does
+    return JSONSerializer.json_serial(obj)
+
+
+def _pack(data) -> bytes:
+    if msgpack is not None:
+        return msgpack.packb(data, use_bin_type=True, default=_msgpack_default)
+    return json_dumps_bytes(data)
+
+
+def _unpack(data: bytes):
+    # JSON array always starts with "[", which is never the first byte of msgpack array
+    if data[:1] == b"[":
+        return json.loads(data.decode("utf-8"))
+    if msgpack is None:
+        raise ValueError("Data is packed with msgpack, which is not installed")
+    return msgpack.unpackb(data, raw=False)
+
+
+class AbstractPayloadCodec(object, metaclass=ABCMeta):
+
+    name = None
+
+    def __init__(self):
+        self._classes = {}
+
+    def get_payload_class(self, class_path: str) -> type:
+        kls = self._classes.get(class_path, None)
+        if kls is None:
+            kls = self._classes[class_path] = get_class_by_path(class_path)
+        return kls
+
+    @abstractmethod
+    def encode(self, payload: AbstractPayload) -> bytes:
+        pass
+
+    @abstractmethod
+    def decode(self, data: bytes) -> AbstractPayload:
+        pass
+
+    def encode_batch(self, batch: PayloadBatch) -> Iterator[bytes]:
+        for payload in batch.iter_payloads():
+            yield self.encode(payload)
+
+
+class JSONCodec(AbstractPayloadCodec):
+
+    name = "json"
+
+    def encode(self, payload: AbstractPayload) -> bytes:
+        return json_dumps_bytes([get_class_path(payload.__class__), payload.as_dict])
+
+    def decode(self, data: bytes) -> AbstractPayload:
+        class_path, values = json.loads(data.decode("utf-8"))
+        return self.get_payload_class(class_path)(values)
+
+    def encode_batch(self, batch: PayloadBatch) -> Iterator[bytes]:
+        class_path = get_class_path(batch.payload_class)
+        for values in batch.iter_values():
+            yield json_dumps_bytes([class_path, values])
+
+
+class MsgpackCodec(AbstractPayloadCodec):
+
+    name = "msgpack"
+
+    def __init__(self):
+        super().__init__()
+        if msgpack is None:
+            raise ValueError("msgpack codec requires 'msgpack' package installed")
+
+    def encode(self, payload: AbstractPayload) -> bytes:
+        return msgpack.packb(
+            [get_class_path(payload.__class__), payload.as_dict], use_bin_type=True, default=_msgpack_default
+        )
+
+    def decode(self, data: bytes) -> AbstractPayload:
+        class_path, values = msgpack.unpackb(data, raw=False)
+        return self.get_payload_class(class_path)(values)
+
+
+class SchemaCodec(AbstractPayloadCodec):
+    """
+    Schema id is crc32 of the payload class path and its sorted field names, so it is the same
+    in every process, and changes whenever payload fields change. Decoder finds schema among
+    registered payload classes, or among all payload classes imported in its process.
+    """
+
+    name = "schema"
+
+    def __init__(self, payload_classes: Iterable[type] = ()):
+        super().__init__()
+        self._schemas = {}
+        self._schemas_by_id = {}
+        for kls in payload_classes:
+            self.register(kls)
+
+    def register(self, payload_class: type) -> PayloadSchema:
+        fields = tuple(sorted(payload_class.fields))
+        signature = "{}:{}".format(get_class_path(payload_class), ",".join(fields))
+        schema = PayloadSchema(
+            id=zlib.crc32(signature.encode("utf-8")),
+            payload_class=payload_class,
+            fields=fields,
+        )
+        self._schemas[payload_class] = schema
+        self._schemas_by_id[schema.id] = schema
+        return schema
+
+    def get_schema(self, payload_class: type) -> PayloadSchema:
+        schema = self._schemas.get(payload_class, None)
+        if schema is None:
+            schema = self.register(payload_class)
+        return schema
+
+    def _find_schema(self, schema_id: int) -> PayloadSchema:
+        schema = self._schemas_by_id.get(schema_id, None)
+        if schema is not None:
+            return schema
+
+        # Register everything that is imported by now and look again
+        subclasses = list(AbstractPayload.__subclasses__())
+        while subclasses:
+            kls = subclasses.pop()
+            subclasses.extend(kls.__subclasses__())
+            if kls not in self._schemas:
+                self.register(kls)
+
+        try:
+            return self._schemas_by_id[schema_id]
+        except KeyError:
+            raise ValueError("Unknown payload schema {}. Is payload module imported?".format(schema_id))
+
+    def encode_values(self, payload_class: type, values: Dict) -> bytes:
+        schema = self.get_schema(payload_class)
+        row = [schema.id, 0]
+        presence = 0
+        for bit, name in enumerate(schema.fields):
+            if name in values:
+                presence |= 1 << bit
+                row.append(values[name])
+        row[1] = presence
+        return _pack(row)
+
+    def encode(self, payload: AbstractPayload) -> bytes:
+        return self.encode_values(payload.__class__, payload.as_dict)
+
+    def encode_batch(self, batch: PayloadBatch) -> Iterator[bytes]:
+        # Batch columns are in the same sorted order, as schema fields
+        schema = self.get_schema(batch.payload_class)
+        for row in batch.iter_rows():
+            presence = 0
+            values = [schema.id, 0]
+            for bit, value in enumerate(row):
+                if value is not MISSING:
+                    presence |= 1 << bit
+                    values.append(value)
+            values[1] = presence
+            yield _pack(values)
+
+    def decode(self, data: bytes) -> AbstractPayload:
+        row = _unpack(data)
+        schema = self._find_schema(row[0])
+        presence = row[1]
+        names = (name for bit, name in enumerate(schema.fields) if presence & (1 << bit))
+        return schema.payload_class(zip(names, row[2:]))
+
+
+CODECS = {
+    kls.name: kls for kls in (JSONCodec, MsgpackCodec, SchemaCodec)
+}
+
+
+def get_codec(name: Optional[str]) -> AbstractPayloadCodec:
+    """
+    Instantiate codec by its name or by full class path. Default codec is ``json``.
+    """
+    name = name or JSONCodec.name
+    kls = CODECS.get(name, None)
+    if kls is None:
+        kls = get_class_by_path(name)
+    return kls()
+
+
+MESSAGE_SEPARATOR = b"\0"
+
+
+def wrap_message(codec: AbstractPayloadCodec, data: bytes) -> bytes:
+    """
+    Message for transports, that carry bytes: codec name, zero byte, then encoded payload.
+    """
+    return codec.name.encode("ascii") + MESSAGE_SEPARATOR + data
+
+
+def encode_message(codec: AbstractPayloadCodec, payload: AbstractPayload) -> bytes:
+    return wrap_message(codec, codec.encode(payload))
+
+
+def decode_message(message: bytes, codecs: Optional[Dict[str, AbstractPayloadCodec]] = None) -> AbstractPayload:
+    """
+    Restore payload from the message, made by ``encode_message``.
+    """
+    name, _, data = bytes(message).partition(MESSAGE_SEPARATOR)
+    name = name.decode("ascii")
+    codec = codecs.get(name) if codecs is not None else None
+    if codec is None:
+        codec = get_codec(name)
+    return codec.decode(data)
@@ -0,0 +1,187 @@
+"""
+Change detection between runs of the same feed. Keeps compact on-disk index of
+``original_id -> content hash`` and tells which payloads are new or changed since the
+previous run, and which ids disappeared.
+"""
+
+from array import array
+from bisect import bisect_left
+import hashlib
+import heapq
+import logging
+from operator import itemgetter
+import os
+import struct
+from typing import Dict, Iterable
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from aeroport.abc import AbstractPayload
+from aeroport.idset import IntIdSet, is_packable_id
+from aeroport.utils import json_dumps_bytes
+
+
+logger = logging.getLogger(__name__)
+
+
+INDEX_MAGIC = b"AFPI"
+INDEX_HEADER = struct.Struct("<4sBQ")  # magic, version, number of entries
+INDEX_VERSION = 1
+
+
+def values_fingerprint(values: Dict) -> int:
+    """
+    64-bit hash of the payload content. Key order does not matter.
+    """
+    data = json_dumps_bytes(values, sort_keys=True)
+    return int.from_bytes(hashlib.md5(data).digest()[:8], "little")
+
+
+def payload_fingerprint(payload: AbstractPayload) -> int:
+    return values_fingerprint(payload.as_dict)
+
+
+class DeltaTracker(object):
+    """
+    Compares payloads of the current run with fingerprints stored by previous one.
+    Ids must be non-negative integers (as produced by ``yml.get_attrib(..., cast_type=int)``).
+    Items with other ids are not tracked: they are always sent and never reported deleted.
+
+    Both previous and new index are kept as plain ``array`` of 64-bit integers, so memory
+    usage is about 32 bytes per item. New index replaces previous only on ``commit()``,
+    so failed run will be compared against the last successful one again.
+    """
+
+    SORT_CHUNK_SIZE = 65536
+
+    def __init__(self, path: str):
+        self._path = path
+        self._old_ids, self._old_hashes = self._load(path)
+        self._new_ids = array("Q")
+        self._new_hashes = array("Q")
+        self._carried_ids = array("Q")
+        self.num_changed = 0
+        self.num_untracked = 0
+
+    @staticmethod
+    def _load(path: str):
+        ids, hashes = array("Q"), array("Q")
+        if not os.path.isfile(path):
+            return ids, hashes
+
+        with open(path, "rb") as f:
+            magic, version, count = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                logger.warning("Unknown fingerprint index format in %s, ignoring it", path)
+                return array("Q"), array("Q")
+            ids.fromfile(f, count)
+            hashes.fromfile(f, count)
+        return ids, hashes
+
+    def _get_old_hash(self, original_id: int):
+        idx = bisect_left(self._old_ids, original_id)
+        if idx < len(self._old_ids) and self._old_ids[idx] == original_id:
+            return self._old_hashes[idx]
+        return None
+
+    def is_changed(self, original_id: int, payload: AbstractPayload) -> bool:
+        """
+        Remember payload fingerprint for the new index and tell whether it must be emitted.
+        """
+        return self.is_changed_values(original_id, payload.as_dict)
+
+    def is_changed_values(self, original_id: int, values: Dict) -> bool:
+        if not is_packable_id(original_id):
+            if not self.num_untracked:
+                logger.warning(
+                    "Delta needs non-negative 64-bit integer ids, got %r, such items are always sent. "
+                    "Cast ids with get_attrib(..., cast_type=int) in adapter", original_id
+                )
+            self.num_untracked += 1
+            return True
+        fingerprint = values_fingerprint(values)
+        self._new_ids.append(original_id)
+        self._new_hashes.append(fingerprint)
+        changed = self._get_old_hash(original_id) != fingerprint
+        if changed:
+            self.num_changed += 1
+        return changed
+
+    def mark_seen(self, original_ids: Iterable[int]):
+        """
+        Mark items as present in feed without checking their content. Their previous
+        fingerprints will be kept in the new index.
+        """
+        self._carried_ids.extend(original_id for original_id in original_ids if is_packable_id(original_id))
+
+    def get_deleted_ids(self) -> IntIdSet:
+        """
+        Ids from the previous run, which were not seen in this one.
+        """
+        seen = IntIdSet(self._new_ids)
+        seen.update(self._carried_ids)
+        return IntIdSet(original_id for original_id in self._old_ids if original_id not in seen)
+
+    @staticmethod
+    def _sort_unique(ids: array, hashes: array):
+        """
+        Sort both columns by id, keeping the last entry of the same id.
+        """
+        if not ids:
+            return ids, hashes
+        if numpy is not None:
+            np_ids = numpy.frombuffer(ids, dtype=numpy.uint64)
+            order = numpy.argsort(np_ids, kind="stable")
+            np_ids = np_ids[order]
+            last = numpy.append(np_ids[1:] != np_ids[:-1], True)
+            order = order[last]
+            return (
+                array("Q", np_ids[last].tobytes()),
+                array("Q", numpy.frombuffer(hashes, dtype=numpy.uint64)[order].tobytes()),
+            )
+
+        # Without numpy columns are sorted by chunks, which are merged then, so that only
+        # one chunk at a time is turned into python objects
+        runs = []
+        for start in range(0, len(ids), DeltaTracker.SORT_CHUNK_SIZE):
+            order = sorted(range(start, min(start + DeltaTracker.SORT_CHUNK_SIZE, len(ids))), key=ids.__getitem__)
+            runs.append(zip(array("Q", (ids[idx] for idx in order)), array("Q", (hashes[idx] for idx in order))))
+        sorted_ids, sorted_hashes = array("Q"), array("Q")
+        for original_id, fingerprint in heapq.merge(*runs, key=itemgetter(0)):
+            if sorted_ids and sorted_ids[-1] == original_id:
+                sorted_hashes[-1] = fingerprint
+            else:
+                sorted_ids.append(original_id)
+                sorted_hashes.append(fingerprint)
+        return sorted_ids, sorted_hashes
+
+    def commit(self):
+        """
+        Atomically replace index on disk with the new one.
+        """
+        # Carried entries go first, so that fingerprints of the same id from this run win
+        ids, hashes = array("Q"), array("Q")
+        for original_id in self._carried_ids:
+            fingerprint = self._get_old_hash(original_id)
+            if fingerprint is not None:
+                ids.append(original_id)
+                hashes.append(fingerprint)
+        ids.extend(self._new_ids)
+        hashes.extend(self._new_hashes)
+        ids, hashes = self._sort_unique(ids, hashes)
+
+        dirname = os.path.dirname(self._path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(ids)))
+            ids.tofile(f)
+            hashes.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path)
+        logger.info("Fingerprint index %s updated, %s entries", self._path, len(ids))
@@ -0,0 +1,224 @@
+"""
+Write payloads to local files as newline-delimited JSON (one ``payload.as_dict`` per line).
+
+Encoding happens on the event loop, but lines are grouped into big chunks and actual
+file writing (with optional compression) is done by the background thread, so the
+origin is almost never blocked by disk.
+"""
+
+import asyncio
+from datetime import datetime
+import gzip
+import logging
+import os
+import queue
+import threading
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from sunhead.conf import settings
+
+from aeroport.abc import AbstractDestination, AbstractPayload
+from aeroport.payload import PayloadBatch
+from aeroport.utils import json_dumps_bytes
+
+
+logger = logging.getLogger(__name__)
+
+
+class RotatingFileWriter(threading.Thread):
+    """
+    Thread, that takes chunks of bytes from the queue and writes them to the file. When
+    file grows over ``rotate_bytes`` (counted before compression), it is closed and
+    writing continues to the new one. File is named with ``.part`` suffix until it is closed,
+    and keeps it, if writing fails.
+    """
+
+    EXTENSIONS = {
+        None: ".ndjson",
+        "gzip": ".ndjson.gz",
+        "zstd": ".ndjson.zst",
+    }
+
+    def __init__(
+            self, chunks: queue.Queue, path: str, prefix: str, compression: Optional[str],
+            compression_level: Optional[int], rotate_bytes: int, buffer_bytes: int):
+
+        super().__init__(name="ndjson-writer-{}".format(prefix), daemon=True)
+        self._chunks = chunks
+        self._path = path
+        self._prefix = prefix
+        self._compression = compression
+        self._compression_level = compression_level
+        self._rotate_bytes = rotate_bytes
+        self._buffer_bytes = buffer_bytes
+        self._raw = None
+        self._stream = None
+        self._filename = None
+        self._written = 0
+        self._seq = 0
+        self.error = None
+
+    def run(self):
+        try:
+            while True:
+                chunk = self._chunks.get()
+                if chunk is None:
+                    break
+                self._write(chunk)
+            self._close_file()
+        except Exception as e:
+            logger.error("NDJSON writer failed", exc_info=True)
+            self.error = e
+            self._abandon_file()
+            # Keep consuming, so producer will not hang on the full queue
+            while self._chunks.get() is not None:
+                pass
+
+    def _write(self, chunk: bytes):
+        if self._stream is None:
+            self._open_file()
+        self._stream.write(chunk)
+        self._written += len(chunk)
+        if self._written >= self._rotate_bytes:
+            self._close_file()
+
+    def _open_file(self):
+        self._seq += 1
+        self._filename = os.path.join(self._path, "{}-{}-{:05d}{}".format(
+            self._prefix,
+            datetime.now().strftime("%Y%m%d%H%M%S"),
+            self._seq,
+            self.EXTENSIONS[self._compression],
+        ))
+        self._raw = open(self._filename + ".part", "wb", buffering=self._buffer_bytes)
+        if self._compression == "gzip":
+            level = self._compression_level if self._compression_level is not None else 6
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=level)
+        elif self._compression == "zstd":
+            level = self._compression_level if self._compression_level is not None else 3
+            self._stream = zstandard.ZstdCompressor(level=level).stream_writer(self._raw)
+        else:
+            self._stream = self._raw
+        self._written = 0
+        logger.info("Writing payloads to %s", self._filename)
+
+    def _close_file(self):
+        if self._stream is None:
+            return
+        self._stream.close()
+        if not self._raw.closed:
+            self._raw.close()
+        self._stream, self._raw = None, None
+        os.rename(self._filename + ".part", self._filename)
+
+    def _abandon_file(self):
+        # Compressed stream is not finished, so that truncated file doesn't look complete
+        if self._raw is None:
+            return
+        try:
+            self._raw.close()
+        except Exception:
+            logger.warning("Can't close %s.part", self._filename, exc_info=True)
+        self._stream, self._raw = None, None
+        logger.warning("Unfinished file is left as %s.part", self._filename)
+
+
+class NDJSONFileDestination(AbstractDestination):
+    """
+    Store payloads in local rotating NDJSON files. Example of destination settings::
+
+        {
+            "path": "/var/lib/aeroport/ndjson",
+            "prefix": "offers",
+            "compression": "zstd",
+            "rotate_bytes": 268435456
+        }
+
+    ``compression`` is one of ``null``, ``"gzip"`` or ``"zstd"`` (requires ``zstandard``).
+    """
+
+    DEFAULT_PREFIX = "aeroport"
+    DEFAULT_ROTATE_BYTES = 256 * 1024 * 1024
+    DEFAULT_BUFFER_BYTES = 4 * 1024 * 1024
+    CHUNK_BYTES = 512 * 1024
+    QUEUE_CHUNKS = 32
+
+    def __init__(self, **init_kwargs):
+        super().__init__(**init_kwargs)
+        self._loop = asyncio.get_event_loop()
+        self._chunks = queue.Queue(maxsize=self.QUEUE_CHUNKS)
+        self._writer = None
+        self._lines = []
+        self._lines_bytes = 0
+
+    async def prepare(self):
+        compression = self._init_kwargs.get("compression", None)
+        if compression not in RotatingFileWriter.EXTENSIONS:
+            raise ValueError("Unknown NDJSON compression '{}'".format(compression))
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstd compression requires 'zstandard' package installed")
+
+        path = self._init_kwargs.get("path", os.path.join(settings.DATA_DIR, "ndjson"))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self._writer = RotatingFileWriter(
+            chunks=self._chunks,
+            path=path,
+            prefix=self._init_kwargs.get("prefix", self.DEFAULT_PREFIX),
+            compression=compression,
+            compression_level=self._init_kwargs.get("compression_level", None),
+            rotate_bytes=int(self._init_kwargs.get("rotate_bytes", self.DEFAULT_ROTATE_BYTES)),
+            buffer_bytes=int(self._init_kwargs.get("buffer_bytes", self.DEFAULT_BUFFER_BYTES)),
+        )
+        self._writer.start()
+
+    async def release(self):
+        if self._writer is None:
+            return
+        writer = self._writer
+        try:
+            await self._flush()
+        finally:
+            await self._put_chunk(None)
+            await self._loop.run_in_executor(None, writer.join)
+            self._writer = None
+        if writer.error is not None:
+            raise writer.error
+
+    async def process_payload(self, payload: AbstractPayload):
+        line = json_dumps_bytes(payload.as_dict)
+        self._lines.append(line)
+        self._lines_bytes += len(line) + 1
+        if self._lines_bytes >= self.CHUNK_BYTES:
+            await self._flush()
+
+    async def process_batch(self, batch: PayloadBatch):
+        for values in batch.iter_values():
+            line = json_dumps_bytes(values)
+            self._lines.append(line)
+            self._lines_bytes += len(line) + 1
+        if self._lines_bytes >= self.CHUNK_BYTES:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._lines:
+            return
+        chunk = b"\n".join(self._lines) + b"\n"
+        self._lines = []
+        self._lines_bytes = 0
+        await self._put_chunk(chunk)
+
+    async def _put_chunk(self, chunk: Optional[bytes]):
+        if chunk is not None and self._writer.error is not None:
+            raise self._writer.error
+        try:
+            self._chunks.put_nowait(chunk)
+        except queue.Full:
+            # Disk or compression is slower than payloads arrive, wait without blocking the loop
+            await self._loop.run_in_executor(None, self._chunks.put, chunk)
@@ -0,0 +1,477 @@
+"""
+Durable write-ahead spool in front of another destination.
+
+Payloads are appended to segment files on local disk and acknowledged immediately, while
+the background task drains segments to the real destination, retrying until it accepts
+them. Segments and the drain cursor survive restarts, so undelivered payloads are sent
+after the process comes back.
+
+Writes are buffered: segment is flushed to the OS every ``flush_every`` payloads or
+``flush_interval`` seconds, and synced to disk every ``sync_interval`` seconds and when
+it is sealed. So crash of the process loses at most payloads of the last flush window,
+and crash of the host ones of the last sync window.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import struct
+from typing import List, Optional, Tuple
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from sunhead.conf import settings
+from sunhead.utils import get_class_by_path
+
+from aeroport.abc import AbstractDestination, AbstractPayload
+from aeroport.codecs import AbstractPayloadCodec, get_codec
+from aeroport.payload import PayloadBatch
+
+
+logger = logging.getLogger(__name__)
+
+
+FRAME_HEADER = struct.Struct(">II")  # body length, crc32 of body
+
+
+class DirectoryLock(object):
+    """
+    Exclusive non-blocking lock of the spool directory. It holds against other processes
+    (where ``fcntl`` is available) and against other spools in this process.
+    """
+
+    FILENAME = "lock"
+
+    _held = set()  # Directories locked in this process
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self._file = None
+
+    def acquire(self) -> bool:
+        if self.path in self._held:
+            return False
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        lock_file = open(os.path.join(self.path, self.FILENAME), "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self._file = lock_file
+        self._held.add(self.path)
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        self._held.discard(self.path)
+        self._file.close()  # Closing the file drops flock
+        self._file = None
+
+
+class SpoolDestination(AbstractDestination):
+    """
+    Wraps the other destination. Example of destination settings::
+
+        {
+            "name": "offers",
+            "destination": "aeroport.destinations.stream.StreamDestination",
+            "destination_settings": {"active_stream": "rabbitmq", "streams": {...}},
+            "segment_bytes": 67108864,
+            "codec": "schema",
+            "flush_every": 100,
+            "flush_interval": 0.1,
+            "sync_interval": 1.0
+        }
+
+    Payloads are encoded with ``codec`` (see ``aeroport.codecs``, ``json`` by default).
+    Spool files are kept in ``SPOOL_DIR/<name>`` unless ``path`` is given explicitly.
+    Every spool locks its own slot in that directory: the directory itself, or numbered
+    subdirectory, when several flights (or processes) use the same destination at once.
+    Undelivered segments of slots, that are not locked by anyone, are taken over on prepare.
+    """
+
+    SEGMENT_SUFFIX = ".seg"
+    CURSOR_FILENAME = "cursor"
+    REJECTED_FILENAME = "rejected"
+    MAX_SLOTS = 64
+    DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+    WRITE_BUFFER_BYTES = 1024 * 1024
+    READ_CHUNK_BYTES = 1024 * 1024
+    FLUSH_EVERY = 100
+    FLUSH_INTERVAL = 0.1
+    SYNC_INTERVAL = 1.0
+    SAVE_CURSOR_ON_EACH = 1000
+    RETRY_DELAY = 0.5
+    MAX_RETRY_DELAY = 60.0
+    RELEASE_TIMEOUT = 30.0
+
+    def __init__(self, **init_kwargs):
+        super().__init__(**init_kwargs)
+        self._loop = asyncio.get_event_loop()
+        self._destination = None
+        self._path = None
+        self._segment_bytes = int(init_kwargs.get("segment_bytes", self.DEFAULT_SEGMENT_BYTES))
+        self._flush_every = int(init_kwargs.get("flush_every", self.FLUSH_EVERY))
+        self._flush_interval = float(init_kwargs.get("flush_interval", self.FLUSH_INTERVAL))
+        self._sync_interval = float(init_kwargs.get("sync_interval", self.SYNC_INTERVAL))
+        self._codec = get_codec(init_kwargs.get("codec", None))
+        self._codecs = {self._codec.name: self._codec}
+        self._active_seq = 0
+        self._active = None
+        self._active_size = 0
+        self._active_opened = None
+        self._unflushed = 0
+        self._flush_handle = None
+        self._synced_at = None
+        self._syncs = set()
+        self._cursor = (0, 0)
+        self._drainer = None
+        self._closing = False
+        self._lock = None
+
+    async def prepare(self):
+        root = self._init_kwargs.get(
+            "path", os.path.join(settings.SPOOL_DIR, self._init_kwargs.get("name", "default"))
+        )
+        self._path, self._lock = self._lock_slot(root)
+
+        kls = get_class_by_path(self._init_kwargs["destination"])
+        self._destination = kls(**self._init_kwargs.get("destination_settings", {}))
+        await self._destination.prepare()
+
+        self._cursor = self._load_cursor()
+        self._adopt_orphans(root)
+        sealed = self._list_segments()
+        self._active_seq = sealed[-1][0] + 1 if sealed else 1
+        if sealed:
+            logger.info("Spool %s resumes with %s undelivered segment(s)", self._path, len(sealed))
+
+        self._closing = False
+        self._drainer = asyncio.ensure_future(self._drain())
+
+    async def release(self):
+        self._closing = True
+        self._seal()
+        try:
+            if self._syncs:
+                await asyncio.wait(self._syncs)
+            if self._drainer is not None:
+                await self._stop_drainer()
+        finally:
+            self._drainer = None
+            if self._lock is not None:
+                self._save_cursor()
+                self._lock.release()
+                self._lock = None
+            if self._destination is not None:
+                await self._destination.release()
+
+    async def _stop_drainer(self):
+        try:
+            await asyncio.wait_for(asyncio.shield(self._drainer), self.RELEASE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Spool %s is not drained in time, rest will be sent after restart", self._path)
+            self._drainer.cancel()
+            # Let it save the cursor
+            await asyncio.wait([self._drainer])
+
+    def _get_slot_path(self, root: str, slot: int) -> str:
+        return root if slot == 0 else os.path.join(root, str(slot))
+
+    def _lock_slot(self, root: str) -> Tuple[str, DirectoryLock]:
+        for slot in range(self.MAX_SLOTS):
+            path = self._get_slot_path(root, slot)
+            lock = DirectoryLock(path)
+            if lock.acquire():
+                return path, lock
+        raise ValueError("All {} spool slots in {} are in use".format(self.MAX_SLOTS, root))
+
+    def _adopt_orphans(self, root: str):
+        """
+        Move undelivered segments of unlocked slots (left by stopped or crashed spools) to own one.
+        """
+        for slot in range(self.MAX_SLOTS):
+            path = self._get_slot_path(root, slot)
+            if path == self._path or not os.path.isdir(path):
+                continue
+            lock = DirectoryLock(path)
+            if not lock.acquire():
+                continue
+            try:
+                self._adopt_slot(path)
+            finally:
+                lock.release()
+
+    def _adopt_slot(self, path: str):
+        segments = self._list_segments(path)
+        if not segments:
+            return
+        cursor_seq, cursor_offset = self._load_cursor(path)
+        own = self._list_segments()
+        next_seq = (own[-1][0] if own else self._cursor[0]) + 1
+        if not own:
+            self._cursor = (next_seq, 0)
+        for seq, codec_name in segments:
+            filename = self._find_segment(path, seq, codec_name)
+            target = self._segment_path(next_seq, codec_name)
+            if seq < cursor_seq:
+                os.remove(filename)
+                continue
+            if seq == cursor_seq and cursor_offset:
+                # Start of this segment is delivered already
+                with open(filename, "rb") as f:
+                    f.seek(cursor_offset)
+                    data = f.read()
+                with open(target, "wb") as f:
+                    f.write(data)
+                os.remove(filename)
+            else:
+                os.rename(filename, target)
+            next_seq += 1
+        self._save_cursor()
+        try:
+            os.remove(os.path.join(path, self.CURSOR_FILENAME))
+        except OSError:
+            pass
+        logger.info("Spool %s took over %s undelivered segment(s) from %s", self._path, len(segments), path)
+
+    async def process_payload(self, payload: AbstractPayload):
+        self._write_frame(self._codec.encode(payload))
+
+    async def process_batch(self, batch: PayloadBatch):
+        for body in self._codec.encode_batch(batch):
+            self._write_frame(body)
+
+    def _write_frame(self, body: bytes):
+        if self._active is None:
+            filename = self._segment_path(self._active_seq, self._codec.name)
+            self._active = open(filename, "ab", buffering=self.WRITE_BUFFER_BYTES)
+            self._active_size = 0
+            self._active_opened = self._synced_at = self._loop.time()
+        self._active.write(FRAME_HEADER.pack(len(body), zlib.crc32(body)))
+        self._active.write(body)
+        self._active_size += FRAME_HEADER.size + len(body)
+        self._unflushed += 1
+        if self._active_size >= self._segment_bytes:
+            self._seal()
+        elif self._unflushed >= self._flush_every:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self._flush_interval, self._flush)
+
+    def _flush(self):
+        """
+        Hand buffered frames of active segment to the OS, and sync it, if it's time.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._active is None:
+            return
+        self._active.flush()
+        self._unflushed = 0
+        if self._loop.time() - self._synced_at >= self._sync_interval:
+            self._sync_in_background(self._active)
+            self._synced_at = self._loop.time()
+
+    def _sync_in_background(self, segment_file):
+        # Own descriptor, so that segment can be closed meanwhile
+        fd = os.dup(segment_file.fileno())
+        sync = asyncio.ensure_future(self._loop.run_in_executor(None, self._sync_fd, fd))
+        self._syncs.add(sync)
+        sync.add_done_callback(self._sync_done)
+
+    @staticmethod
+    def _sync_fd(fd: int):
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _sync_done(self, sync: asyncio.Future):
+        self._syncs.discard(sync)
+        if not sync.cancelled() and sync.exception() is not None:
+            logger.error("Can't sync spool segment in %s", self._path, exc_info=sync.exception())
+
+    def _segment_path(self, seq: int, codec_name: str) -> str:
+        return os.path.join(self._path, "{:012d}.{}{}".format(seq, codec_name, self.SEGMENT_SUFFIX))
+
+    def _find_segment(self, path: str, seq: int, codec_name: str) -> str:
+        filename = os.path.join(path, "{:012d}.{}{}".format(seq, codec_name, self.SEGMENT_SUFFIX))
+        if not os.path.isfile(filename):
+            # Segment of the old format without codec in name
+            filename = os.path.join(path, "{:012d}{}".format(seq, self.SEGMENT_SUFFIX))
+        return filename
+
+    def _list_segments(self, path: Optional[str] = None) -> List[Tuple[int, str]]:
+        """
+        Sorted sequence numbers of segments on disk, with codec names their payloads are encoded with.
+        """
+        segments = []
+        for name in os.listdir(path or self._path):
+            if name.endswith(self.SEGMENT_SUFFIX):
+                seq, _, codec_name = name[:-len(self.SEGMENT_SUFFIX)].partition(".")
+                segments.append((int(seq), codec_name or "json"))
+        return sorted(segments)
+
+    def _get_codec(self, name: str) -> AbstractPayloadCodec:
+        codec = self._codecs.get(name, None)
+        if codec is None:
+            codec = self._codecs[name] = get_codec(name)
+        return codec
+
+    def _seal(self):
+        """
+        Close active segment, so it can be drained. Next payload will open the new one.
+        """
+        if self._active is None:
+            return
+        self._flush()
+        self._sync_in_background(self._active)
+        self._active.close()
+        self._active = None
+        self._active_seq += 1
+
+    def _load_cursor(self, path: Optional[str] = None) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(path or self._path, self.CURSOR_FILENAME), "r") as f:
+                seq, offset = json.load(f)
+        except (OSError, ValueError):
+            return 0, 0
+        return seq, offset
+
+    def _save_cursor(self):
+        filename = os.path.join(self._path, self.CURSOR_FILENAME)
+        with open(filename + ".tmp", "w") as f:
+            json.dump(list(self._cursor), f)
+        os.replace(filename + ".tmp", filename)
+
+    async def _drain(self):
+        while True:
+            sealed = [segment for segment in self._list_segments() if segment[0] < self._active_seq]
+            if sealed:
+                try:
+                    await self._drain_segment(*sealed[0])
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.error("Can't drain spool %s, retrying", self._path, exc_info=True)
+                    await asyncio.sleep(self.RETRY_DELAY)
+                continue
+
+            if self._closing:
+                return
+
+            if self._active is not None and self._loop.time() - self._active_opened >= self._sync_interval:
+                # Nothing else to send, so take what is collected by now
+                self._seal()
+            else:
+                await asyncio.sleep(self._sync_interval)
+
+    async def _drain_segment(self, seq: int, codec_name: str):
+        filename = self._find_segment(self._path, seq, codec_name)
+        codec = self._get_codec(codec_name)
+        offset = self._cursor[1] if self._cursor[0] == seq else 0
+
+        delivered = 0
+        try:
+            with open(filename, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                f.seek(offset)
+                data = b""
+                torn = False
+                while not torn and offset < size:
+                    # Segment is read by chunks, frame, that doesn't fit in one, is completed by the next
+                    chunk = await self._loop.run_in_executor(None, f.read, self.READ_CHUNK_BYTES)
+                    data += chunk
+                    bodies, used, torn = self._split_frames(data, offset, size, filename)
+                    data = data[used:]
+                    for body, end in bodies:
+                        payload = self._decode(codec, body, end - len(body) - FRAME_HEADER.size, filename)
+                        if payload is None:
+                            self._cursor = (seq, end)
+                            continue
+                        await self._deliver(payload)
+                        self._cursor = (seq, end)
+                        delivered += 1
+                        if delivered % self.SAVE_CURSOR_ON_EACH == 0:
+                            self._save_cursor()
+                    offset += used
+                    if not chunk:
+                        break
+        except asyncio.CancelledError:
+            self._save_cursor()
+            raise
+
+        os.remove(filename)
+        self._cursor = (seq + 1, 0)
+        self._save_cursor()
+        logger.debug("Spool segment %s drained, %s payloads delivered", filename, delivered)
+
+    @staticmethod
+    def _split_frames(data: bytes, offset: int, size: int, filename: str) -> Tuple[List[Tuple[bytes, int]], int, bool]:
+        """
+        Complete frames at the start of ``data``, which is read from segment of ``size`` at ``offset``.
+
+        :return: Frame bodies with segment offsets of their ends, number of bytes they take,
+            and whether the rest of the segment is torn.
+        """
+        bodies = []
+        pos = 0
+        while True:
+            if pos + FRAME_HEADER.size > len(data):
+                if pos == len(data) or offset + len(data) < size:
+                    # Nothing left, or the rest is in the next chunk
+                    return bodies, pos, False
+                break
+            length, crc = FRAME_HEADER.unpack_from(data, pos)
+            start, end = pos + FRAME_HEADER.size, pos + FRAME_HEADER.size + length
+            if offset + end > size:
+                break
+            if end > len(data):
+                return bodies, pos, False
+            body = data[start:end]
+            if zlib.crc32(body) != crc:
+                break
+            bodies.append((body, offset + end))
+            pos = end
+        logger.warning("Spool segment %s has torn record at %s, skipping the rest", filename, offset + pos)
+        return bodies, pos, True
+
+    def _decode(self, codec: AbstractPayloadCodec, body: bytes, offset: int, filename: str) -> Optional[AbstractPayload]:
+        try:
+            return codec.decode(body)
+        except Exception:
+            logger.error(
+                "Can't decode record at %s of spool segment %s, moving it to '%s'",
+                offset, filename, self.REJECTED_FILENAME, exc_info=True
+            )
+            self._reject(codec, body)
+            return None
+
+    def _reject(self, codec: AbstractPayloadCodec, body: bytes):
+        with open(os.path.join(self._path, self.REJECTED_FILENAME), "ab") as f:
+            f.write(codec.name.encode("utf-8") + b" " + FRAME_HEADER.pack(len(body), zlib.crc32(body)) + body)
+
+    async def _deliver(self, payload: AbstractPayload):
+        delay = self.RETRY_DELAY
+        while True:
+            if self._destination.ready:
+                try:
+                    await self._destination.process_payload(payload)
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.warning("Spool can't deliver payload, retrying in %.1fs", delay, exc_info=True)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.MAX_RETRY_DELAY)
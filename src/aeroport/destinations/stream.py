@@ -6,19 +6,28 @@ import asyncio
 
 from sunhead.events.stream import init_stream_from_settings
 from sunhead.metrics import get_metrics
+from sunhead.utils import get_class_by_path
 
 from aeroport.abc import AbstractDestination, AbstractPayload
+from aeroport.codecs import get_codec, encode_message, wrap_message
+from aeroport.payload import PayloadBatch
 from aeroport.utils import register_metric
 
 
 class StreamDestination(AbstractDestination):
     """
     Send payloads to the SunHead framework's stream (which is distributed queues).
+
+    Payloads are published as plain dicts, unless ``codec`` is set in destination settings.
+    Then they are encoded with this codec and published as bytes, which consumers restore
+    with ``aeroport.codecs.decode_message``. Codec requires the transport, that passes bytes
+    as they are, such as ``aeroport.transports.BinaryAMQPClient``.
     """
 
     def __init__(self, **init_kwargs):
         super().__init__(**init_kwargs)
         self._stream = None
+        self._codec = get_codec(init_kwargs["codec"]) if init_kwargs.get("codec", None) else None
         self._loop = asyncio.get_event_loop()
         self._metrics = get_metrics()
         self._metric_sent = register_metric(
@@ -29,13 +38,42 @@ class StreamDestination(AbstractDestination):
         )
 
     async def prepare(self):
+        if self._codec is not None:
+            self._check_transport()
         self._stream = await init_stream_from_settings(self._init_kwargs)
         await self._stream.connect()
 
+    def _check_transport(self):
+        transport = self._init_kwargs["streams"][self._init_kwargs["active_stream"]].get("transport", None)
+        transport_class = get_class_by_path(transport) if transport else None
+        if not getattr(transport_class, "ACCEPTS_BYTES", False):
+            raise ValueError(
+                "Stream transport '{}' JSON-encodes messages, so '{}' codec is useless with it. "
+                "Use aeroport.transports.BinaryAMQPClient or no codec".format(transport, self._codec.name)
+            )
+
     async def release(self):
-        await self._stream.close()
+        if self._stream is None:
+            return
+        stream, self._stream = self._stream, None
+        await stream.close()
+
+    @property
+    def ready(self) -> bool:
+        return self._stream is not None and self._stream.connected
 
     async def process_payload(self, payload: AbstractPayload):
         pname = payload.__class__.__name__.lower()
-        await self._stream.publish(payload.as_dict, ("aeroport.payload_sent.{}".format(pname), ))
+        message = payload.as_dict if self._codec is None else encode_message(self._codec, payload)
+        await self._stream.publish(message, ("aeroport.payload_sent.{}".format(pname), ))
         self._metrics.counters.get(self._metric_sent).inc()
+
+    async def process_batch(self, batch: PayloadBatch):
+        topics = ("aeroport.payload_sent.{}".format(batch.payload_class.__name__.lower()), )
+        if self._codec is None:
+            messages = batch.iter_values()
+        else:
+            messages = (wrap_message(self._codec, data) for data in self._codec.encode_batch(batch))
+        for message in messages:
+            await self._stream.publish(message, topics)
+        self._metrics.counters.get(self._metric_sent).inc(len(batch))
@@ -6,10 +6,13 @@ import asyncio
 import logging
 from datetime import datetime
 from enum import Enum
+from typing import Callable, Optional
 import uuid
 
 import peewee
 
+from sunhead.conf import settings
+
 from aeroport.abc import AbstractOrigin
 from aeroport.db import BaseModel, choices_from_enum
 from aeroport.management.utils import get_airline
@@ -27,6 +30,8 @@ class FlightStatuses(Enum):
     new = 0
     in_air = 1
     landed = 2
+    interrupted = 3
+    queued = 4
 
 
 # TODO: Add destination
@@ -43,6 +48,15 @@ class FlightRecord(BaseModel):
     finished = peewee.DateTimeField(null=True, index=True)
     num_processed = peewee.IntegerField(null=True)
     uuid = peewee.UUIDField()
+    # Distributed mode: queued flight to run and lease of the worker, which runs it
+    destination = peewee.CharField(null=True)
+    options = peewee.TextField(null=True)
+    priority = peewee.IntegerField(default=0)
+    attempts = peewee.IntegerField(default=0)
+    worker = peewee.CharField(null=True)
+    lease_expires = peewee.DateTimeField(null=True, index=True)
+    heartbeat = peewee.DateTimeField(null=True)
+    cancel_requested = peewee.BooleanField(default=False)
 
 
 class Flight(object):
@@ -59,13 +73,24 @@ class Flight(object):
         self._num_processed = None
         self._status = FlightStatuses.new
         self._flight_record = None
+        self._failed_urls = []
 
         self.uuid = uuid.uuid4()
+        self.worker = None
+
+    def adopt_record(self, flight_record: FlightRecord):
+        """
+        Run as the queued flight, that was claimed by the worker.
+        """
+        self.uuid = uuid.UUID(str(flight_record.uuid))
+        self.worker = flight_record.worker
+        self._flight_record = flight_record
 
     async def start(self):
         self._start_time = datetime.now()
         self._start_time_iso = self._datetime_to_iso(self._start_time)
         self._status = FlightStatuses.in_air
+        get_flight_supervisor().register_flight(self)
         await self._store_data()
 
     async def finish(self, total_processed=None):
@@ -74,17 +99,49 @@ class Flight(object):
         self._status = FlightStatuses.landed
         if total_processed is not None:
             self._num_processed = total_processed
+        if self._failed_urls:
+            logger.warning("Flight %s landed with %s failed urls", self.uuid, len(self._failed_urls))
         await self._store_data()
 
+    async def interrupt(self):
+        """
+        Mark flight as cancelled before it landed.
+        """
+        self._finish_time = datetime.now()
+        self._status = FlightStatuses.interrupted
+        await self._store_data()
+
+    @property
+    def status(self) -> FlightStatuses:
+        return self._status
+
     @property
     def num_processed(self):
         return self._num_processed
 
     async def set_num_processed(self, value):
+        previous = self._num_processed or 0
         self._num_processed = value
-        if self._num_processed % self.SAVE_ON_EACH == 0:
+        # Counter can move by more than one, so store whenever it crosses the next multiple
+        if value // self.SAVE_ON_EACH != previous // self.SAVE_ON_EACH:
             await self._store_data()
 
+    async def add_num_processed(self, value):
+        """
+        Add to the counter. Origins processing several sources at once report progress this way.
+        """
+        await self.set_num_processed((self._num_processed or 0) + value)
+
+    @property
+    def failed_urls(self):
+        """
+        Urls, that could not be downloaded, with their errors.
+        """
+        return self._failed_urls
+
+    def add_failed_url(self, url: str, error: Exception):
+        self._failed_urls.append((url, str(error) or repr(error)))
+
     def _datetime_to_iso(self, d: datetime) -> str:
         isoformat = d.isoformat()
         return isoformat
@@ -104,32 +161,202 @@ class Flight(object):
 
     async def _store_data(self):
         flight_record = await self._get_flight_record()
-        flight_record.started = self._start_time
-        flight_record.finished = self._finish_time
-        flight_record.num_processed = self.num_processed
-        flight_record.status = self._status.value
-        await FlightRecord.db_manager.update(flight_record)
+        # Only own fields are written, lease of the record is updated by the worker meanwhile
+        query = FlightRecord.update(
+            started=self._start_time,
+            finished=self._finish_time,
+            num_processed=self.num_processed,
+            status=self._status.value,
+        ).where(FlightRecord.id == flight_record.id)
+        if self.worker is not None:
+            # Flight, whose lease was taken over by another worker, must not overwrite its record
+            query = query.where(FlightRecord.worker == self.worker)
+        await FlightRecord.db_manager.execute(query)
 
 
 async def process_origin(
-        airline_name: str, origin_name: str, destination_name: str, use_await=False, **options):
+        airline_name: str, origin_name: str, destination_name: str, use_await=False,
+        flight_record: Optional[FlightRecord] = None, **options):
 
     airline = get_airline(airline_name)
     origin = airline.get_origin(origin_name)
     origin.set_options(**options)
 
     if destination_name:
-        try:
-            dest = await Destination.db_manager.get(
-                Destination, enabled=True, name=destination_name
-            )
-        except Destination.DoesNotExist:
-            logger.error("There is not destination named '%s'" % destination_name)
-            raise ProcessingException
-        else:
-            await origin.set_destination(dest.class_name, **dest.settings)
+        dest = await get_destination(destination_name)
+        await origin.set_destination(dest.class_name, **dest.settings)
 
+    supervisor = get_flight_supervisor()
     if use_await:
-        await origin.process()
+        await supervisor.run(origin, flight_record)
     else:
-        asyncio.ensure_future(origin.process())
+        supervisor.start(origin, flight_record)
+
+
+async def get_destination(destination_name: str) -> Destination:
+    try:
+        return await Destination.db_manager.get(
+            Destination, enabled=True, name=destination_name
+        )
+    except Destination.DoesNotExist:
+        logger.error("There is not destination named '%s'" % destination_name)
+        raise ProcessingException
+
+
+async def check_flight(airline_name: str, origin_name: str, destination_name: Optional[str] = None):
+    """
+    Check, that airline, origin and destination of the flight exist, before it is queued.
+    Raises ``ProcessingException`` if they don't.
+    """
+    try:
+        get_airline(airline_name).get_origin_class(origin_name)
+    except (ImportError, AttributeError):
+        logger.error("There is no origin '%s' of airline '%s'", origin_name, airline_name)
+        raise ProcessingException
+    if destination_name:
+        await get_destination(destination_name)
+
+
+def _current_task() -> Optional[asyncio.Task]:
+    current_task = getattr(asyncio, "current_task", None) or asyncio.Task.current_task
+    return current_task()
+
+
+class FlightSupervisor(object):
+    """
+    Keeps track of running origins, so that their flights can be cancelled, and all of them
+    are stopped on shutdown. Cancelled and failed flights are marked ``interrupted``. After every flight
+    origin's destination is released, so that buffered payloads are not lost.
+    Origin, started with claimed ``flight_record``, runs its flight as that record.
+    """
+
+    DEFAULT_SHUTDOWN_TIMEOUT = 30
+
+    def __init__(self):
+        self._tasks = {}  # Task -> origin, running in it
+        self._flights = {}  # Flight uuid -> (flight, task)
+        self._records = {}  # Task -> claimed flight record, not adopted yet
+        self._shutdown_hooks = []
+
+    @property
+    def running(self) -> int:
+        return len(self._tasks)
+
+    def start(self, origin: AbstractOrigin, flight_record: Optional[FlightRecord] = None) -> asyncio.Task:
+        task = asyncio.ensure_future(self._run(origin, flight_record))
+        task.add_done_callback(self._retrieve_exception)
+        return task
+
+    @staticmethod
+    def _retrieve_exception(task: asyncio.Task):
+        # Error is logged by the task itself, nobody may await it
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, origin: AbstractOrigin, flight_record: Optional[FlightRecord] = None):
+        await self.start(origin, flight_record)
+
+    async def _run(self, origin: AbstractOrigin, flight_record: Optional[FlightRecord] = None):
+        task = _current_task()
+        self._tasks[task] = origin
+        if flight_record is not None:
+            self._records[task] = flight_record
+        try:
+            await origin.process()
+        except asyncio.CancelledError:
+            logger.warning("Processing of %s %s is cancelled", origin.airline.name, origin.name)
+            await self._interrupt_flights(task)
+            raise
+        except Exception:
+            logger.error("Processing of %s %s failed", origin.airline.name, origin.name, exc_info=True)
+            await self._interrupt_flights(task)
+            raise
+        finally:
+            await self._release_destination(origin)
+            del self._tasks[task]
+            self._records.pop(task, None)
+            for flight in self._get_task_flights(task):
+                self._flights.pop(flight.uuid, None)
+
+    async def _interrupt_flights(self, task: asyncio.Task):
+        for flight in self._get_task_flights(task):
+            if flight.status == FlightStatuses.in_air:
+                try:
+                    await flight.interrupt()
+                except Exception:
+                    logger.error("Can't mark flight %s interrupted", flight.uuid, exc_info=True)
+
+    async def _release_destination(self, origin: AbstractOrigin):
+        try:
+            await asyncio.wait_for(origin.release_destination(), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            logger.error("Destination of %s %s is not released in time", origin.airline.name, origin.name)
+        except Exception:
+            logger.error("Can't release destination of %s %s", origin.airline.name, origin.name, exc_info=True)
+
+    def _get_task_flights(self, task: asyncio.Task):
+        return [flight for flight, flight_task in self._flights.values() if flight_task is task]
+
+    def register_flight(self, flight: "Flight"):
+        task = _current_task()
+        if task in self._tasks:
+            flight_record = self._records.pop(task, None)
+            if flight_record is not None:
+                flight.adopt_record(flight_record)
+            self._flights[flight.uuid] = (flight, task)
+
+    def get_flight(self, flight_uuid: uuid.UUID) -> Optional["Flight"]:
+        flight, _ = self._flights.get(flight_uuid, (None, None))
+        return flight
+
+    def cancel(self, flight_uuid: uuid.UUID) -> bool:
+        """
+        Cancel processing, that runs the flight.
+
+        :return: False if there is no such flight running.
+        """
+        _, task = self._flights.get(flight_uuid, (None, None))
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    def add_shutdown_hook(self, hook: Callable):
+        """
+        Add coroutine function to be called on shutdown, after all flights are stopped.
+        """
+        self._shutdown_hooks.append(hook)
+
+    @property
+    def shutdown_timeout(self) -> float:
+        return getattr(settings, "FLIGHT_SHUTDOWN_TIMEOUT", self.DEFAULT_SHUTDOWN_TIMEOUT)
+
+    async def shutdown(self):
+        """
+        Cancel all running flights, wait for them to clean up, then run shutdown hooks.
+        """
+        tasks = list(self._tasks)
+        if tasks:
+            logger.info("Cancelling %s running flights", len(tasks))
+            for task in tasks:
+                task.cancel()
+            # Cleanup of every task is bounded by timeout too, this one is the last resort
+            _, not_done = await asyncio.wait(tasks, timeout=self.shutdown_timeout * 2)
+            if not_done:
+                logger.error("%s flights are not stopped in time", len(not_done))
+
+        for hook in self._shutdown_hooks:
+            try:
+                await hook()
+            except Exception:
+                logger.error("Shutdown hook %s failed", hook, exc_info=True)
+
+
+_supervisor = None
+
+
+def get_flight_supervisor() -> FlightSupervisor:
+    global _supervisor
+    if _supervisor is None:
+        _supervisor = FlightSupervisor()
+    return _supervisor
@@ -13,6 +13,8 @@ import time
 
 import aiohttp
 
+from aeroport.httpclient import get_http_client
+from aeroport.retry import DownloadError, RetryPolicy
 from aeroport.storage.abc import AbstractStorage, ObjectInStorage
 from aeroport.storage.exceptions import ObjectNotFoundException
 
@@ -40,6 +42,7 @@ class FileUrlCache(object):
         self._bucket = bucket
         self._expires = expires
         self._download_hooks = []
+        self._retry_policy = RetryPolicy.from_settings()
 
     async def get(
             self, url: str, as_filename: str,
@@ -61,7 +64,7 @@ class FileUrlCache(object):
 
         if cached_file is None and not force_cache:
             try:
-                cached_file = await self.download_to_cache(url, as_filename)
+                cached_file = await self._retry_policy.call(self.download_to_cache, url, as_filename)
             except Exception:
                 logger.error("Problem with file downloading", exc_info=True)
                 return None
@@ -99,11 +102,12 @@ class FileUrlCache(object):
     async def download_to_cache(self, url: str, as_filename: str) -> ObjectInStorage:
         logger.info("Downloading to cache, filename=%s", as_filename)
         await self._storage.remove(self._bucket, as_filename)
-        async with aiohttp.ClientSession(read_timeout=self.DOWNLOAD_TIMEOUT) as session:
-            with aiohttp.Timeout(self.DOWNLOAD_TIMEOUT):
-                async with session.get(url, timeout=self.DOWNLOAD_TIMEOUT) as response:
-                    assert response.status == 200
-                    cached_file = await self._storage.put(self._bucket, as_filename, response)
+        session = get_http_client().session
+        with aiohttp.Timeout(self.DOWNLOAD_TIMEOUT):
+            async with session.get(url, timeout=self.DOWNLOAD_TIMEOUT) as response:
+                if response.status != 200:
+                    raise DownloadError(url, response.status)
+                cached_file = await self._storage.put(self._bucket, as_filename, response)
 
         for hook in self._download_hooks:
             cached_file = await hook(cached_file)
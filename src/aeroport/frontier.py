@@ -0,0 +1,290 @@
+"""
+Persistent crawl frontier. Urls to visit are kept in SQLite along with all urls seen
+before, so that every url is fetched once, and interrupted crawl continues where it
+stopped. Bloom filter in memory answers most of "seen?" questions without the database.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional
+
+from aeroport.abc import AbstractUrlGenerator, UrlInfo
+
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter(object):
+    """
+    Set of strings with false positives at about ``error_rate``, while it holds up to
+    ``capacity`` items. It never has false negatives.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, value: str) -> Iterable[int]:
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.md5(value.encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, value: str):
+        bits = self._bits
+        for pos in self._positions(value):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value: str) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class UrlStates(object):
+    pending = 0
+    in_progress = 1
+    done = 2
+    failed = 3
+
+
+class CrawlFrontier(object):
+    """
+    Urls of one crawl in SQLite file at ``path``. Urls are taken by priority (higher first),
+    then in the order they were added. Url, that was added once, is never added again,
+    until the frontier is reset.
+
+    Changes of urls are committed in batches of ``COMMIT_EVERY`` writes, or after
+    ``COMMIT_INTERVAL`` seconds, and on ``close()``. If the process dies, the last of them
+    are lost, and those pages are just visited again.
+    """
+
+    BLOOM_CAPACITY = 1000000
+    BLOOM_ERROR_RATE = 0.001
+    COMMIT_EVERY = 200
+    COMMIT_INTERVAL = 1.0
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS urls ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " url TEXT NOT NULL UNIQUE,"
+        " priority INTEGER NOT NULL DEFAULT 0,"
+        " state INTEGER NOT NULL DEFAULT 0,"
+        " kwargs TEXT,"
+        " updated REAL)",
+        "CREATE INDEX IF NOT EXISTS urls_queue ON urls (state, priority DESC, id)",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    )
+
+    def __init__(self, path: str, bloom_capacity: int = BLOOM_CAPACITY):
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+        self._bloom_capacity = bloom_capacity
+        self._bloom = self._load_bloom()
+        self._uncommitted = 0
+        self._committed_at = time.monotonic()
+
+    def _load_bloom(self) -> BloomFilter:
+        count = self._db.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+        bloom = BloomFilter(max(self._bloom_capacity, count * 2), self.BLOOM_ERROR_RATE)
+        for url, in self._db.execute("SELECT url FROM urls"):
+            bloom.add(url)
+        return bloom
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def is_seen(self, url: str) -> bool:
+        if url not in self._bloom:
+            return False
+        return self._db.execute("SELECT 1 FROM urls WHERE url = ?", (url, )).fetchone() is not None
+
+    def add(self, url: str, priority: int = 0, kwargs: Optional[Dict] = None) -> bool:
+        """
+        Add url to visit, unless it was seen already.
+
+        :return: Whether url was added.
+        """
+        return self.add_many([UrlInfo(url=url, kwargs=kwargs)], priority) == 1
+
+    def add_many(self, url_infos: Iterable[UrlInfo], priority: int = 0) -> int:
+        now = time.time()
+        rows = []
+        for url_info in url_infos:
+            if self.is_seen(url_info.url):
+                continue
+            self._bloom.add(url_info.url)
+            kwargs = json.dumps(url_info.kwargs) if url_info.kwargs else None
+            rows.append((url_info.url, priority, UrlStates.pending, kwargs, now))
+        if rows:
+            # Duplicates within the same call are skipped by the unique index
+            cursor = self._db.executemany(
+                "INSERT OR IGNORE INTO urls (url, priority, state, kwargs, updated) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._written(len(rows))
+            return cursor.rowcount
+        return 0
+
+    def pop(self, count: int = 1) -> List[UrlInfo]:
+        """
+        Take urls to visit and mark them as in progress.
+        """
+        rows = self._db.execute(
+            "SELECT id, url, kwargs FROM urls WHERE state = ? ORDER BY priority DESC, id LIMIT ?",
+            (UrlStates.pending, count)
+        ).fetchall()
+        if not rows:
+            return []
+        self._db.executemany(
+            "UPDATE urls SET state = ?, updated = ? WHERE id = ?",
+            [(UrlStates.in_progress, time.time(), row_id) for row_id, _, _ in rows]
+        )
+        self._written(len(rows))
+        return [UrlInfo(url=url, kwargs=json.loads(kwargs) if kwargs else {}) for _, url, kwargs in rows]
+
+    def mark_done(self, url: str):
+        self._set_state(url, UrlStates.done)
+
+    def mark_failed(self, url: str):
+        self._set_state(url, UrlStates.failed)
+
+    def _set_state(self, url: str, state: int):
+        self._db.execute("UPDATE urls SET state = ?, updated = ? WHERE url = ?", (state, time.time(), url))
+        self._written()
+
+    def _written(self, num: int = 1):
+        self._uncommitted += num
+        if self._uncommitted >= self.COMMIT_EVERY or time.monotonic() - self._committed_at >= self.COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        self._db.commit()
+        self._uncommitted = 0
+        self._committed_at = time.monotonic()
+
+    def count(self, state: int) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM urls WHERE state = ?", (state, )).fetchone()[0]
+
+    def requeue_in_progress(self) -> int:
+        """
+        Return urls, that were taken by interrupted crawl, back to the queue.
+        """
+        cursor = self._db.execute(
+            "UPDATE urls SET state = ? WHERE state = ?", (UrlStates.pending, UrlStates.in_progress)
+        )
+        self.commit()
+        return cursor.rowcount
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key, )).fetchone()
+        return row[0] if row is not None else None
+
+    def set_meta(self, key: str, value: str):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+        self.commit()
+
+    def reset(self):
+        """
+        Forget all urls, so that the next crawl starts from scratch.
+        """
+        self._db.execute("DELETE FROM urls")
+        self._db.execute("DELETE FROM meta")
+        self.commit()
+        self._bloom = BloomFilter(self._bloom_capacity, self.BLOOM_ERROR_RATE)
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+
+class FrontierUrlGenerator(AbstractUrlGenerator):
+    """
+    Url generator over the frontier. Crawl, that was interrupted, is resumed: urls that were
+    in progress are visited again, done ones are not. Finished crawl is started anew from
+    ``seeds``, ``SEEDS`` by default.
+
+    Urls, discovered on the pages, are added with ``add``. Generator stops when
+    there are no pending urls and no urls in progress, which could bring new ones.
+
+    Used in scraping scheme, generator gets the origin's frontier, named ``FRONTIER_NAME``
+    (class name by default), and closes it with ``close()``.
+    """
+
+    FRONTIER_NAME = None
+    SEEDS = ()
+
+    def __init__(self, frontier: CrawlFrontier, seeds: Optional[Iterable[UrlInfo]] = None, priority: int = 0):
+        self.frontier = frontier
+        self._seeds = seeds if seeds is not None else self.SEEDS
+        self._priority = priority
+        self._started = False
+        self._in_progress = set()
+        self._changed = asyncio.Event()
+
+    def _start(self):
+        self._started = True
+        if self.frontier.get_meta("state") == "crawling":
+            requeued = self.frontier.requeue_in_progress()
+            logger.info(
+                "Resuming crawl from %s, %s urls pending (%s requeued)",
+                self.frontier.path, self.frontier.count(UrlStates.pending), requeued
+            )
+            return
+        self.frontier.reset()
+        self.frontier.add_many(self._seeds, self._priority)
+        self.frontier.set_meta("state", "crawling")
+
+    async def __anext__(self) -> UrlInfo:
+        if not self._started:
+            self._start()
+        while True:
+            url_infos = self.frontier.pop(1)
+            if url_infos:
+                self._in_progress.add(url_infos[0].url)
+                return url_infos[0]
+            if not self._in_progress:
+                self.frontier.set_meta("state", "finished")
+                raise StopAsyncIteration
+            self._changed.clear()
+            await self._changed.wait()
+
+    def add(self, url: str, priority: int = 0, kwargs: Optional[Dict] = None) -> bool:
+        added = self.frontier.add(url, priority, kwargs)
+        if added:
+            self._changed.set()
+        return added
+
+    def mark_done(self, url_info: UrlInfo):
+        self.frontier.mark_done(url_info.url)
+        self._finish_one(url_info.url)
+
+    def mark_failed(self, url_info: UrlInfo):
+        self.frontier.mark_failed(url_info.url)
+        self._finish_one(url_info.url)
+
+    def _finish_one(self, url: str):
+        self._in_progress.discard(url)
+        self._changed.set()
+
+    async def close(self):
+        self.frontier.close()
+
+    @classmethod
+    def get_frontier_name(cls) -> str:
+        return cls.FRONTIER_NAME or cls.__name__
@@ -0,0 +1,221 @@
+"""
+On-disk cache of scraped pages. Pages are kept in storage gzipped, along with their
+validators, and are served from cache while fresh by ``Cache-Control``/``Expires``
+(or by TTL override). Stale ones are revalidated with ``If-None-Match`` and
+``If-Modified-Since``, so unchanged pages are not downloaded again.
+"""
+
+import asyncio
+from email.utils import parsedate_to_datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, Mapping, Optional
+
+from sunhead.conf import settings
+from sunhead.utils import get_class_by_path
+
+from aeroport.storage import storage_executor
+from aeroport.storage.abc import AbstractStorage
+from aeroport.storage.exceptions import ObjectNotFoundException
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') if arg else None
+    return directives
+
+
+def parse_http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class CacheEntry(object):
+
+    def __init__(self, url: str, html: str, stored: float, expires: float,
+                 etag: Optional[str] = None, last_modified: Optional[str] = None):
+        self.url = url
+        self.html = html
+        self.stored = stored
+        self.expires = expires
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        return (now or time.time()) < self.expires
+
+    @property
+    def can_revalidate(self) -> bool:
+        return self.etag is not None or self.last_modified is not None
+
+    def get_conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def dump_meta(self) -> Dict:
+        return {
+            "url": self.url,
+            "stored": self.stored,
+            "expires": self.expires,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+        }
+
+
+class HttpCache(object):
+    """
+    Cache entries in ``bucket`` of ``storage``, one object per url.
+    """
+
+    # Lifetime of response without explicit one, as a fraction of its age by Last-Modified (RFC 7234)
+    HEURISTIC_FRACTION = 0.1
+    MAX_HEURISTIC_LIFETIME = 24 * 3600
+    COMPRESS_LEVEL = 6
+    # Request headers, which may be in Vary, but don't change the page, as it is stored
+    IGNORED_VARY = frozenset(("accept-encoding", ))
+
+    def __init__(self, storage: AbstractStorage, bucket: str):
+        self._storage = storage
+        self._bucket = bucket
+
+    @staticmethod
+    def get_object_name(url: str) -> str:
+        return hashlib.sha1(url.encode("utf-8")).hexdigest() + ".gz"
+
+    def get_lifetime(self, headers: Mapping[str, str], now: float, ttl: Optional[int] = None) -> Optional[float]:
+        """
+        Seconds the response stays fresh, or None if it must not be stored at all.
+        Given ``ttl`` overrides what response headers say.
+
+        Responses, that vary by request headers, are not stored, because cache is keyed by url only.
+        """
+        if ttl is not None:
+            return ttl
+
+        cache_control = parse_cache_control(headers.get("Cache-Control"))
+        if "no-store" in cache_control:
+            return None
+        vary = {name.strip().lower() for name in headers.get("Vary", "").split(",")}
+        if vary - self.IGNORED_VARY - {""}:
+            return None
+        if "no-cache" in cache_control:
+            return 0
+        max_age = cache_control.get("max-age")
+        if max_age is not None:
+            try:
+                return max(0, int(max_age))
+            except ValueError:
+                return 0
+
+        expires = headers.get("Expires")
+        if expires is not None:
+            expires_ts = parse_http_date(expires)
+            date_ts = parse_http_date(headers.get("Date")) or now
+            return max(0, expires_ts - date_ts) if expires_ts is not None else 0
+
+        last_modified_ts = parse_http_date(headers.get("Last-Modified"))
+        if last_modified_ts is not None:
+            return min(self.MAX_HEURISTIC_LIFETIME, max(0, now - last_modified_ts) * self.HEURISTIC_FRACTION)
+        return 0
+
+    def make_entry(self, url: str, html: str, headers: Mapping[str, str],
+                   ttl: Optional[int] = None) -> Optional[CacheEntry]:
+        now = time.time()
+        lifetime = self.get_lifetime(headers, now, ttl)
+        if lifetime is None:
+            return None
+        entry = CacheEntry(
+            url=url, html=html, stored=now, expires=now + lifetime,
+            etag=headers.get("ETag"), last_modified=headers.get("Last-Modified"),
+        )
+        if lifetime <= 0 and not entry.can_revalidate:
+            # Could be neither served nor revalidated
+            return None
+        return entry
+
+    def refresh_entry(self, entry: CacheEntry, headers: Mapping[str, str], ttl: Optional[int] = None):
+        """
+        Update entry after server told it's not modified (304).
+        """
+        now = time.time()
+        lifetime = self.get_lifetime(headers, now, ttl)
+        entry.stored = now
+        entry.expires = now + (lifetime or 0)
+        entry.etag = headers.get("ETag", entry.etag)
+        entry.last_modified = headers.get("Last-Modified", entry.last_modified)
+
+    async def load(self, url: str) -> Optional[CacheEntry]:
+        try:
+            cached_file = await self._storage.fget(self._bucket, self.get_object_name(url))
+        except ObjectNotFoundException:
+            return None
+        loop = asyncio.get_event_loop()
+        try:
+            entry = await loop.run_in_executor(storage_executor, self._read_entry, cached_file.path)
+        except (OSError, EOFError, ValueError, KeyError):
+            logger.warning("Broken cache entry for %s, ignoring it", url, exc_info=True)
+            return None
+        # Different urls with the same hash are not expected, but must not be mixed up
+        return entry if entry.url == url else None
+
+    async def store(self, entry: CacheEntry):
+        loop = asyncio.get_event_loop()
+        tmp_path = await loop.run_in_executor(storage_executor, self._write_entry, entry)
+        try:
+            await self._storage.fput(self._bucket, self.get_object_name(entry.url), tmp_path)
+        finally:
+            os.remove(tmp_path)
+
+    async def remove(self, url: str):
+        await self._storage.remove(self._bucket, self.get_object_name(url))
+
+    @staticmethod
+    def _read_entry(path: str) -> CacheEntry:
+        with gzip.open(path, "rb") as f:
+            meta = json.loads(f.readline().decode("utf-8"))
+            html = f.read().decode("utf-8")
+        return CacheEntry(html=html, **meta)
+
+    def _write_entry(self, entry: CacheEntry) -> str:
+        # Entry is JSON line with metadata, followed by the page
+        fd, tmp_path = tempfile.mkstemp(suffix=".gz")
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=self.COMPRESS_LEVEL) as f:
+            f.write(json.dumps(entry.dump_meta()).encode("utf-8"))
+            f.write(b"\n")
+            f.write(entry.html.encode("utf-8"))
+        return tmp_path
+
+
+_cache = None
+
+
+def get_http_cache() -> HttpCache:
+    """
+    Shared cache, with storage configured by ``HTTP_CACHE`` setting.
+    """
+    global _cache
+    if _cache is None:
+        conf = dict(settings.HTTP_CACHE["storage"])
+        bucket = conf.pop("bucket")
+        storage_class = get_class_by_path(conf.pop("class"))
+        _cache = HttpCache(storage_class(**conf), bucket)
+    return _cache
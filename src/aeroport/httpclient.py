@@ -0,0 +1,78 @@
+"""
+Process-wide HTTP client. All downloads share one connection pool, so connections to the
+same host are kept alive and reused, and DNS lookups are cached.
+"""
+
+import inspect
+import logging
+
+import aiohttp
+
+from sunhead.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class HttpClientManager(object):
+    """
+    Lazily creates ``aiohttp.ClientSession`` and keeps it until ``close()``.
+    """
+
+    DEFAULT_LIMIT_PER_HOST = 16
+    DEFAULT_KEEPALIVE_TIMEOUT = 30
+    DEFAULT_USE_DNS_CACHE = True
+
+    def __init__(self, limit_per_host: int = DEFAULT_LIMIT_PER_HOST,
+                 keepalive_timeout: int = DEFAULT_KEEPALIVE_TIMEOUT,
+                 use_dns_cache: bool = DEFAULT_USE_DNS_CACHE):
+        self._limit_per_host = limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._use_dns_cache = use_dns_cache
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                # In aiohttp 1.x the limit is per endpoint (host, port, ssl)
+                limit=self._limit_per_host,
+                keepalive_timeout=self._keepalive_timeout,
+                use_dns_cache=self._use_dns_cache,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is None:
+            return
+        session, self._session = self._session, None
+        if not session.closed:
+            result = session.close()
+            if inspect.isawaitable(result):
+                await result
+        logger.debug("HTTP client session closed")
+
+
+_manager = None
+
+
+def get_http_client() -> HttpClientManager:
+    """
+    Shared client, configured by ``HTTP_CLIENT`` setting.
+    """
+    global _manager
+    if _manager is None:
+        conf = getattr(settings, "HTTP_CLIENT", {})
+        _manager = HttpClientManager(**conf)
+    return _manager
+
+
+async def close_http_client():
+    """
+    Close shared client, if it was used. Call it before event loop is closed.
+    """
+    global _manager
+    manager, _manager = _manager, None
+    if manager is not None:
+        await manager.close()
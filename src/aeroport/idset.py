@@ -0,0 +1,192 @@
+"""
+Compact set of integer ids. Used to collect ids of all items in a big feed, which
+in plain Python ``set`` costs way too much memory.
+"""
+
+from array import array
+import base64
+from bisect import bisect_left
+import heapq
+from typing import Any, Dict, Iterable, Iterator, List
+import zlib
+
+
+MAX_ID = 2 ** 64 - 1
+
+
+def is_packable_id(value) -> bool:
+    """
+    Whether id fits ``IntIdSet``: non-negative integer up to 64 bits.
+    """
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= MAX_ID
+
+
+class IntIdSet(object):
+    """
+    Set of non-negative 64-bit integers, kept as sorted ``array`` runs (8 bytes per id).
+    Adding is cheap appending, runs are merged lazily when set is read.
+
+    Serialized form is zlib-compressed varint deltas of sorted ids, which is a few bytes
+    per id even for random 56-bit ids produced by ``yml.to_int``.
+    """
+
+    RUN_SIZE = 256 * 1024
+    PACKED_VERSION = 1
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self._runs = []
+        self._pending = array("Q")
+        self.update(ids)
+
+    def add(self, value: int):
+        self._pending.append(value)
+        if len(self._pending) >= self.RUN_SIZE:
+            self._seal_pending()
+
+    def update(self, values: Iterable[int]):
+        for value in values:
+            self.add(value)
+
+    def _seal_pending(self):
+        if self._pending:
+            self._runs.append(array("Q", sorted(set(self._pending))))
+            self._pending = array("Q")
+
+    def _compact(self) -> array:
+        self._seal_pending()
+        if len(self._runs) > 1:
+            merged = array("Q")
+            last = None
+            for value in heapq.merge(*self._runs):
+                if value != last:
+                    merged.append(value)
+                    last = value
+            self._runs = [merged]
+        return self._runs[0] if self._runs else array("Q")
+
+    def __contains__(self, value: int) -> bool:
+        ids = self._compact()
+        idx = bisect_left(ids, value)
+        return idx < len(ids) and ids[idx] == value
+
+    def __len__(self) -> int:
+        return len(self._compact())
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._compact())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, IntIdSet):
+            return NotImplemented
+        return self._compact() == other._compact()
+
+    def __repr__(self):
+        return "<{} of {} ids>".format(self.__class__.__name__, len(self))
+
+    def chunks(self, size: int) -> Iterator[List[int]]:
+        """
+        Sorted ids, split into lists of ``size`` ids at most.
+        """
+        ids = self._compact()
+        for start in range(0, len(ids), size):
+            yield ids[start:start + size].tolist()
+
+    def to_bytes(self) -> bytes:
+        buf = bytearray((self.PACKED_VERSION, ))
+        previous = 0
+        for value in self._compact():
+            delta = value - previous
+            previous = value
+            while delta > 0x7F:
+                buf.append((delta & 0x7F) | 0x80)
+                delta >>= 7
+            buf.append(delta)
+        return zlib.compress(bytes(buf))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "IntIdSet":
+        buf = zlib.decompress(data)
+        if not buf or buf[0] != cls.PACKED_VERSION:
+            raise ValueError("Unknown packed id set format")
+
+        ids = array("Q")
+        previous, delta, shift = 0, 0, 0
+        for byte in buf[1:]:
+            delta |= (byte & 0x7F) << shift
+            if byte & 0x80:
+                shift += 7
+            else:
+                previous += delta
+                ids.append(previous)
+                delta, shift = 0, 0
+
+        result = cls()
+        result._runs = [ids]
+        return result
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.to_bytes()).decode("ascii")
+
+    @classmethod
+    def from_base64(cls, data: str) -> "IntIdSet":
+        return cls.from_bytes(base64.b64decode(data))
+
+
+class IdCollector(object):
+    """
+    Ids of feed items, kept in the same type adapters put them to payloads. While all of
+    them fit ``IntIdSet`` they are stored there compactly. Once the other id appears (string,
+    negative or too big number), collector switches to plain ``set``, which can't be packed.
+    """
+
+    def __init__(self):
+        self._int_ids = IntIdSet()
+        self._values = None
+
+    @property
+    def is_packable(self) -> bool:
+        return self._values is None
+
+    def add(self, value):
+        if self._values is None:
+            if is_packable_id(value):
+                self._int_ids.add(value)
+                return
+            self._values = set(self._int_ids)
+            self._int_ids = None
+        self._values.add(value)
+
+    def __len__(self) -> int:
+        return len(self._int_ids) if self._values is None else len(self._values)
+
+    def __iter__(self) -> Iterator:
+        if self._values is None:
+            return iter(self._int_ids)
+        try:
+            return iter(sorted(self._values))
+        except TypeError:
+            # Ids of different types
+            return iter(list(self._values))
+
+    def to_base64(self) -> str:
+        if self._values is not None:
+            raise ValueError("Only non-negative 64-bit integer ids can be packed")
+        return self._int_ids.to_base64()
+
+    def dump(self) -> Dict[str, Any]:
+        if self._values is None:
+            return {"packed": self._int_ids.to_base64()}
+        return {"values": list(self)}
+
+    @classmethod
+    def load(cls, data) -> "IdCollector":
+        collector = cls()
+        if isinstance(data, str):
+            # Packed ids, as they were stored before
+            data = {"packed": data}
+        if "packed" in data:
+            collector._int_ids = IntIdSet.from_base64(data["packed"])
+        else:
+            for value in data["values"]:
+                collector.add(value)
+        return collector
@@ -2,6 +2,14 @@
 Defining and working with payload.
 """
 
+import array
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from aeroport.abc import AbstractPayload, AbstractField
 
 
@@ -11,6 +19,270 @@ class Field(AbstractField):
 
 class Payload(AbstractPayload):
 
+    __slots__ = ()
+
     def postprocess(self, **kwargs):
         pass
 
+    @classmethod
+    def postprocess_batch(cls, batch: "PayloadBatch", **kwargs):
+        """
+        Postprocess all payloads of the batch at once. Default implementation calls ``postprocess``
+        on every payload, override it to transform whole ``batch`` columns instead.
+        """
+        for idx, payload in enumerate(batch.iter_payloads()):
+            payload.postprocess(**kwargs)
+            batch.set_payload(idx, payload)
+
+
+class _Missing(object):
+    def __repr__(self):
+        return "MISSING"
+
+    def __bool__(self):
+        return False
+
+    def __reduce__(self):
+        # Unpickled batches must still compare their values to the same ``MISSING``
+        return "MISSING"
+
+
+MISSING = _Missing()  # Value of the field, that is not set in payload
+
+
+class NumericColumn(object):
+    """
+    Column of ints (``typecode`` "q") or floats ("d"), stored in ``array.array`` of C numbers,
+    with byte ``mask`` of missing values. Value of any other type raises ``TypeError``
+    (too big int raises ``OverflowError``), ints don't mix with floats.
+    """
+
+    __slots__ = ("values", "mask")
+
+    TYPES = {"q": int, "d": float}
+
+    def __init__(self, typecode: str = "q", values: array.array = None, mask: bytearray = None):
+        self.values = array.array(typecode) if values is None else values
+        self.mask = bytearray(len(self.values)) if mask is None else mask
+
+    def _check(self, value):
+        if type(value) is not self.TYPES[self.values.typecode]:
+            if type(value) is float and self.mask.count(0) == 0:
+                # Column of only missing values yet takes floats as well
+                self.values = array.array("d", bytes(len(self.values) * self.values.itemsize))
+            else:
+                raise TypeError("Column of {} can't store {!r}".format(
+                    self.TYPES[self.values.typecode].__name__, value
+                ))
+
+    def append(self, value):
+        if value is MISSING:
+            self.values.append(0)
+            self.mask.append(1)
+        else:
+            self._check(value)
+            self.values.append(value)
+            self.mask.append(0)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __iter__(self) -> Iterator:
+        for value, missing in zip(self.values, self.mask):
+            yield MISSING if missing else value
+
+    def __getitem__(self, idx: int):
+        return MISSING if self.mask[idx] else self.values[idx]
+
+    def __setitem__(self, idx: int, value):
+        if value is MISSING:
+            self.values[idx] = 0
+            self.mask[idx] = 1
+        else:
+            self._check(value)
+            self.values[idx] = value
+            self.mask[idx] = 0
+
+    def __delitem__(self, idx):
+        del self.values[idx]
+        del self.mask[idx]
+
+
+Column = Union[NumericColumn, list]
+
+
+def make_column(values: Iterable) -> Column:
+    """
+    ``NumericColumn``, if all ``values`` fit in it, otherwise list.
+    """
+    column = NumericColumn()
+    values = iter(values)
+    for value in values:
+        try:
+            column.append(value)
+        except (TypeError, OverflowError):
+            return list(column) + [value] + list(values)
+    return column
+
+
+class PayloadBatch(object):
+    """
+    Payloads of the same class, stored column-wise, fields are in sorted order. Columns of ints
+    or floats are ``NumericColumn``s, column turns into list of values, once value of another
+    type comes. Absent values are ``MISSING``. Every row can also carry a ``tag`` (such as item's
+    original id), which is not a part of payload.
+    """
+
+    def __init__(self, payload_class: type):
+        self.payload_class = payload_class
+        self.fields = tuple(sorted(payload_class.fields))
+        self.columns = {name: NumericColumn() for name in self.fields}
+        self.tags = []
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, payload: AbstractPayload, tag=None):
+        self.append_values(payload.as_dict, tag)
+
+    def append_values(self, values: Dict, tag=None):
+        for name, column in self.columns.items():
+            value = values.get(name, MISSING)
+            try:
+                column.append(value)
+            except (TypeError, OverflowError):
+                self._to_list(name).append(value)
+        self.tags.append(tag)
+        self._size += 1
+
+    def _to_list(self, name: str) -> list:
+        column = self.columns[name] = list(self.columns[name])
+        return column
+
+    def clear(self):
+        self.columns = {name: NumericColumn() for name in self.fields}
+        del self.tags[:]
+        self._size = 0
+
+    def column(self, name: str) -> Column:
+        return self.columns[name]
+
+    def set_column(self, name: str, values: Iterable, keep_missing: bool = True):
+        """
+        Replace column values. NumPy arrays of ints and floats are stored as they are, other ones
+        are converted back to the plain Python values. If ``keep_missing``, values that were
+        missing stay missing.
+        """
+        old = self.columns[name]
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            if len(values) != self._size:
+                raise ValueError("Column '{}' must have {} values, got {}".format(name, self._size, len(values)))
+            if values.dtype.kind in "if":
+                typecode = "q" if values.dtype.kind == "i" else "d"
+                column = NumericColumn(typecode, array.array(typecode, values.astype(typecode).tobytes()))
+                if keep_missing:
+                    column.mask = bytearray(old.mask) if isinstance(old, NumericColumn) else \
+                        bytearray(value is MISSING for value in old)
+                self.columns[name] = column
+                return
+            values = values.tolist()
+        values = list(values)
+        if len(values) != self._size:
+            raise ValueError("Column '{}' must have {} values, got {}".format(name, self._size, len(values)))
+        if keep_missing:
+            values = [MISSING if value is MISSING else new for value, new in zip(old, values)]
+        self.columns[name] = make_column(values)
+
+    def array(self, name: str, dtype=float, missing=float("nan")):
+        """
+        Column as NumPy array, with ``missing`` value instead of missing ones.
+        """
+        if numpy is None:
+            raise ValueError("PayloadBatch.array requires 'numpy' package installed")
+        column = self.columns[name]
+        if not isinstance(column, NumericColumn):
+            return numpy.array([missing if v is MISSING else v for v in column], dtype=dtype)
+        result = numpy.array(column.values, dtype=dtype)
+        if len(column):
+            result[numpy.frombuffer(column.mask, dtype=numpy.uint8).astype(bool)] = missing
+        return result
+
+    def iter_rows(self) -> Iterator[Tuple]:
+        """
+        Tuples of values in ``fields`` order.
+        """
+        return zip(*(self.columns[name] for name in self.fields))
+
+    def get_values(self, idx: int) -> Dict:
+        values = {}
+        for name, column in self.columns.items():
+            value = column[idx]
+            if value is not MISSING:
+                values[name] = value
+        return values
+
+    def iter_values(self) -> Iterator[Dict]:
+        for row in self.iter_rows():
+            yield {name: value for name, value in zip(self.fields, row) if value is not MISSING}
+
+    def iter_payloads(self) -> Iterator[AbstractPayload]:
+        kls = self.payload_class
+        for values in self.iter_values():
+            yield kls(values)
+
+    def set_payload(self, idx: int, payload: AbstractPayload):
+        values = payload.as_dict
+        for name, column in self.columns.items():
+            value = values.get(name, MISSING)
+            try:
+                column[idx] = value
+            except (TypeError, OverflowError):
+                self._to_list(name)[idx] = value
+
+    def select(self, mask: Sequence[bool]) -> "PayloadBatch":
+        """
+        New batch with rows, for which ``mask`` is true.
+        """
+        mask = list(mask)
+        result = PayloadBatch(self.payload_class)
+        for name in self.fields:
+            result.columns[name] = make_column(value for value, keep in zip(self.columns[name], mask) if keep)
+        result.tags = [tag for tag, keep in zip(self.tags, mask) if keep]
+        result._size = len(result.tags)
+        return result
+
+
+class PayloadBatcher(object):
+    """
+    Groups consecutive payloads of the same class into batches of limited size. Batch is
+    closed, when payload of another class comes, so batches keep the order of payloads.
+    """
+
+    def __init__(self, batch_size: int):
+        self._batch_size = batch_size
+        self._batch = None
+
+    def add(self, payload: AbstractPayload, tag=None) -> List[PayloadBatch]:
+        """
+        Add payload and return batches, that are complete now. Caller owns returned batches.
+        """
+        kls = payload.__class__
+        batches = []
+        if self._batch is not None and self._batch.payload_class is not kls:
+            batches.append(self._batch)
+            self._batch = None
+        if self._batch is None:
+            self._batch = PayloadBatch(kls)
+        self._batch.append(payload, tag)
+        if len(self._batch) >= self._batch_size:
+            batches.append(self._batch)
+            self._batch = None
+        return batches
+
+    def flush(self) -> List[PayloadBatch]:
+        """
+        Collected batch, if it is not empty.
+        """
+        batch, self._batch = self._batch, None
+        return [batch] if batch is not None and len(batch) else []
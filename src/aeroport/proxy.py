@@ -2,16 +2,170 @@
 Managing proxies to use with site scrapers and other connections.
 """
 
-from random import randrange
+from collections import namedtuple
+import logging
+from random import sample
+import time
+from typing import Iterable, Optional, Sequence
 
+from sunhead.conf import settings
 
-class ProxyCollection(object):
 
-    PROXIES_LIST = [
-        ("108.59.10.138:55555", "https"),
-    ]
+logger = logging.getLogger(__name__)
 
-    def get_proxy(self):
-        idx = randrange(len(self.PROXIES_LIST))
-        proxy = self.PROXIES_LIST[idx]
-        return proxy
\ No newline at end of file
+
+Proxy = namedtuple("Proxy", "address type")
+
+
+class ProxyStats(object):
+
+    LATENCY_SMOOTHING = 0.2
+    SUCCESS_SMOOTHING = 0.1
+
+    def __init__(self):
+        self.latency = None
+        self.reports = 0
+        self.success_rate = 1.0
+        self.consecutive_failures = 0
+        self.quarantined_until = 0.0
+        self.quarantine_seconds = 0.0
+
+    def get_score(self, unknown_latency: float) -> float:
+        """
+        Expected time to get one successful response, lower is better. Untried proxy is
+        the best, so that every proxy is tried. Proxy, that has only failed so far, is taken
+        as ``unknown_latency`` slow.
+        """
+        if self.latency is not None:
+            latency = self.latency
+        elif self.reports:
+            latency = unknown_latency
+        else:
+            latency = 0.0
+        return latency / max(self.success_rate, 0.01)
+
+
+class ProxyPool(object):
+    """
+    Proxies with health stats. ``get_proxy`` picks the better of two random healthy proxies
+    (power of two choices), so traffic goes to fast proxies without herding on a single one.
+    Proxy, that failed several times in a row, is quarantined for a while, and quarantine
+    gets longer, if it keeps failing after that.
+    """
+
+    QUARANTINE_AFTER = 3
+    QUARANTINE_SECONDS = 30
+    MAX_QUARANTINE_SECONDS = 30 * 60
+    UNKNOWN_LATENCY = 10.0  # For failed proxies, while no proxy of the pool has succeeded
+
+    def __init__(self, proxies: Iterable[Sequence[str]] = ()):
+        self._stats = {}
+        for address, proxy_type in proxies:
+            self.add(Proxy(address, proxy_type))
+
+    @classmethod
+    def from_settings(cls) -> "ProxyPool":
+        """
+        Pool of proxies from ``PROXIES`` setting, list of ``(address, type)`` pairs.
+        """
+        return cls(getattr(settings, "PROXIES", ()))
+
+    def __len__(self) -> int:
+        return len(self._stats)
+
+    def add(self, proxy: Proxy):
+        self._stats.setdefault(proxy, ProxyStats())
+
+    def remove(self, proxy: Proxy):
+        self._stats.pop(proxy, None)
+
+    def get_stats(self, proxy: Proxy) -> ProxyStats:
+        return self._stats[proxy]
+
+    def check_configured(self, types: Optional[Sequence[str]] = None):
+        """
+        Raise ``ValueError``, if there is no proxy of ``types`` in the pool, so that downloader,
+        that must use proxy, doesn't go without it.
+        """
+        if not any(types is None or proxy.type in types for proxy in self._stats):
+            raise ValueError("Proxy is required, but there are no {}proxies in PROXIES setting".format(
+                "{} ".format("/".join(types)) if types else ""
+            ))
+
+    def get_proxy(self, types: Optional[Sequence[str]] = None) -> Optional[Proxy]:
+        candidates = [proxy for proxy in self._stats if types is None or proxy.type in types]
+        if not candidates:
+            return None
+
+        now = time.monotonic()
+        healthy = [proxy for proxy in candidates if self._stats[proxy].quarantined_until <= now]
+        if not healthy:
+            # All are bad, try the one which is going to be released first
+            return min(candidates, key=lambda proxy: self._stats[proxy].quarantined_until)
+        if len(healthy) == 1:
+            return healthy[0]
+        first, second = sample(healthy, 2)
+        unknown_latency = self.get_average_latency()
+        if self._stats[first].get_score(unknown_latency) <= self._stats[second].get_score(unknown_latency):
+            return first
+        return second
+
+    def get_average_latency(self) -> float:
+        """
+        Average latency of the proxies, that have succeeded, or ``UNKNOWN_LATENCY``.
+        """
+        latencies = [stats.latency for stats in self._stats.values() if stats.latency is not None]
+        return sum(latencies) / len(latencies) if latencies else self.UNKNOWN_LATENCY
+
+    def report(self, proxy: Proxy, success: bool, latency: Optional[float] = None):
+        stats = self._stats.get(proxy, None)
+        if stats is None:
+            return
+
+        stats.reports += 1
+        stats.success_rate += ((1.0 if success else 0.0) - stats.success_rate) * stats.SUCCESS_SMOOTHING
+        if success:
+            if latency is not None:
+                stats.latency = latency if stats.latency is None else \
+                    stats.latency + (latency - stats.latency) * stats.LATENCY_SMOOTHING
+            stats.consecutive_failures = 0
+            stats.quarantine_seconds = 0.0
+            return
+
+        stats.consecutive_failures += 1
+        if stats.consecutive_failures >= self.QUARANTINE_AFTER:
+            stats.quarantine_seconds = min(
+                self.MAX_QUARANTINE_SECONDS, max(self.QUARANTINE_SECONDS, stats.quarantine_seconds * 2)
+            )
+            stats.quarantined_until = time.monotonic() + stats.quarantine_seconds
+            stats.consecutive_failures = 0
+            logger.warning("Proxy %s is quarantined for %s seconds", proxy.address, stats.quarantine_seconds)
+
+    def is_quarantined(self, proxy: Proxy) -> bool:
+        stats = self._stats.get(proxy, None)
+        return stats is not None and stats.quarantined_until > time.monotonic()
+
+
+class ProxyCollection(ProxyPool):
+    """
+    Pool of proxies from ``PROXIES`` setting. There are no default proxies, pool is empty,
+    if setting is.
+    """
+
+    def __init__(self, proxies: Optional[Iterable[Sequence[str]]] = None):
+        if proxies is None:
+            proxies = getattr(settings, "PROXIES", None) or ()
+        super().__init__(proxies)
+
+
+_pool = None
+
+
+def get_proxy_pool() -> ProxyPool:
+    """
+    Process-wide pool, so that all downloaders share proxy health stats.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProxyCollection()
+    return _pool
@@ -0,0 +1,178 @@
+"""
+Per-host politeness for downloaders. Every host gets a token bucket (requests per second)
+and adaptive concurrency limit: it grows by one while host answers well, and is halved
+when host answers 429 or 5xx, fails, or its latency grows (AIMD, as TCP congestion control).
+Cancelled requests tell nothing about the host and are not counted.
+Limiters are shared by all origins in the process.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+from urllib import parse
+
+from sunhead.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class HostLimiter(object):
+
+    BACKOFF_STATUSES = frozenset((429, 503))  # Host asks to slow down, requests are paused
+    DECREASE_FACTOR = 0.5
+    LATENCY_TOLERANCE = 3.0  # Latency that many times above usual is the sign of overload
+    LATENCY_SMOOTHING = 0.05
+    BACKOFF_PAUSE = 1.0  # Seconds without requests to the host after it asked to slow down
+
+    def __init__(self, host: str, rate: Optional[float] = None, burst: Optional[int] = None,
+                 min_concurrency: int = 1, max_concurrency: int = 16, initial_concurrency: int = 2):
+        self.host = host
+        self._rate = rate
+        self._burst = burst or (max(1, int(rate)) if rate else None)
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+        self._min_concurrency = min_concurrency
+        self._max_concurrency = max_concurrency
+        self._concurrency = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+        self._active = 0
+        self._successes = 0
+        self._latency = None
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+        self._cond = None
+
+    @property
+    def concurrency(self) -> int:
+        return int(self._concurrency)
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        # Created lazily, so that it belongs to the running loop
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def request(self) -> "LimitedRequest":
+        """
+        Async context manager around one request. Set its ``status`` to the response status.
+        """
+        return LimitedRequest(self)
+
+    async def acquire(self):
+        async with self.condition:
+            while self._active >= self.concurrency:
+                await self.condition.wait()
+            self._active += 1
+        try:
+            await self._wait_for_token()
+        except BaseException:
+            await self._release_slot()
+            raise
+
+    async def _wait_for_token(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            if self._rate is None:
+                return
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self._rate)
+
+    async def release(self, status: Optional[int], latency: float, failed: bool = False,
+                      cancelled: bool = False):
+        if not cancelled:
+            self.record(status, latency, failed)
+        await self._release_slot()
+
+    async def _release_slot(self):
+        async with self.condition:
+            self._active -= 1
+            self.condition.notify_all()
+
+    def record(self, status: Optional[int], latency: float, failed: bool = False):
+        now = time.monotonic()
+        if status in self.BACKOFF_STATUSES:
+            self._paused_until = now + self.BACKOFF_PAUSE
+            self._decrease(now, "status {}".format(status))
+        elif status is not None and status >= 500:
+            self._decrease(now, "status {}".format(status))
+        elif failed:
+            self._decrease(now, "request failed")
+        elif self._latency is not None and latency > self._latency * self.LATENCY_TOLERANCE:
+            self._decrease(now, "latency {:.2f}s".format(latency))
+        else:
+            self._latency = latency if self._latency is None else \
+                self._latency + (latency - self._latency) * self.LATENCY_SMOOTHING
+            # Additive increase: one more slot per window of successful requests
+            self._successes += 1
+            if self._successes >= self.concurrency and self._concurrency < self._max_concurrency:
+                self._concurrency += 1
+                self._successes = 0
+
+    def _decrease(self, now: float, reason: str):
+        # Requests, that were already in flight, would report the same trouble. Decrease once per latency.
+        if now - self._last_decrease < (self._latency or 0):
+            return
+        self._last_decrease = now
+        self._successes = 0
+        self._concurrency = max(self._min_concurrency, self._concurrency * self.DECREASE_FACTOR)
+        logger.info("Slowing down on %s (%s), concurrency %s", self.host, reason, self.concurrency)
+
+
+class LimitedRequest(object):
+
+    def __init__(self, limiter: HostLimiter):
+        self._limiter = limiter
+        self._started = None
+        self.status = None
+
+    async def __aenter__(self):
+        await self._limiter.acquire()
+        self._started = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        failed = exc_type is not None and self.status is None
+        cancelled = exc_type is not None and issubclass(exc_type, asyncio.CancelledError)
+        await self._limiter.release(self.status, time.monotonic() - self._started, failed, cancelled)
+        return False
+
+
+class RateLimiterRegistry(object):
+    """
+    Limiters by host, with parameters from ``RATE_LIMITS`` setting: ``default`` ones,
+    overridden per host in ``hosts``.
+    """
+
+    def __init__(self, config: Optional[Dict] = None):
+        config = config if config is not None else getattr(settings, "RATE_LIMITS", {})
+        self._default = config.get("default", {})
+        self._hosts_config = config.get("hosts", {})
+        self._limiters = {}
+
+    def get(self, url: str) -> HostLimiter:
+        host = parse.urlparse(url).netloc.lower()
+        limiter = self._limiters.get(host, None)
+        if limiter is None:
+            kwargs = dict(self._default)
+            kwargs.update(self._hosts_config.get(host, {}))
+            limiter = self._limiters[host] = HostLimiter(host, **kwargs)
+        return limiter
+
+
+_registry = None
+
+
+def get_rate_limiter(url: str) -> HostLimiter:
+    global _registry
+    if _registry is None:
+        _registry = RateLimiterRegistry()
+    return _registry.get(url)
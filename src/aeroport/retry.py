@@ -0,0 +1,130 @@
+"""
+Retrying of downloads. Transient failures (timeouts, connection errors, 429 and 5xx answers)
+are retried with exponential backoff and full jitter. Retries are limited by a budget, so
+that a host, which is down, does not get several times more requests than usual.
+"""
+
+import asyncio
+from email.utils import parsedate_to_datetime
+import logging
+import random
+import time
+from typing import Callable, Optional
+
+import aiohttp
+
+from sunhead.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadError(Exception):
+    """Url can't be downloaded"""
+
+    def __init__(self, url: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+        message = "Can't download {}".format(url) if status is None else \
+            "Can't download {}, status {}".format(url, status)
+        super().__init__(message)
+
+
+def is_download_failure(error: Exception) -> bool:
+    """
+    Whether the error is about the url, not about the code, that processes it.
+    """
+    return isinstance(error, (DownloadError, ) + RetryPolicy.RETRY_EXCEPTIONS)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Seconds to wait from ``Retry-After`` header, which is either seconds or HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class RetryPolicy(object):
+    """
+    Call download function up to ``max_attempts`` times. Every request adds ``budget_ratio``
+    to retry budget (up to ``max_budget``), every retry takes one from it. Without budget,
+    failure is not retried.
+    """
+
+    DEFAULT_MAX_ATTEMPTS = 4
+    DEFAULT_BASE_DELAY = 0.5
+    DEFAULT_MAX_DELAY = 30.0
+    DEFAULT_RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+    DEFAULT_BUDGET_RATIO = 0.2
+    DEFAULT_MAX_BUDGET = 100.0
+    # Failures, that are worth to try again. Download errors are retried by their status.
+    RETRY_EXCEPTIONS = (asyncio.TimeoutError, aiohttp.ClientError, OSError)
+
+    def __init__(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS, base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY, retry_statuses=DEFAULT_RETRY_STATUSES,
+                 budget_ratio: float = DEFAULT_BUDGET_RATIO, max_budget: float = DEFAULT_MAX_BUDGET):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = frozenset(retry_statuses)
+        self.budget_ratio = budget_ratio
+        self.max_budget = max_budget
+        # Start with some budget, so that failures at the very beginning are retried too
+        self._budget = min(max_budget, 10.0)
+
+    @classmethod
+    def from_settings(cls) -> "RetryPolicy":
+        """
+        Policy with parameters from ``RETRY_POLICY`` setting.
+        """
+        return cls(**getattr(settings, "RETRY_POLICY", {}))
+
+    @property
+    def budget(self) -> float:
+        return self._budget
+
+    def is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, DownloadError):
+            return error.status is None or error.status in self.retry_statuses
+        return isinstance(error, self.RETRY_EXCEPTIONS)
+
+    def get_delay(self, attempt: int, error: Optional[Exception] = None) -> float:
+        """
+        Pause before the retry number ``attempt`` (starting from 1). Server's ``Retry-After`` wins.
+        """
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def call(self, func: Callable, *args, **kwargs):
+        """
+        Await ``func(*args, **kwargs)``, retrying it on transient failures.
+        The last error is raised, if all attempts failed.
+        """
+        self._budget = min(self.max_budget, self._budget + self.budget_ratio)
+        attempt = 1
+        while True:
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_attempts or not self.is_retryable(e):
+                    raise
+                if self._budget < 1:
+                    logger.warning("Retry budget is exhausted, not retrying: %s", e)
+                    raise
+                self._budget -= 1
+                delay = self.get_delay(attempt, e)
+                logger.info("Attempt %s failed (%s), retrying in %.2fs", attempt, e, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
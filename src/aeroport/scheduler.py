@@ -0,0 +1,225 @@
+"""
+Queue of flights to run. Cron entries and API requests enqueue flights here instead of
+starting them right away, and scheduler starts them as long as global and per-airline
+limits allow. The same origin of the same airline is never queued or run twice at once.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from sunhead.conf import settings
+from sunhead.metrics import get_metrics
+
+from aeroport.dispatch import process_origin
+from aeroport.utils import register_metric
+
+
+logger = logging.getLogger(__name__)
+
+
+class PendingFlight(object):
+
+    def __init__(self, airline_name: str, origin_name: str, destination_name: Optional[str],
+                 priority: int, options: Dict):
+        self.airline_name = airline_name
+        self.origin_name = origin_name
+        self.destination_name = destination_name
+        self.priority = priority
+        self.options = options
+        self.enqueued = time.monotonic()
+        self.uuid = uuid.uuid4()
+
+    @property
+    def key(self):
+        return self.airline_name, self.origin_name
+
+    def as_dict(self) -> Dict:
+        return {
+            "uuid": str(self.uuid),
+            "airline": self.airline_name,
+            "origin": self.origin_name,
+            "destination": self.destination_name,
+            "priority": self.priority,
+            "waiting": round(time.monotonic() - self.enqueued, 3),
+        }
+
+
+class FlightScheduler(object):
+    """
+    Runs up to ``max_running`` flights, and up to ``max_per_airline`` of them for one
+    airline (can be set per airline in ``airlines``). Pending flights are started by
+    priority (higher first), then in order they were enqueued.
+    """
+
+    DEFAULT_MAX_RUNNING = 4
+    DEFAULT_MAX_PER_AIRLINE = 2
+
+    def __init__(self, max_running: int = DEFAULT_MAX_RUNNING, max_per_airline: int = DEFAULT_MAX_PER_AIRLINE,
+                 airlines: Optional[Dict[str, int]] = None):
+        self._max_running = max_running
+        self._max_per_airline = max_per_airline
+        self._airline_limits = airlines or {}
+        self._queue = []
+        self._seq = itertools.count()
+        self._keys = set()  # Pending and running (airline, origin) pairs
+        self._running = {}  # Key -> PendingFlight
+        self._running_by_airline = {}
+        self._tasks = {}  # Pending flight uuid -> task, running it
+        self._stopped = False
+
+        self._metrics = get_metrics()
+        self._metric_depth = register_metric(
+            self._metrics, "gauge", "flights_queue_depth", "Flights waiting to start"
+        )
+        self._metric_running = register_metric(
+            self._metrics, "gauge", "flights_running", "Flights started by scheduler and running now"
+        )
+        self._metric_wait = register_metric(
+            self._metrics, "summary", "flights_queue_wait_seconds", "Time flights spent in the queue"
+        )
+
+    @classmethod
+    def from_settings(cls) -> "FlightScheduler":
+        return cls(**getattr(settings, "FLIGHT_SCHEDULER", {}))
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    def get_airline_limit(self, airline_name: str) -> int:
+        return self._airline_limits.get(airline_name, self._max_per_airline)
+
+    def enqueue(self, airline_name: str, origin_name: str, destination_name: Optional[str] = None,
+                priority: int = 0, **options) -> Optional[PendingFlight]:
+        """
+        Put flight to the queue and start it, if limits allow.
+
+        :return: Queued flight, or None if the same origin is already pending or running.
+        """
+        if self._stopped:
+            raise ValueError("Scheduler is stopped")
+        pending = PendingFlight(airline_name, origin_name, destination_name, priority, options)
+        if pending.key in self._keys:
+            logger.info("Flight of %s %s is already queued or running, skipping", airline_name, origin_name)
+            return None
+        self._keys.add(pending.key)
+        heapq.heappush(self._queue, (-priority, next(self._seq), pending))
+        self._start_pending()
+        return pending
+
+    def cancel(self, flight_uuid: uuid.UUID) -> bool:
+        """
+        Drop pending flight, or cancel running one, by uuid it got when enqueued.
+
+        :return: False if there is no such flight pending or running.
+        """
+        task = self._tasks.get(flight_uuid)
+        if task is not None:
+            task.cancel()
+            return True
+        for i, (_, _, pending) in enumerate(self._queue):
+            if pending.uuid == flight_uuid:
+                self._queue[i] = self._queue[-1]
+                self._queue.pop()
+                heapq.heapify(self._queue)
+                self._keys.discard(pending.key)
+                logger.info("Pending flight of %s %s is cancelled", pending.airline_name, pending.origin_name)
+                self._update_gauges()
+                return True
+        return False
+
+    def _has_room(self, pending: PendingFlight) -> bool:
+        running_for_airline = self._running_by_airline.get(pending.airline_name, 0)
+        return running_for_airline < self.get_airline_limit(pending.airline_name)
+
+    def _start_pending(self):
+        skipped = []
+        while self._queue and len(self._running) < self._max_running:
+            entry = heapq.heappop(self._queue)
+            pending = entry[2]
+            if self._has_room(pending):
+                self._launch(pending)
+            else:
+                skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+        self._update_gauges()
+
+    def _launch(self, pending: PendingFlight):
+        self._running[pending.key] = pending
+        self._running_by_airline[pending.airline_name] = self._running_by_airline.get(pending.airline_name, 0) + 1
+        self._metrics.summaries.get(self._metric_wait).observe(time.monotonic() - pending.enqueued)
+        task = asyncio.ensure_future(self._run(pending))
+        self._tasks[pending.uuid] = task
+        # Not in ``_run``, task may be cancelled before it starts
+        task.add_done_callback(lambda _: self._finish(pending))
+
+    async def _run(self, pending: PendingFlight):
+        logger.info(
+            "Starting flight: airline=%s, origin=%s, destination=%s",
+            pending.airline_name, pending.origin_name, pending.destination_name
+        )
+        try:
+            await process_origin(
+                pending.airline_name, pending.origin_name, pending.destination_name,
+                use_await=True, **pending.options
+            )
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.error("Flight of %s %s failed", pending.airline_name, pending.origin_name, exc_info=True)
+
+    def _finish(self, pending: PendingFlight):
+        del self._tasks[pending.uuid]
+        del self._running[pending.key]
+        self._running_by_airline[pending.airline_name] -= 1
+        self._keys.discard(pending.key)
+        if not self._stopped:
+            self._start_pending()
+        else:
+            self._update_gauges()
+
+    def _update_gauges(self):
+        self._metrics.gauges.get(self._metric_depth).set(len(self._queue))
+        self._metrics.gauges.get(self._metric_running).set(len(self._running))
+
+    def get_state(self) -> Dict[str, List[Dict]]:
+        return {
+            "running": [pending.as_dict() for pending in self._running.values()],
+            "pending": [entry[2].as_dict() for entry in sorted(self._queue)],
+        }
+
+    async def stop(self):
+        """
+        Stop starting new flights and forget pending ones. Running flights are stopped
+        by the supervisor.
+        """
+        self._stopped = True
+        for _, _, pending in self._queue:
+            self._keys.discard(pending.key)
+        if self._queue:
+            logger.info("Dropping %s pending flights", len(self._queue))
+        self._queue = []
+        self._update_gauges()
+
+
+_scheduler = None
+
+
+def get_flight_scheduler() -> FlightScheduler:
+    """
+    Process-wide scheduler, configured by ``FLIGHT_SCHEDULER`` setting.
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FlightScheduler.from_settings()
+    return _scheduler
@@ -4,18 +4,30 @@ Website scraping, using some scriptable browser like PhantomJS.
 
 import asyncio
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 import logging
-from typing import Dict
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib import parse
 
 import aiohttp
 from splinter import Browser
+from sunhead.conf import settings
 
 from aeroport.abc import (
-    AbstractOrigin, AbstractDownloader, AbstractUrlGenerator, AbstractItemAdapter, AbstractPayload,
+    AbstractOrigin, AbstractDownloader, AbstractUrlGenerator, AbstractItemAdapter, AbstractPayload, UrlInfo,
 )
+from aeroport.browserpool import BrowserPool
 from aeroport.dispatch import Flight
-from aeroport.proxy import ProxyCollection
+from aeroport.frontier import CrawlFrontier, FrontierUrlGenerator
+from aeroport.httpcache import get_http_cache
+from aeroport.httpclient import get_http_client
+from aeroport.ratelimit import get_rate_limiter
+from aeroport.payload import PayloadBatcher
+from aeroport.proxy import Proxy, get_proxy_pool
+from aeroport.retry import DownloadError, RetryPolicy, is_download_failure, parse_retry_after
 
 
 logger = logging.getLogger(__name__)
@@ -24,36 +36,129 @@ logger = logging.getLogger(__name__)
 SchemeItem = namedtuple("SchemeItem", "urlgenerator adapters")
 
 
-class AiohttpDownloader(AbstractDownloader):
+# Responses, that tell more about proxy, than about the page
+PROXY_FAILURE_STATUSES = frozenset((403, 407, 429, 502, 503, 504))
+
 
-    # TODO: Add proxy usage here
+class AiohttpDownloader(AbstractDownloader):
 
     DEFAULT_TIMEOUT = 15
+    FETCH_CONCURRENCY = 32
+    USE_PROXY = False
+    PROXY_TYPES = ("http", "https")
+    USE_HTTP_CACHE = None  # None is to follow HTTP_CACHE setting
+    HTTP_CACHE_TTL = None  # Seconds pages are fresh, regardless of their headers
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._use_http_cache = self.USE_HTTP_CACHE
+        self._http_cache_ttl = self.HTTP_CACHE_TTL
+        if self.USE_PROXY:
+            get_proxy_pool().check_configured(self.PROXY_TYPES)
+
+    def set_options(self, **options):
+        self._use_http_cache = options.pop("http_cache", self.USE_HTTP_CACHE)
+        self._http_cache_ttl = options.pop("http_cache_ttl", self.HTTP_CACHE_TTL)
+        super().set_options(**options)
+
+    @property
+    def use_http_cache(self) -> bool:
+        if self._use_http_cache is not None:
+            return self._use_http_cache
+        return getattr(settings, "HTTP_CACHE", {}).get("enabled", False)
+
+    @property
+    def http_cache_ttl(self) -> Optional[int]:
+        if self._http_cache_ttl is not None:
+            return self._http_cache_ttl
+        return getattr(settings, "HTTP_CACHE", {}).get("ttl", None)
 
     async def get_html_from_url(self, url: str) -> str:
-        with aiohttp.Timeout(self.timeout):
-            logger.debug("Fetching %s", url)
-            response = await aiohttp.get(url)
-            assert response.status == 200
-            html = await response.text()
+        if not self.use_http_cache:
+            html, _ = await self.fetch_url(url)
+            return html
+
+        cache = get_http_cache()
+        entry = await cache.load(url)
+        if entry is not None and entry.is_fresh():
+            logger.debug("Cache hit %s", url)
+            return entry.html
+
+        headers = entry.get_conditional_headers() if entry is not None else None
+        html, response_headers = await self.fetch_url(url, headers)
+        if html is None:
+            logger.debug("Cache revalidated %s", url)
+            cache.refresh_entry(entry, response_headers, self.http_cache_ttl)
+            html = entry.html
+        else:
+            stale_entry = entry
+            entry = cache.make_entry(url, html, response_headers, self.http_cache_ttl)
+            if entry is None and stale_entry is not None:
+                # Page is not cacheable anymore, previous version must not be revalidated
+                await cache.remove(url)
+        if entry is not None:
+            await cache.store(entry)
         return html
 
+    async def fetch_url(self, url: str, headers: Optional[Dict] = None):
+        """
+        Download the page. With conditional ``headers``, page is None, if it was not modified.
+
+        :return: Page and response headers.
+        """
+        session = get_http_client().session
+        proxy_pool = get_proxy_pool()
+        proxy = proxy_pool.get_proxy(self.PROXY_TYPES) if self.USE_PROXY else None
+        started = time.monotonic()
+        html = None
+        async with get_rate_limiter(url).request() as request:
+            try:
+                with aiohttp.Timeout(self.timeout):
+                    logger.debug("Fetching %s", url)
+                    proxy_url = "http://{}".format(proxy.address) if proxy is not None else None
+                    async with session.get(url, headers=headers, proxy=proxy_url) as response:
+                        request.status = response.status
+                        if response.status != 200 and not (headers and response.status == 304):
+                            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                            raise DownloadError(url, response.status, retry_after)
+                        if response.status == 200:
+                            html = await response.text()
+                        response_headers = response.headers
+            finally:
+                if proxy is not None:
+                    proxy_ok = request.status is not None and request.status not in PROXY_FAILURE_STATUSES
+                    proxy_pool.report(proxy, proxy_ok, time.monotonic() - started)
+        return html, response_headers
+
     @property
     def timeout(self) -> int:
         return self.DEFAULT_TIMEOUT
 
+    @property
+    def fetch_concurrency(self) -> int:
+        return self.FETCH_CONCURRENCY
+
 
 class BrowserDownloader(AbstractDownloader):
     BROWSER_DRIVER = "phantomjs"
     DEFAULT_BROWSER_ARGS = ["--load-images=false"]
     MAX_BROWSERS = 5
+    BROWSER_MAX_PAGES = BrowserPool.MAX_PAGES  # Browser is restarted after that many pages
     USE_PROXY = False
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._browser = None
+        self._browser_pool = None
         self.sem = asyncio.Semaphore(self.MAX_BROWSERS)
-        self.proxy_collection = ProxyCollection()
+        self.proxy_collection = get_proxy_pool()
+        if self.USE_PROXY:
+            # Browser failures are retried as download ones, so fail before any browser starts
+            self.proxy_collection.check_configured()
+
+    @property
+    def fetch_concurrency(self) -> int:
+        return self.MAX_BROWSERS
 
     @property
     def browser(self) -> Browser:
@@ -65,20 +170,39 @@ class BrowserDownloader(AbstractDownloader):
     def browser(self, value):
         self._browser = value
 
+    @property
+    def browser_pool(self) -> BrowserPool:
+        if self._browser_pool is None:
+            self._browser_pool = BrowserPool(
+                self._get_browser, self.MAX_BROWSERS, self.BROWSER_MAX_PAGES, health_check=self._is_proxy_healthy,
+            )
+        return self._browser_pool
+
     def _get_browser(self) -> Browser:
-        service_args = self.DEFAULT_BROWSER_ARGS
+        service_args = list(self.DEFAULT_BROWSER_ARGS)
 
+        proxy = None
         if self.USE_PROXY:
-            p_address, p_type = self.proxy_collection.get_proxy()
-            service_args.append("--proxy={}".format(p_address))
-            service_args.append("--proxy-type={}".format(p_type))
+            proxy = self.proxy_collection.get_proxy()
+            service_args.append("--proxy={}".format(proxy.address))
+            service_args.append("--proxy-type={}".format(proxy.type))
 
         browser = Browser(self.BROWSER_DRIVER, service_args=service_args)
+        browser.aeroport_proxy = proxy  # Browser is bound to its proxy for its whole life
         return browser
 
-    def _download_url_with_browser(self, url) -> str:
-        with self._get_browser() as browser:
-            logger.info("Fetching %s", url)
+    def _is_proxy_healthy(self, browser: Browser) -> bool:
+        proxy = getattr(browser, "aeroport_proxy", None)
+        if proxy is None or not self.proxy_collection.is_quarantined(proxy):
+            return True
+        # Keep the browser, if all proxies are quarantined and new one would get no better proxy
+        return self.proxy_collection.get_proxy() == proxy
+
+    def _fetch_with_browser(self, browser: Browser, url: str) -> str:
+        logger.info("Fetching %s", url)
+        proxy = getattr(browser, "aeroport_proxy", None)  # type: Proxy
+        started = time.monotonic()
+        try:
             browser.visit(url)
             # TODO: Investigate wait necessity
             # _ = browser.is_element_not_present_by_tag("body", wait_time=2)
@@ -86,17 +210,51 @@ class BrowserDownloader(AbstractDownloader):
 
             # For some reason, splinter page analyzing not working, so using BS
             html = browser.html
+        except Exception:
+            if proxy is not None:
+                self.proxy_collection.report(proxy, False)
+            raise
+        if proxy is not None:
+            self.proxy_collection.report(proxy, True, time.monotonic() - started)
         return html
 
+    def _download_url_with_browser(self, url) -> str:
+        return self.browser_pool.run(partial(self._fetch_with_browser, url=url))
+
     async def get_html_from_url(self, url: str) -> str:
         loop = asyncio.get_event_loop()
-        async with self.sem:
+        async with self.sem, get_rate_limiter(url).request():
             downloader = partial(self._download_url_with_browser, url)
-            html = await loop.run_in_executor(None, downloader)
+            try:
+                html = await loop.run_in_executor(self.browser_pool.executor, downloader)
+            except Exception as e:
+                # Browser has no status codes, its failures are retried as network ones
+                raise DownloadError(url) from e
         return html
 
+    async def close(self):
+        if self._browser_pool is not None:
+            self._browser_pool.close()
+            self._browser_pool = None
+        await super().close()
+
 
 class ScrapingOrigin(AbstractDownloader, AbstractOrigin):
+    """
+    Pages of every scheme are fetched by ``fetch_concurrency`` workers ahead of processing.
+    With ``PRESERVE_ORDER`` (or ``preserve_order`` option) pages are processed in the order
+    of urls, otherwise in the order they are fetched.
+
+    With ``PARSE_WORKERS`` (or ``parse_workers`` option) payloads are extracted from pages
+    in that many processes, while the next pages are fetched. Adapters and payload classes
+    must be picklable then.
+
+    Downloads are retried by ``retry_policy``. Urls, that still failed, don't stop the crawl:
+    they are tried once more after all other urls, and then reported to the flight.
+
+    Scheme's ``FrontierUrlGenerator`` gets the frontier of this origin. Links, that adapters
+    find on the pages (``extract_links_from_html``), are added to it.
+    """
 
     SCRAPE_SCHEMES = (
         SchemeItem(
@@ -107,24 +265,278 @@ class ScrapingOrigin(AbstractDownloader, AbstractOrigin):
         ),
     )
 
+    BATCH_SIZE = 0  # Postprocess and send payloads one by one
+    PRESERVE_ORDER = False
+    LOOKAHEAD_FACTOR = 4  # Pages fetched ahead of processing, per fetch worker
+    PARSE_WORKERS = 0  # Extract payloads in the event loop
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._batch_size = self.BATCH_SIZE
+        self._preserve_order = self.PRESERVE_ORDER
+        self._fetch_concurrency = None
+        self._parse_workers = self.PARSE_WORKERS
+        self._parse_executor = None
+        self._retry_policy = None
+
+    def set_options(self, **options):
+        self._batch_size = options.pop("batch_size", self.BATCH_SIZE)
+        self._preserve_order = options.pop("preserve_order", self.PRESERVE_ORDER)
+        self._fetch_concurrency = options.pop("fetch_concurrency", None)
+        self._parse_workers = options.pop("parse_workers", self.PARSE_WORKERS)
+        super().set_options(**options)
+
+    def get_frontier(self, name: str = "default") -> CrawlFrontier:
+        """
+        Persistent frontier of this origin, to be used with ``FrontierUrlGenerator`` in schemes.
+        """
+        path = os.path.join(settings.FRONTIER_DIR, self.airline.name, self.name, "{}.sqlite".format(name))
+        return CrawlFrontier(path)
+
+    def get_urlgenerator(self, scheme: SchemeItem) -> AbstractUrlGenerator:
+        kls = scheme.urlgenerator
+        if isinstance(kls, type) and issubclass(kls, FrontierUrlGenerator):
+            return kls(self.get_frontier(kls.get_frontier_name()))
+        return kls()
+
+    @property
+    def retry_policy(self) -> RetryPolicy:
+        if self._retry_policy is None:
+            self._retry_policy = RetryPolicy.from_settings()
+        return self._retry_policy
+
+    @property
+    def parse_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self._parse_executor is None and self._parse_workers:
+            self._parse_executor = ProcessPoolExecutor(max_workers=self._parse_workers)
+        return self._parse_executor
+
+    async def close(self):
+        if self._parse_executor is not None:
+            self._parse_executor.shutdown(wait=False)
+            self._parse_executor = None
+        await super().close()
 
     async def process(self):
         flight = Flight(self)
         await flight.start()
         num = 0
-        for scheme in self.SCRAPE_SCHEMES:
-            adapters = tuple((cls(**init_kwargs) for cls, init_kwargs in scheme.adapters))
-            async for url_info in scheme.urlgenerator():
-                html = await self.get_html_from_url(url_info.url)
-                for adapter in adapters:
-                    for num, payload in enumerate(adapter.gen_payload_from_html(html), start=1):
-                        if payload is not None:
-                            payload.postprocess(**url_info.kwargs)
-                            await self.send_to_destination(payload)
+        try:
+            for scheme in self.SCRAPE_SCHEMES:
+                adapters = tuple((cls(**init_kwargs) for cls, init_kwargs in scheme.adapters))
+                urlgenerator = self.get_urlgenerator(scheme)
+                try:
+                    num += await self.crawl(urlgenerator, adapters, flight)
+                finally:
+                    await urlgenerator.close()
+        finally:
+            await self.close()
         await flight.finish(num)
 
+    async def crawl(self, urlgenerator: AbstractUrlGenerator, adapters: Sequence[AbstractItemAdapter],
+                    flight: Optional[Flight] = None) -> int:
+        """
+        Fetch urls from generator with several workers and process pages as they come.
+        Failed urls are retried at the end. Pages, recovered then, may add links to the
+        generator, so it is crawled again, until there is nothing left to retry.
+
+        :return: Number of payloads sent.
+        """
+        num = 0
+        while True:
+            failed = []
+            num += await self._crawl_pass(urlgenerator, adapters, flight, failed)
+            if not failed:
+                return num
+            num += await self.retry_failed(failed, adapters, flight, urlgenerator)
+
+    async def _crawl_pass(self, urlgenerator: AbstractUrlGenerator, adapters: Sequence[AbstractItemAdapter],
+                          flight: Optional[Flight], failed: List) -> int:
+        concurrency = self._fetch_concurrency or self.fetch_concurrency
+        # Limits pages, that are fetched, but not processed yet
+        window = asyncio.Semaphore(concurrency * self.LOOKAHEAD_FACTOR)
+        urls = asyncio.Queue(maxsize=concurrency)
+        pages = asyncio.Queue()
+
+        async def produce():
+            seq = 0
+            try:
+                async for url_info in urlgenerator:
+                    await window.acquire()
+                    await urls.put((seq, url_info))
+                    seq += 1
+            except Exception as e:
+                # Fetch workers would wait for urls forever, so stop processing right away
+                pages.put_nowait(e)
+                return
+            for _ in range(concurrency):
+                await urls.put(None)
+
+        async def fetch():
+            while True:
+                task = await urls.get()
+                if task is None:
+                    await pages.put(None)
+                    return
+                seq, url_info = task
+                try:
+                    content = await self.fetch_page(url_info, adapters)
+                except Exception as e:
+                    await pages.put((seq, url_info, None, e))
+                else:
+                    await pages.put((seq, url_info, content, None))
+
+        workers = [asyncio.ensure_future(produce())]
+        workers.extend(asyncio.ensure_future(fetch()) for _ in range(concurrency))
+        num = 0
+        pending = {}
+        next_seq = 0
+        finished = 0
+        try:
+            while finished < concurrency:
+                page = await pages.get()
+                if page is None:
+                    finished += 1
+                    continue
+                if isinstance(page, Exception):
+                    raise page
+                if not self._preserve_order:
+                    num += await self._process_fetched(page, adapters, flight, urlgenerator, failed)
+                    window.release()
+                    continue
+                pending[page[0]] = page
+                while next_seq in pending:
+                    num += await self._process_fetched(pending.pop(next_seq), adapters, flight, urlgenerator, failed)
+                    window.release()
+                    next_seq += 1
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+        return num
+
+    async def fetch_page(self, url_info: UrlInfo, adapters: Sequence[AbstractItemAdapter]):
+        content = await self.retry_policy.call(self.get_html_from_url, url_info.url)
+        if self.parse_executor is not None:
+            content = await self.extract_in_executor(content, adapters)
+        return content
+
+    async def retry_failed(self, failed, adapters: Sequence[AbstractItemAdapter], flight: Optional[Flight],
+                           urlgenerator: Optional[AbstractUrlGenerator] = None) -> int:
+        """
+        Try failed urls once more, one by one. Those, that fail again, are reported to the flight.
+        """
+        logger.info("Retrying %s failed urls", len(failed))
+        num = 0
+        for url_info, error in failed:
+            if self.retry_policy.is_retryable(error):
+                try:
+                    content = await self.fetch_page(url_info, adapters)
+                except Exception as e:
+                    if not is_download_failure(e):
+                        raise
+                    error = e
+                else:
+                    num += await self._process_fetched((None, url_info, content, None), adapters, flight, urlgenerator)
+                    continue
+            logger.error("Failed to download %s: %r", url_info.url, error)
+            if flight is not None:
+                flight.add_failed_url(url_info.url, error)
+        return num
+
+    async def _process_fetched(self, page, adapters, flight: Optional[Flight],
+                               urlgenerator: Optional[AbstractUrlGenerator] = None, failed=None) -> int:
+        seq, url_info, content, error = page
+        if error is not None:
+            if failed is None or not is_download_failure(error):
+                raise error
+            failed.append((url_info, error))
+            if urlgenerator is not None:
+                urlgenerator.mark_failed(url_info)
+            return 0
+        if self.parse_executor is not None:
+            num = await self.process_payload_tuples([tuples for tuples, _ in content], url_info)
+            links = [link for _, adapter_links in content for link in adapter_links]
+        else:
+            num = await self.process_page(content, url_info, adapters)
+            links = [link for adapter in adapters for link in adapter.extract_links_from_html(content)]
+        if urlgenerator is not None:
+            # Before the page is done, so that generator doesn't stop for lack of urls
+            self.add_links(urlgenerator, links, url_info)
+            urlgenerator.mark_done(url_info)
+        if flight is not None:
+            await flight.add_num_processed(num)
+        return num
+
+    async def extract_in_executor(self, html: str, adapters: Sequence[AbstractItemAdapter]) -> List[Tuple[List, List]]:
+        """
+        Extract payload tuples and links from the page by every adapter in ``parse_executor`` processes.
+        """
+        loop = asyncio.get_event_loop()
+        return await asyncio.gather(*(
+            loop.run_in_executor(self.parse_executor, adapter.extract_from_html, html) for adapter in adapters
+        ))
+
+    def add_links(self, urlgenerator: AbstractUrlGenerator, links: Iterable, url_info: UrlInfo) -> int:
+        """
+        Add links, found on the page, to the generator. Relative ones are resolved against page url.
+        """
+        num = 0
+        for link in links:
+            if isinstance(link, UrlInfo):
+                url, kwargs = link.url, link.kwargs
+            else:
+                url, kwargs = link, None
+            num += urlgenerator.add(parse.urljoin(url_info.url, url), kwargs=kwargs)
+        return num
+
+    async def process_page(self, html: str, url_info: UrlInfo, adapters: Sequence[AbstractItemAdapter]) -> int:
+        """
+        Extract payloads from the page, postprocess and send them.
+
+        :return: Number of payloads sent.
+        """
+        return await self.send_payloads((adapter.gen_payload_from_html(html) for adapter in adapters), url_info)
+
+    async def process_payload_tuples(self, extracted: Sequence[Sequence[Tuple[type, Dict]]], url_info: UrlInfo) -> int:
+        """
+        Same as ``process_page`` for payloads, that are already extracted as tuples.
+        """
+        return await self.send_payloads(
+            ((payload_class(values) for payload_class, values in tuples) for tuples in extracted), url_info
+        )
+
+    async def send_payloads(self, payloads_by_adapter: Iterable[Iterable[AbstractPayload]], url_info: UrlInfo) -> int:
+        num = 0
+        for payloads in payloads_by_adapter:
+            if self._batch_size:
+                num += await self.process_payloads_batched(payloads, url_info.kwargs)
+                continue
+            for payload in payloads:
+                if payload is not None:
+                    payload.postprocess(**url_info.kwargs)
+                    await self.send_to_destination(payload)
+                    num += 1
+        return num
+
+    async def process_payloads_batched(self, payloads: Iterable[AbstractPayload], postprocess_kwargs: Dict) -> int:
+        """
+        Postprocess and send payloads of one page in batches of ``batch_size``.
+        """
+        batcher = PayloadBatcher(self._batch_size)
+        num = 0
+        for payload in payloads:
+            if payload is None:
+                continue
+            num += 1
+            for batch in batcher.add(payload):
+                batch.payload_class.postprocess_batch(batch, **postprocess_kwargs)
+                await self.send_batch_to_destination(batch)
+        for batch in batcher.flush():
+            batch.payload_class.postprocess_batch(batch, **postprocess_kwargs)
+            await self.send_batch_to_destination(batch)
+        return num
+
 
 class BrowserScrapingOrigin(BrowserDownloader, ScrapingOrigin):
     pass
@@ -37,6 +37,87 @@ FILE_URL_CACHE = {
     "expires": os.environ.get("AERORPORT_FILE_URL_CACHE_EXPIRES", 3600 * 12),
 }
 
+# Cache of pages, fetched by scraping origins with aiohttp. Pages are fresh by response headers,
+# unless "ttl" (seconds) is set. Origins can override both with http_cache and http_cache_ttl options.
+HTTP_CACHE = {
+    "enabled": os.environ.get("AEROPORT_HTTP_CACHE", "False") == "True",
+    "ttl": None,
+    "storage": {
+        "class": "aeroport.storage.fs_storage.FileSystemStorage",
+        "bucket": "httpcache",
+        "url_template": None,
+        "fs_nesting_depth": 2,
+        "storage_path": os.path.join(DATA_DIR, "httpcache"),
+    },
+}
+
+SPOOL_DIR = os.path.join(DATA_DIR, "spool")
+DELTA_INDEX_DIR = os.path.join(DATA_DIR, "delta")
+CHECKPOINT_DIR = os.path.join(DATA_DIR, "checkpoints")
+FRONTIER_DIR = os.path.join(DATA_DIR, "frontier")
+
+# How non-numeric yml ids are turned into integers: "md5" (compatible with existing data) or "xxh64"
+YML_ID_HASH = os.environ.get("AEROPORT_YML_ID_HASH", "md5")
+# XML parser for yml feeds: "auto" (lxml if installed), "lxml" or "stdlib"
+YML_PARSER_ENGINE = os.environ.get("AEROPORT_YML_PARSER_ENGINE", "auto")
+# Seconds between checkpoints of yml feed processing, 0 disables checkpoints
+YML_CHECKPOINT_INTERVAL = int(os.environ.get("AEROPORT_YML_CHECKPOINT_INTERVAL", 60))
+# Shared HTTP client connection pool
+HTTP_CLIENT = {
+    "limit_per_host": int(os.environ.get("AEROPORT_HTTP_LIMIT_PER_HOST", 16)),
+    "keepalive_timeout": 30,
+    "use_dns_cache": True,
+}
+
+# Per-host request limits for scraping: rate is requests per second (None is unlimited),
+# concurrency adapts between min_concurrency and max_concurrency
+RATE_LIMITS = {
+    "default": {
+        "rate": None,
+        "min_concurrency": 1,
+        "max_concurrency": 16,
+        "initial_concurrency": 2,
+    },
+    "hosts": {},
+}
+
+# Retries of failed downloads, see aeroport.retry.RetryPolicy for all parameters
+RETRY_POLICY = {
+    "max_attempts": 4,
+    "base_delay": 0.5,
+    "max_delay": 30.0,
+}
+
+# Proxies for scraping downloaders, list of (address, type) pairs, e.g. ("10.0.0.1:3128", "http").
+# Downloaders with USE_PROXY refuse to start, if there are no proxies of their types here
+PROXIES = []
+
+# Limits for flights, started by cron and API: all together, per airline by default, and for
+# specific airlines, e.g. "airlines": {"air_example": 1}
+FLIGHT_SCHEDULER = {
+    "max_running": int(os.environ.get("AEROPORT_MAX_RUNNING_FLIGHTS", 4)),
+    "max_per_airline": 2,
+    "airlines": {},
+}
+
+# Distributed mode: cron and API put flights to the queue in the database, and they are run
+# by "aeroport worker" processes with the options below, instead of the server itself
+DISTRIBUTED_FLIGHTS = os.environ.get("AEROPORT_DISTRIBUTED_FLIGHTS", "False") == "True"
+FLIGHT_WORKER = {
+    "concurrency": int(os.environ.get("AEROPORT_WORKER_CONCURRENCY", 2)),
+    "lease_timeout": 60,
+    "heartbeat_interval": 15,
+    "poll_interval": 5,
+    "max_attempts": 3,
+}
+
+# Seconds to wait for running flights to stop and release their destinations on shutdown
+FLIGHT_SHUTDOWN_TIMEOUT = int(os.environ.get("AEROPORT_FLIGHT_SHUTDOWN_TIMEOUT", 30))
+
+# Process-wide limits for all yml origins
+YML_MAX_CONCURRENT_DOWNLOADS = int(os.environ.get("AEROPORT_YML_MAX_CONCURRENT_DOWNLOADS", 4))
+YML_MAX_CONCURRENT_PARSES = int(os.environ.get("AEROPORT_YML_MAX_CONCURRENT_PARSES", 2))
+
 
 DATABASE = {
     "default": {
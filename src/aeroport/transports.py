@@ -0,0 +1,32 @@
+"""
+SunHead stream transports, that carry payloads, encoded with ``aeroport.codecs``, as they are.
+SunHead's own transports JSON-encode every message, so binary codec output would need
+base64 and JSON on top of it, losing all its speed and size gains.
+"""
+
+from sunhead.events.transports.amqp import AMQPClient
+from sunhead.serializers.json import JSONSerializer
+
+
+class BytesPassingSerializer(JSONSerializer):
+    """
+    Bytes go to the wire untouched, everything else is JSON, as usual.
+    """
+
+    def serialize(self, data):
+        if isinstance(data, (bytes, bytearray)):
+            return bytes(data)
+        return super().serialize(data)
+
+
+class BinaryAMQPClient(AMQPClient):
+    """
+    AMQP transport for ``StreamDestination`` with ``codec``. Use it in stream settings::
+
+        "transport": "aeroport.transports.BinaryAMQPClient"
+    """
+
+    ACCEPTS_BYTES = True
+
+    def _get_serializer(self):
+        return BytesPassingSerializer()
@@ -1,7 +1,18 @@
 import logging
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
 from sunhead.exceptions import DuplicateMetricException
 from sunhead.metrics import Metrics
+from sunhead.serializers.json import JSONSerializer
 
 logger = logging.getLogger(__name__)
 
@@ -11,11 +22,25 @@ def register_metric(metrics: Metrics, metric_type: str, name: str, *args) -> str
     Will register metric in SunHead Metrics system and return its full name for
     later retrieval. Main purpose of this is to shut down duplicates.
     """
-    full_name = metrics.prefix("fs_storage_put_kb_total")
-    name = "add_{}".format(metric_type)
+    full_name = metrics.prefix(name)
+    method_name = "add_{}".format(metric_type)
     try:
-        getattr(metrics, name)(full_name, *args)
+        getattr(metrics, method_name)(full_name, *args)
     except DuplicateMetricException:
         logger.debug("Metric %s exists, passing silently", full_name)
 
     return full_name
+
+
+def json_dumps_bytes(data, sort_keys: bool = False) -> bytes:
+    """
+    Serialize data to UTF-8 encoded JSON as fast as installed libraries allow.
+    ``orjson`` is used when available, otherwise falls back to (simple)json.
+    Non-standard types (sets, datetimes, enums, etc.) are handled the same way
+    SunHead's JSON serializer does.
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS if sort_keys else orjson.OPT_NON_STR_KEYS
+        return orjson.dumps(data, default=JSONSerializer.json_serial, option=option)
+    serialized = json.dumps(data, default=JSONSerializer.json_serial, ensure_ascii=False, sort_keys=sort_keys)
+    return serialized.encode("utf-8")
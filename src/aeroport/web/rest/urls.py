@@ -16,6 +16,8 @@ urlconf = (
     # Jobs
     ("GET", "/flights/", flights.FlightsListView),
     ("POST", "/flights/", flights.FlightsListView),
+    ("GET", "/flights/queue/", flights.FlightsQueueView),
+    ("DELETE", "/flights/{flight}/", flights.FlightView),
 
     # Destinations
     ("GET", "/destinations/", destinations.DestinationsListView),
@@ -3,13 +3,16 @@ Processing jobs views
 """
 
 import logging
+import uuid
 
 from aiohttp import web_exceptions
 
 from sunhead.rest.views import JSONView
 from sunhead.serializers.json import JSONSerializer
 
-from aeroport.dispatch import FlightRecord, process_origin, ProcessingException
+from aeroport.dispatch import FlightRecord, ProcessingException, check_flight, get_flight_supervisor
+from aeroport.scheduler import get_flight_scheduler
+from aeroport.worker import get_flight_queue, is_distributed
 
 
 logger = logging.getLogger(__name__)
@@ -44,15 +47,64 @@ class FlightsListView(JSONView):
         origin_name = data.get("origin", None)
         destination_name = data.get("destination", None)
         options = serializer.deserialize(data.get("options", "{}"))
+        try:
+            priority = int(data.get("priority", 0))
+        except ValueError:
+            raise web_exceptions.HTTPBadRequest
         if not all((airline_name, origin_name)):
             raise web_exceptions.HTTPBadRequest
-
         try:
-            await process_origin(
-                airline_name, origin_name, destination_name,
-                use_await=False, **options
-            )
+            await check_flight(airline_name, origin_name, destination_name)
         except ProcessingException:
             raise web_exceptions.HTTPExpectationFailed
 
+        if is_distributed():
+            flight_uuid = await get_flight_queue().enqueue(
+                airline_name, origin_name, destination_name, priority, **options
+            )
+            data = {"uuid": str(flight_uuid)} if flight_uuid is not None else None
+        else:
+            pending = get_flight_scheduler().enqueue(
+                airline_name, origin_name, destination_name, priority, **options
+            )
+            data = pending.as_dict() if pending is not None else None
+        if data is None:
+            raise web_exceptions.HTTPConflict
+
+        response = self.json_response(data)
+        response.set_status(202)
+        return response
+
+
+class FlightsQueueView(JSONView):
+
+    async def get(self):
+        if is_distributed():
+            data = await get_flight_queue().get_state()
+            data["depth"] = len(data["pending"])
+        else:
+            scheduler = get_flight_scheduler()
+            data = scheduler.get_state()
+            data["depth"] = scheduler.depth
+        return self.json_response(data)
+
+
+class FlightView(JSONView):
+
+    @property
+    def requested_flight(self) -> uuid.UUID:
+        try:
+            return uuid.UUID(self.request.match_info.get("flight", ""))
+        except ValueError:
+            raise web_exceptions.HTTPNotFound
+
+    async def delete(self):
+        if is_distributed():
+            cancelled = await get_flight_queue().cancel(self.requested_flight)
+        else:
+            # Flight is known by its own uuid, or by the one it got from the scheduler
+            cancelled = get_flight_supervisor().cancel(self.requested_flight) or \
+                get_flight_scheduler().cancel(self.requested_flight)
+        if not cancelled:
+            raise web_exceptions.HTTPNotFound
         raise web_exceptions.HTTPNoContent
@@ -16,7 +16,10 @@ from sunhead.workers.http.server import Server
 from sunhead.workers.http.ext.runtime import ServerStatsMixin
 
 from aeroport.management.utils import get_airlines_list, get_airline
-from aeroport.dispatch import process_origin
+from aeroport.dispatch import get_flight_supervisor
+from aeroport.httpclient import close_http_client
+from aeroport.scheduler import get_flight_scheduler
+from aeroport.worker import get_flight_queue, is_distributed
 from aeroport.web.rest.urls import urlconf as rest_urlconf
 
 
@@ -51,11 +54,13 @@ class AeroportHTTPServer(ServerStatsMixin, Server):
             self.app.router.add_static(settings.SWAGGER_UI_PREFIX, settings.SWAGGER_UI_DIR)
 
         super().init_requirements(loop)
+        get_flight_supervisor().add_shutdown_hook(close_http_client)
         loop.run_until_complete(self.set_timetable(loop))
 
     def cleanup(self, srv, handler, loop):
-        # TODO: Kill all scraping and processing executors
-        pass
+        loop.run_until_complete(get_flight_scheduler().stop())
+        # Stops running flights, origins close their browsers and executors on the way
+        loop.run_until_complete(get_flight_supervisor().shutdown())
 
     # TODO: Move to separate module, connect with airline schedule change API
     @property
@@ -72,27 +77,32 @@ class AeroportHTTPServer(ServerStatsMixin, Server):
                 for entry in entries:
                     destination = entry.get("destination", None)
                     crontab = entry.get("crontab", None)
+                    priority = entry.get("priority", 0)
                     if not crontab:
                         continue
-                    self._set_origin_processing_crontab(airline.name, origin_name, destination, crontab)
+                    self._set_origin_processing_crontab(airline.name, origin_name, destination, crontab, priority)
 
-    def _set_origin_processing_crontab(self, airline_name: str, origin_name: str, destination: str, crontab: str):
+    def _set_origin_processing_crontab(self, airline_name: str, origin_name: str, destination: str, crontab: str,
+                                       priority: int = 0):
         key = "{}_{}_{}".format(airline_name, origin_name, destination)
         if key in self.timetable:
             self.timetable[key].stop()
-        processor = partial(self._process_origin, airline_name, origin_name, destination)
+        processor = partial(self._process_origin, airline_name, origin_name, destination, priority)
         schedule_executor = aiocron.crontab(crontab, processor, start=True)
         logger.debug(
             "Scheduling airline=%s, origin=%s, destination=%s at '%s'",
             airline_name, origin_name, destination, crontab
         )
-        self.timetable["key"] = schedule_executor
+        self.timetable[key] = schedule_executor
 
-    async def _process_origin(self, airline_name, origin_name, destination_name):
+    async def _process_origin(self, airline_name, origin_name, destination_name, priority=0):
         logger.info(
-            "Starting scheduled processing: airline=%s, origin=%s, destination=%s",
+            "Scheduling processing: airline=%s, origin=%s, destination=%s",
             airline_name,
             origin_name,
             destination_name
         )
-        await process_origin(airline_name, origin_name, destination_name)
+        if is_distributed():
+            await get_flight_queue().enqueue(airline_name, origin_name, destination_name, priority)
+        else:
+            get_flight_scheduler().enqueue(airline_name, origin_name, destination_name, priority)
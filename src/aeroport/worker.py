@@ -0,0 +1,397 @@
+"""
+Distributed flights. In distributed mode cron entries and API requests put flights to the
+queue in ``FlightRecord`` table, and ``aeroport worker`` processes on any number of nodes
+run them. Worker holds a lease on the flight it runs and extends it with heartbeats.
+Flight of the worker, that crashed or hung, is queued again when its lease expires.
+
+Tables, created before distributed mode, are updated with ``aeroport migrate``.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from typing import Dict, List, Optional, Tuple
+import uuid
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from sunhead.conf import settings
+
+from aeroport.dispatch import FlightRecord, FlightStatuses, get_flight_supervisor, process_origin
+
+
+logger = logging.getLogger(__name__)
+
+
+# Queue columns of ``FlightRecord`` and the index, that allows one queued or running flight
+# per origin. ADD COLUMN IF NOT EXISTS needs PostgreSQL 9.6 and newer, CREATE INDEX IF NOT EXISTS
+# and ON CONFLICT of ``FlightQueue.enqueue``, that relies on the partial unique index, need 9.5.
+MIGRATION = (
+    "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS destination VARCHAR(255)",
+    "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS options TEXT",
+    "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS priority INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS worker VARCHAR(255)",
+    "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS lease_expires TIMESTAMP",
+    "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS heartbeat TIMESTAMP",
+    "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS cancel_requested BOOLEAN NOT NULL DEFAULT FALSE",
+    "CREATE INDEX IF NOT EXISTS {table}_lease_expires ON {table} (lease_expires)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS {table}_active_origin ON {table} (airline, origin)"
+    " WHERE status = {queued} OR (status = {in_air} AND lease_expires IS NOT NULL)",
+)
+
+
+def migrate(model=FlightRecord) -> None:
+    """
+    Add queue columns and indexes to the existing flight records table. Can be run many times.
+    """
+    database = model._meta.database
+    with database.atomic():
+        for statement in MIGRATION:
+            database.execute_sql(statement.format(
+                table=model._meta.db_table,
+                queued=FlightStatuses.queued.value,
+                in_air=FlightStatuses.in_air.value,
+            ))
+
+
+def is_distributed() -> bool:
+    return getattr(settings, "DISTRIBUTED_FLIGHTS", False)
+
+
+def get_worker_id() -> str:
+    return "{}:{}:{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:6])
+
+
+class FlightQueue(object):
+    """
+    Queue operations over ``FlightRecord`` table. Every operation is one statement, so that
+    concurrent workers never claim the same flight (``FOR UPDATE SKIP LOCKED``), and a worker
+    can change only records, that it holds. Unique index from ``MIGRATION`` keeps concurrent
+    requests from queueing the same origin twice. Lease times are taken from the database clock,
+    so that clocks of the nodes don't matter.
+    """
+
+    def __init__(self, model=FlightRecord):
+        self._model = model
+        self._table = model._meta.db_table
+
+    async def _execute(self, sql: str, *params) -> List[FlightRecord]:
+        return list(await self._model.db_manager.execute(self._model.raw(sql, *params)))
+
+    async def enqueue(self, airline_name: str, origin_name: str, destination_name: Optional[str] = None,
+                      priority: int = 0, **options) -> Optional[uuid.UUID]:
+        """
+        Put flight to the queue.
+
+        :return: Uuid of the flight, or None if the same origin is queued or running already.
+        """
+        records = await self._execute(
+            "INSERT INTO {table} (airline, origin, status, uuid, destination, options, priority, attempts,"
+            " cancel_requested) VALUES (%s, %s, %s, %s, %s, %s, %s, 0, FALSE)"
+            " ON CONFLICT DO NOTHING RETURNING uuid".format(table=self._table),
+            airline_name, origin_name, FlightStatuses.queued.value, str(uuid.uuid4()), destination_name,
+            json.dumps(options) if options else None, priority,
+        )
+        return records[0].uuid if records else None
+
+    async def claim(self, worker_id: str, lease_timeout: float) -> Optional[FlightRecord]:
+        """
+        Take the queued flight with the highest priority and lease it for ``lease_timeout`` seconds.
+        """
+        records = await self._execute(
+            "UPDATE {table} SET status = %s, worker = %s, attempts = attempts + 1,"
+            " heartbeat = LOCALTIMESTAMP, lease_expires = LOCALTIMESTAMP + %s * INTERVAL '1 second'"
+            " WHERE id = ("
+            " SELECT id FROM {table} WHERE status = %s ORDER BY priority DESC, id"
+            " LIMIT 1 FOR UPDATE SKIP LOCKED"
+            ") RETURNING *".format(table=self._table),
+            FlightStatuses.in_air.value, worker_id, lease_timeout, FlightStatuses.queued.value,
+        )
+        return records[0] if records else None
+
+    async def heartbeat(self, worker_id: str, flight_uuids: List[uuid.UUID],
+                        lease_timeout: float) -> List[Tuple[uuid.UUID, bool]]:
+        """
+        Extend leases of the flights.
+
+        :return: Uuids of the flights, that are still held by the worker, and whether
+            cancel of the flight is requested.
+        """
+        if not flight_uuids:
+            return []
+        records = await self._execute(
+            "UPDATE {table} SET heartbeat = LOCALTIMESTAMP,"
+            " lease_expires = LOCALTIMESTAMP + %s * INTERVAL '1 second'"
+            " WHERE worker = %s AND lease_expires IS NOT NULL AND uuid IN ({uuids})"
+            " RETURNING uuid, cancel_requested".format(
+                table=self._table, uuids=", ".join(["%s"] * len(flight_uuids))
+            ),
+            lease_timeout, worker_id, *[str(flight_uuid) for flight_uuid in flight_uuids]
+        )
+        return [(record.uuid, record.cancel_requested) for record in records]
+
+    async def complete(self, worker_id: str, flight_uuid: uuid.UUID, status: FlightStatuses) -> bool:
+        """
+        Drop the lease of the flight, that is over. Flight, that is still in the air by its record,
+        gets ``status``.
+        """
+        records = await self._execute(
+            "UPDATE {table} SET lease_expires = NULL,"
+            " status = CASE WHEN status = %s THEN %s ELSE status END"
+            " WHERE worker = %s AND uuid = %s AND lease_expires IS NOT NULL"
+            " RETURNING uuid".format(table=self._table),
+            FlightStatuses.in_air.value, status.value, worker_id, str(flight_uuid),
+        )
+        return bool(records)
+
+    async def release(self, worker_id: str) -> int:
+        """
+        Put flights, held by the stopping worker, back to the queue. The attempt is not counted.
+        Cancelled flights are interrupted instead.
+        """
+        records = await self._execute(
+            "UPDATE {table} SET status = CASE WHEN cancel_requested THEN %s ELSE %s END,"
+            " worker = NULL, lease_expires = NULL, attempts = GREATEST(attempts - 1, 0)"
+            " WHERE worker = %s AND lease_expires IS NOT NULL"
+            " RETURNING uuid".format(table=self._table),
+            FlightStatuses.interrupted.value, FlightStatuses.queued.value, worker_id,
+        )
+        return len(records)
+
+    async def cancel(self, flight_uuid: uuid.UUID) -> bool:
+        """
+        Cancel queued or running flight. Queued flight is interrupted at once, running one is
+        stopped by its worker on the next heartbeat.
+
+        :return: False if there is no such flight queued or running.
+        """
+        records = await self._execute(
+            "UPDATE {table} SET cancel_requested = TRUE,"
+            " status = CASE WHEN status = %s THEN %s ELSE status END"
+            " WHERE uuid = %s AND (status = %s OR (status = %s AND lease_expires IS NOT NULL))"
+            " RETURNING uuid".format(table=self._table),
+            FlightStatuses.queued.value, FlightStatuses.interrupted.value, str(flight_uuid),
+            FlightStatuses.queued.value, FlightStatuses.in_air.value,
+        )
+        return bool(records)
+
+    async def get_state(self) -> Dict[str, List[Dict]]:
+        """
+        Flights, that are running on workers and waiting in the queue.
+        """
+        records = await self._execute(
+            "SELECT * FROM {table} WHERE status = %s OR (status = %s AND lease_expires IS NOT NULL)"
+            " ORDER BY priority DESC, id".format(table=self._table),
+            FlightStatuses.queued.value, FlightStatuses.in_air.value,
+        )
+        state = {"running": [], "pending": []}
+        for record in records:
+            data = {
+                "uuid": str(record.uuid),
+                "airline": record.airline,
+                "origin": record.origin,
+                "destination": record.destination,
+                "priority": record.priority,
+                "attempts": record.attempts,
+            }
+            if record.status == FlightStatuses.queued.value:
+                state["pending"].append(data)
+            else:
+                data.update(worker=record.worker, heartbeat=record.heartbeat, lease_expires=record.lease_expires)
+                state["running"].append(data)
+        return state
+
+    async def reap(self, max_attempts: int) -> Dict[str, int]:
+        """
+        Put flights with expired leases back to the queue, or give up on them after ``max_attempts``.
+        Flights, that landed before the lease expired, just lose the lease, and cancelled ones
+        are interrupted.
+        """
+        requeued = await self._execute(
+            "UPDATE {table} SET status = %s, worker = NULL, lease_expires = NULL"
+            " WHERE lease_expires < LOCALTIMESTAMP AND status != %s AND attempts < %s"
+            " AND NOT cancel_requested"
+            " RETURNING uuid".format(table=self._table),
+            FlightStatuses.queued.value, FlightStatuses.landed.value, max_attempts,
+        )
+        given_up = await self._execute(
+            "UPDATE {table} SET status = %s, lease_expires = NULL"
+            " WHERE lease_expires < LOCALTIMESTAMP AND status != %s"
+            " RETURNING uuid".format(table=self._table),
+            FlightStatuses.interrupted.value, FlightStatuses.landed.value,
+        )
+        await self._execute(
+            "UPDATE {table} SET lease_expires = NULL WHERE lease_expires < LOCALTIMESTAMP"
+            " RETURNING uuid".format(table=self._table),
+        )
+        for record in requeued:
+            logger.warning("Lease of flight %s expired, flight is queued again", record.uuid)
+        for record in given_up:
+            logger.error("Lease of flight %s expired after %s attempts, giving up", record.uuid, max_attempts)
+        return {"requeued": len(requeued), "given_up": len(given_up)}
+
+
+class FlightWorker(object):
+    """
+    Runs up to ``concurrency`` flights from the queue at once. Heartbeats go every
+    ``heartbeat_interval`` seconds, and the worker stops the flight, whose lease was lost
+    or which was cancelled.
+    Every worker also reaps expired leases, when it polls the queue.
+    """
+
+    DEFAULT_CONCURRENCY = 2
+    DEFAULT_LEASE_TIMEOUT = 60
+    DEFAULT_HEARTBEAT_INTERVAL = 15
+    DEFAULT_POLL_INTERVAL = 5
+    DEFAULT_MAX_ATTEMPTS = 3
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, lease_timeout: float = DEFAULT_LEASE_TIMEOUT,
+                 heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 worker_id: Optional[str] = None, queue: Optional[FlightQueue] = None):
+        if heartbeat_interval >= lease_timeout:
+            raise ValueError("Heartbeat interval must be shorter than lease timeout")
+        self.concurrency = concurrency
+        self.lease_timeout = lease_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.worker_id = worker_id or get_worker_id()
+        self.queue = queue or FlightQueue()
+        self._running = {}  # Flight uuid -> task
+        self._cancelled = set()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    @classmethod
+    def from_settings(cls, **kwargs) -> "FlightWorker":
+        options = dict(getattr(settings, "FLIGHT_WORKER", {}))
+        options.update(kwargs)
+        return cls(**options)
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    async def run(self):
+        """
+        Take and run flights until ``stop()`` is called. Flights, that are running then, are
+        cancelled and put back to the queue.
+        """
+        logger.info("Worker %s is started, up to %s flights at once", self.worker_id, self.concurrency)
+        heartbeat_task = asyncio.ensure_future(self._heartbeat_loop())
+        try:
+            while not self._stopping:
+                try:
+                    await self._poll()
+                except Exception:
+                    # Database may be unavailable for a while, worker must survive it
+                    logger.error("Can't poll the flight queue", exc_info=True)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            heartbeat_task.cancel()
+            await self._stop_flights()
+        logger.info("Worker %s is stopped", self.worker_id)
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+
+    async def _poll(self):
+        await self.queue.reap(self.max_attempts)
+        while len(self._running) < self.concurrency and not self._stopping:
+            flight_record = await self.queue.claim(self.worker_id, self.lease_timeout)
+            if flight_record is None:
+                break
+            task = asyncio.ensure_future(self._run_flight(flight_record))
+            self._running[flight_record.uuid] = task
+
+    async def _run_flight(self, flight_record: FlightRecord):
+        logger.info(
+            "Flight %s claimed: airline=%s, origin=%s, attempt %s",
+            flight_record.uuid, flight_record.airline, flight_record.origin, flight_record.attempts
+        )
+        status = FlightStatuses.landed
+        try:
+            await self.run_flight_record(flight_record)
+        except asyncio.CancelledError:
+            if flight_record.uuid not in self._cancelled:
+                # Lease is lost or worker is stopping, record is up to its new owner
+                raise
+            status = FlightStatuses.interrupted
+        except Exception:
+            logger.error("Flight %s failed", flight_record.uuid, exc_info=True)
+            status = FlightStatuses.interrupted
+        finally:
+            del self._running[flight_record.uuid]
+            self._cancelled.discard(flight_record.uuid)
+            self._wakeup.set()
+        try:
+            await self.queue.complete(self.worker_id, flight_record.uuid, status)
+        except Exception:
+            logger.error("Can't complete flight %s, its lease expires later", flight_record.uuid, exc_info=True)
+
+    async def run_flight_record(self, flight_record: FlightRecord):
+        """
+        Process the origin of the claimed flight.
+        """
+        options = json.loads(flight_record.options) if flight_record.options else {}
+        await process_origin(
+            flight_record.airline, flight_record.origin, flight_record.destination,
+            use_await=True, flight_record=flight_record, **options
+        )
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            flight_uuids = list(self._running)
+            try:
+                held = dict(await self.queue.heartbeat(self.worker_id, flight_uuids, self.lease_timeout))
+            except Exception:
+                logger.error("Can't send heartbeat", exc_info=True)
+                continue
+            for flight_uuid in flight_uuids:
+                task = self._running.get(flight_uuid)
+                if task is None:
+                    continue
+                if flight_uuid not in held:
+                    logger.error("Lease of flight %s is lost, stopping it", flight_uuid)
+                    task.cancel()
+                elif held[flight_uuid] and flight_uuid not in self._cancelled:
+                    logger.warning("Flight %s is cancelled, stopping it", flight_uuid)
+                    self._cancelled.add(flight_uuid)
+                    task.cancel()
+
+    async def _stop_flights(self):
+        tasks = list(self._running.values())
+        if tasks:
+            logger.info("Stopping %s running flights", len(tasks))
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks, timeout=get_flight_supervisor().shutdown_timeout * 2)
+        try:
+            released = await self.queue.release(self.worker_id)
+        except Exception:
+            logger.error("Can't release flights, they are queued again when leases expire", exc_info=True)
+        else:
+            if released:
+                logger.info("%s flights are queued again", released)
+
+
+_queue = None
+
+
+def get_flight_queue() -> FlightQueue:
+    global _queue
+    if _queue is None:
+        _queue = FlightQueue()
+    return _queue
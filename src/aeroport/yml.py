@@ -2,20 +2,25 @@
 Things to extract data from Yandex Market Format (yml). Not to be confused with YAML.
 """
 
-import asyncio  # noqa
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 from copy import copy
 from enum import Enum
-from functools import partial
+from functools import lru_cache, partial
 import hashlib
+from itertools import islice
 import logging
 import os
 import time
-from typing import Optional, Dict, Iterable, Sequence, Generator
+from typing import Optional, Dict, Iterable, List, Sequence, Generator
 from urllib import parse
 from xml.etree import cElementTree as ET
-from xml.etree.cElementTree import iterparse
 import zipfile
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 from sunhead.conf import settings
 from sunhead.utils import get_class_by_path
@@ -23,14 +28,44 @@ from sunhead.utils import get_class_by_path
 from aeroport.abc import (
     AbstractOrigin, AbstractDownloader, AbstractUrlGenerator, AbstractItemAdapter, AbstractPayload,
 )
-from aeroport.payload import Payload, Field
+from aeroport.payload import Payload, Field, PayloadBatch, PayloadBatcher
+from aeroport.checkpoint import FeedCheckpoint
+from aeroport.delta import DeltaTracker
+from aeroport.idset import IdCollector
 from aeroport.dispatch import Flight
 from aeroport.fileurlcache import FileUrlCache
+from aeroport.ymlparsers import AbstractParserEngine, get_parser_engine
 
 
 logger = logging.getLogger(__name__)
 
 
+_semaphores = {}
+
+
+def get_semaphore(setting_name: str, default: int) -> asyncio.Semaphore:
+    """
+    Process-wide semaphore, sized by the setting.
+    """
+    semaphore = _semaphores.get(setting_name, None)
+    if semaphore is None:
+        semaphore = _semaphores[setting_name] = asyncio.Semaphore(getattr(settings, setting_name, default))
+    return semaphore
+
+
+_feed_items = None  # Items of the feed, parsed in this process for the parent one
+
+
+def _start_feed_parsing(origin_class, parser_engine_name: Optional[str], feed_file: str, skip_items: int):
+    global _feed_items
+    origin = origin_class.for_parsing(parser_engine_name)
+    _feed_items = filter(None, origin.parse_feed(feed_file, skip_items=skip_items))
+
+
+def _next_feed_items(size: int) -> List[Dict]:
+    return list(islice(_feed_items, size))
+
+
 class YmlFeedItemTypes(Enum):
     category = 0
     offer = 1
@@ -51,11 +86,73 @@ class XMLElementsCollection(object):
         return self._data
 
 
-def to_int(data):
+ID_HASH_MASK = (1 << 56) - 1  # Ids fit into 56 bits, as they always did with md5
+ID_HASH_CACHE_SIZE = 64 * 1024
+
+
+def _md5_id(data: bytes) -> int:
+    # The same as parsing first 14 hex digits of the hexdigest
+    return int.from_bytes(hashlib.md5(data).digest()[:7], "big")
+
+
+def _xxh64_id(data: bytes) -> int:
+    return xxhash.xxh64(data).intdigest() & ID_HASH_MASK
+
+
+ID_HASHES = {
+    "md5": _md5_id,
+    "xxh64": _xxh64_id,
+}
+
+_id_hash = None
+
+
+def set_id_hash(name: Optional[str] = None):
+    """
+    Select hash, used to make integer ids from non-numeric ones. By default it is taken from
+    ``YML_ID_HASH`` setting. ``md5`` gives the same ids as previous versions, ``xxh64`` is
+    much faster, but ids are different, so don't switch it for existing data.
+    """
+    global _id_hash
+    name = name or getattr(settings, "YML_ID_HASH", "md5")
+    if name not in ID_HASHES:
+        raise ValueError("Unknown id hash '{}'".format(name))
+    if name == "xxh64" and xxhash is None:
+        raise ValueError("xxh64 id hash requires 'xxhash' package installed")
+    _id_hash = ID_HASHES[name]
+    _to_int_cached.cache_clear()
+
+
+@lru_cache(maxsize=ID_HASH_CACHE_SIZE)
+def _to_int_cached(data) -> int:
     if hasattr(data, "encode"):
         data = data.encode()
-    result = int(hashlib.md5(data).hexdigest()[:14], 16)
-    return result
+    return _id_hash(data)
+
+
+def to_int(data) -> int:
+    if _id_hash is None:
+        set_id_hash()
+    return _to_int_cached(data)
+
+
+def to_int_many(values: Iterable) -> List[int]:
+    """
+    Hash many ids in one pass. Ids, that are in the memo of ``to_int``, are taken from it.
+    """
+    if _id_hash is None:
+        set_id_hash()
+    return list(map(_to_int_cached, values))
+
+
+def cast_value(value: str, cast_type):
+    try:
+        return cast_type(value)
+    except ValueError as e:
+        # There is problem casting type. Try to workaround
+        if cast_type == int:
+            return to_int(value)
+        raise ValueError(e)
 
 
 def get_attrib(elem, names, cast_type=None, default=None):
@@ -73,14 +170,7 @@ def get_attrib(elem, names, cast_type=None, default=None):
         if name in elem.attrib:
             result = elem.attrib[name]
             if cast_type:
-                try:
-                    result = cast_type(result)
-                except ValueError as e:
-                    # There is problem casting type. Try to workaround
-                    if cast_type == int:
-                        result = to_int(result)
-                    else:
-                        raise ValueError(e)
+                result = cast_value(result, cast_type)
             return result
     return default
 
@@ -88,10 +178,32 @@ def get_attrib(elem, names, cast_type=None, default=None):
 class YMLItemAdapter(AbstractItemAdapter):
     """
     Concrete airline must subclass and implement this adapter.
+
+    ``STREAMING`` adapters are fed with elements of the item as they are parsed
+    (``start_item``, ``feed`` for every ended child, ``finish_item`` with the ended
+    item element) instead of getting copied elements in ``adapt_raw_item``.
     """
+
+    STREAMING = False
+
     def extract_raw_items_from_html(self, html) -> Sequence:
         raise NotImplementedError()
 
+    def start_item(self, elem):
+        raise NotImplementedError()
+
+    def feed(self, state, elem):
+        raise NotImplementedError()
+
+    def finish_item(self, state, elem) -> AbstractPayload:
+        raise NotImplementedError()
+
+    def get_tags(self) -> Optional[frozenset]:
+        """
+        Tags of the item children, adapter needs to see. ``None`` means all of them.
+        """
+        return None
+
 
 class FeedInfo(Payload):
     """
@@ -110,10 +222,18 @@ class FeedParsingResult(Payload):
     """
     After parsing the whole feed, this should be sent to the destination, so that
     remote subscribers can do their cleanup such as delete non-existing items in feed.
+
+    Id lists are lists of ids, as adapters put them to ``original_id`` of payloads (sorted,
+    if they can be compared), or base64 strings of ``IntIdSet.to_bytes()`` if
+    ``id_list_encoding`` is ``"packed"``. Packed encoding is used only if all ids are
+    non-negative 64-bit integers, otherwise lists are sent and encoding is ``"list"``.
     """
     shop_name = Field()
+    id_list_encoding = Field()
     offers_id_list = Field()
     categories_id_list = Field()
+    deleted_offers_id_list = Field()
+    deleted_categories_id_list = Field()
 
 
 class YmlOrigin(AbstractOrigin):
@@ -125,6 +245,11 @@ class YmlOrigin(AbstractOrigin):
     """
 
     ADAPTER_MAPPING = {}
+    ID_LIST_ENCODINGS = ("list", "packed")
+    DEFAULT_ID_LIST_ENCODING = "list"
+    BATCH_SIZE = 0  # Postprocess and send payloads one by one
+    FEED_CONCURRENCY = 1  # Number of feeds, processed at the same time
+    PARSE_CHUNK_SIZE = 500  # Items parsed in executor at once
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -134,6 +259,27 @@ class YmlOrigin(AbstractOrigin):
         self._cache = self._init_file_url_cache()
         self._force_cache = False
         self._force_download = False
+        self._delta = False
+        self._id_list_encoding = self.DEFAULT_ID_LIST_ENCODING
+        self._batch_size = self.BATCH_SIZE
+        self._parser_engine_name = None
+        self._engine = None
+        self._checkpoint_interval = getattr(settings, "YML_CHECKPOINT_INTERVAL", 0)
+        self._feed_concurrency = self.FEED_CONCURRENCY
+
+    @classmethod
+    def for_parsing(cls, parser_engine_name: Optional[str] = None) -> "YmlOrigin":
+        """
+        Origin, that only parses feeds: with its own adapters, but without airline, file cache
+        and destination. Feeds of concurrent processing are parsed by it in separate processes.
+        """
+        origin = cls.__new__(cls)
+        origin._adapters = {
+            item_type: kls() for item_type, kls in cls.ADAPTER_MAPPING.items()
+        }
+        origin._parser_engine_name = parser_engine_name
+        origin._engine = None
+        return origin
 
     def _init_file_url_cache(self) -> FileUrlCache:
         conf = dict(settings.FILE_URL_CACHE["storage"])
@@ -161,29 +307,112 @@ class YmlOrigin(AbstractOrigin):
         """
         self._force_download = options.pop("force_download", False)
         self._force_cache = options.pop("force_cache", False)
+        self._delta = options.pop("delta", False)
+        self._id_list_encoding = options.pop("id_list_encoding", self.DEFAULT_ID_LIST_ENCODING)
+        if self._id_list_encoding not in self.ID_LIST_ENCODINGS:
+            raise ValueError("Unknown id list encoding '{}'".format(self._id_list_encoding))
+        self._batch_size = options.pop("batch_size", self.BATCH_SIZE)
+        self._parser_engine_name = options.pop("parser_engine", None)
+        self._engine = None
+        self._checkpoint_interval = options.pop(
+            "checkpoint_interval", getattr(settings, "YML_CHECKPOINT_INTERVAL", 0)
+        )
+        self._feed_concurrency = options.pop("feed_concurrency", self.FEED_CONCURRENCY)
         super().set_options(**options)
 
     async def process(self):
         """
         Starting point for feeds consuming. Several feeds will be processed, as yielded
-        by urlgenerator.
+        by urlgenerator, up to ``feed_concurrency`` of them at the same time. Downloads
+        and parsing are also limited process-wide by ``YML_MAX_CONCURRENT_DOWNLOADS``
+        and ``YML_MAX_CONCURRENT_PARSES`` settings.
         """
 
         flight = Flight(self)
         await flight.start()
 
-        total_processed = 0
-        async for url_info in await self.get_urlgenerator():
-            procesed = await self.process_export_url(url_info.url, url_info.kwargs)
-            total_processed += procesed
-            await flight.set_num_processed(total_processed)
+        urlgenerator = await self.get_urlgenerator()
+        if self._feed_concurrency > 1:
+            total_processed = await self._process_concurrently(urlgenerator, flight)
+        else:
+            total_processed = 0
+            async for url_info in urlgenerator:
+                total_processed += await self.process_export_url(url_info.url, url_info.kwargs, flight) or 0
 
         await flight.finish(total_processed)
 
-    async def process_export_url(self, export_url: str, url_kwargs: Dict) -> Optional[int]:
+    async def _process_concurrently(self, urlgenerator: AbstractUrlGenerator, flight: Flight) -> int:
+        queue = asyncio.Queue(maxsize=self._feed_concurrency)
+        totals = []
+        errors = []
+
+        async def worker():
+            while True:
+                url_info = await queue.get()
+                if url_info is None:
+                    return
+                try:
+                    totals.append(await self.process_export_url(url_info.url, url_info.kwargs, flight) or 0)
+                except Exception as e:
+                    # Let other feeds finish, flight fails after that
+                    logger.error("Processing of %s failed", url_info.url, exc_info=True)
+                    errors.append(e)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self._feed_concurrency)]
+        cancelled = False
+        try:
+            async for url_info in urlgenerator:
+                await queue.put(url_info)
+        except asyncio.CancelledError:
+            cancelled = True
+            for worker_task in workers:
+                worker_task.cancel()
+            raise
+        finally:
+            if not cancelled:
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+
+        if errors:
+            raise errors[0]
+        return sum(totals)
+
+    def get_delta_trackers(self, shop_name: str) -> Dict[YmlFeedItemTypes, DeltaTracker]:
+        """
+        Change detection state for the shop feed, from the previous successful run.
+        """
+        path = os.path.join(settings.DELTA_INDEX_DIR, self.airline.name, self.name)
+        trackers = {
+            item_type: DeltaTracker(os.path.join(path, "{}.{}.fpi".format(shop_name, item_type.name)))
+            for item_type in YmlFeedItemTypes
+        }
+        return trackers
+
+    def encode_id_list(self, ids, encoding: str):
+        if encoding == "packed":
+            return ids.to_base64()
+        return list(ids)
+
+    async def process_export_url(self, export_url: str, url_kwargs: Dict,
+                                 flight: Optional[Flight] = None) -> Optional[int]:
         """
         Process one given feed url.
 
+        With ``delta`` option only new and changed items are sent, and ids of items
+        that disappeared from the feed are sent with ``FeedParsingResult``.
+
+        With ``batch_size`` option payloads are collected into ``PayloadBatch``es, which are
+        postprocessed with ``postprocess_batch`` and sent to destination as a whole.
+
+        Progress is saved to checkpoint every ``checkpoint_interval`` seconds. If processing
+        of the same feed file was interrupted, it continues from the last checkpoint.
+
+        With ``feed_concurrency`` above 1 feed is parsed by chunks in a separate process, so that
+        feeds are parsed in parallel, and downloaded and sent meanwhile. Origin class, its adapters
+        and payloads must be picklable then, and adapters must not depend on the state of the origin
+        (see ``for_parsing``). Progress is added to the ``flight``, if given.
+
         :return: Processed number
         """
 
@@ -192,56 +421,195 @@ class YmlOrigin(AbstractOrigin):
         if shop_name is None:
             return
 
-        feed_file = await self.get_feed_file(export_url, shop_name)
+        async with get_semaphore("YML_MAX_CONCURRENT_DOWNLOADS", 4):
+            feed_file = await self.get_feed_file(export_url, shop_name)
         if feed_file is None:
             logger.error("Can't get valid feed file, aborting")
             return
 
+        async with get_semaphore("YML_MAX_CONCURRENT_PARSES", 2):
+            return await self.process_feed_file(feed_file, shop_name, url_kwargs, flight)
+
+    async def process_feed_file(self, feed_file: str, shop_name: str, url_kwargs: Dict,
+                                flight: Optional[Flight] = None) -> int:
+        """
+        Process downloaded feed, see ``process_export_url``.
+
+        :return: Processed number
+        """
         feed_info = self.analyze_feed(feed_file, shop_name)
         await self.send_to_destination(feed_info)
 
         # Parsing process
         idx = 0
         id_lists = {
-            YmlFeedItemTypes.category: set(),
-            YmlFeedItemTypes.offer: set(),
+            YmlFeedItemTypes.category: IdCollector(),
+            YmlFeedItemTypes.offer: IdCollector(),
         }
-        for idx, item in enumerate(filter(None, self.parse_feed(feed_file)), start=1):
-            if idx % 100 == 0:
-                await self.progress_callback(idx, feed_info["total_count"])
-                # For some reason, messages are not sent if there is constant
-                # sending without interruptions. Probably some issue in stream
-                # interface and ensure_futures?
-                # This sleep allows some time for messages to be actually sent, so
-                # store subscriber can receive them immediately.
-                # await asyncio.sleep(0.05)
-
-            # Why this is here?
-            # # Get adapter by item type (offer or category)
-            # adapter = self._adapters.get(item["type"], None)
-            # if not adapter:
-            #     continue
-
-            # Add item's original id to the list of collected ids
-            id_lists.get(item["type"], set()).add(item["original_id"])
-            item["payload"].postprocess(
-                **{
-                    "origin_name": self.name,
-                    "url_kwargs": url_kwargs,
-                }
-            )
-            await self.send_to_destination(item["payload"])
+        delta_trackers = self.get_delta_trackers(shop_name) if self._delta else None
+        checkpoint = self.get_checkpoint(shop_name, feed_file) if self._checkpoint_interval else None
+        if checkpoint is not None:
+            idx = self.restore_checkpoint(checkpoint, id_lists, delta_trackers)
+        resumed = idx
+        checkpoint_at = time.monotonic() + (self._checkpoint_interval or 0)
+        postprocess_kwargs = {
+            "origin_name": self.name,
+            "url_kwargs": url_kwargs,
+        }
+        batcher = PayloadBatcher(self._batch_size) if self._batch_size else None
+        reported = 0
+        loop = asyncio.get_event_loop()
+        # Parser of the concurrently processed feed lives in its own process, chunks of items
+        # are taken from it in turn
+        executor = ProcessPoolExecutor(max_workers=1) if self._feed_concurrency > 1 else None
+        try:
+            if executor is not None:
+                await loop.run_in_executor(
+                    executor, _start_feed_parsing, type(self),
+                    self._parser_engine_name or getattr(settings, "YML_PARSER_ENGINE", "auto"), feed_file, resumed,
+                )
+            else:
+                items = filter(None, self.parse_feed(feed_file, skip_items=resumed))
+            while True:
+                if executor is not None:
+                    chunk = await loop.run_in_executor(executor, _next_feed_items, self.PARSE_CHUNK_SIZE)
+                else:
+                    chunk = list(islice(items, self.PARSE_CHUNK_SIZE))
+                if not chunk:
+                    break
+                for item in chunk:
+                    idx += 1
+                    if idx % 100 == 0:
+                        await self.progress_callback(idx, feed_info["total_count"])
+                        if flight is not None:
+                            await flight.add_num_processed(idx - reported)
+                            reported = idx
+                        if checkpoint is not None and time.monotonic() >= checkpoint_at:
+                            # Everything before current item must be sent by now
+                            if batcher is not None:
+                                for batch in batcher.flush():
+                                    await self.process_batch(batch, postprocess_kwargs, delta_trackers)
+                            self.save_checkpoint(checkpoint, idx - 1, id_lists)
+                            checkpoint_at = time.monotonic() + self._checkpoint_interval
+                        # For some reason, messages are not sent if there is constant
+                        # sending without interruptions. Probably some issue in stream
+                        # interface and ensure_futures?
+                        # This sleep allows some time for messages to be actually sent, so
+                        # store subscriber can receive them immediately.
+                        # await asyncio.sleep(0.05)
+
+                    # Why this is here?
+                    # # Get adapter by item type (offer or category)
+                    # adapter = self._adapters.get(item["type"], None)
+                    # if not adapter:
+                    #     continue
+
+                    # Add item's original id to the list of collected ids
+                    original_id = item["original_id"]
+                    if original_id is not None:
+                        id_lists[item["type"]].add(original_id)
+
+                    if batcher is not None:
+                        for batch in batcher.add(item["payload"], (item["type"], original_id)):
+                            await self.process_batch(batch, postprocess_kwargs, delta_trackers)
+                        continue
+
+                    item["payload"].postprocess(**postprocess_kwargs)
+                    if delta_trackers is not None and original_id is not None:
+                        if not delta_trackers[item["type"]].is_changed(original_id, item["payload"]):
+                            continue
+                    await self.send_to_destination(item["payload"])
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+        if batcher is not None:
+            for batch in batcher.flush():
+                await self.process_batch(batch, postprocess_kwargs, delta_trackers)
+
+        if flight is not None:
+            await flight.add_num_processed(idx - reported)
 
         # Finalize
+        encoding = self._id_list_encoding
+        if encoding == "packed" and not all(ids.is_packable for ids in id_lists.values()):
+            logger.warning("Feed %s has ids, that are not 64-bit integers, sending plain id lists", shop_name)
+            encoding = "list"
         result = FeedParsingResult(
             shop_name=shop_name,
-            categories_id_list=id_lists[YmlFeedItemTypes.category],
-            offers_id_list=id_lists[YmlFeedItemTypes.offer]
+            id_list_encoding=encoding,
+            categories_id_list=self.encode_id_list(id_lists[YmlFeedItemTypes.category], encoding),
+            offers_id_list=self.encode_id_list(id_lists[YmlFeedItemTypes.offer], encoding),
         )
+        if delta_trackers is not None:
+            deleted = {
+                item_type: tracker.get_deleted_ids() for item_type, tracker in delta_trackers.items()
+            }
+            result["deleted_categories_id_list"] = self.encode_id_list(deleted[YmlFeedItemTypes.category], encoding)
+            result["deleted_offers_id_list"] = self.encode_id_list(deleted[YmlFeedItemTypes.offer], encoding)
         await self.send_to_destination(result)
 
+        if delta_trackers is not None:
+            for tracker in delta_trackers.values():
+                tracker.commit()
+            logger.info(
+                "Delta for %s: %s changed offers, %s deleted",
+                shop_name,
+                delta_trackers[YmlFeedItemTypes.offer].num_changed,
+                len(deleted[YmlFeedItemTypes.offer]),
+            )
+
+        if checkpoint is not None:
+            checkpoint.remove()
+
         return idx
 
+    def get_checkpoint(self, shop_name: str, feed_file: str) -> FeedCheckpoint:
+        path = os.path.join(settings.CHECKPOINT_DIR, self.airline.name, self.name, "{}.json".format(shop_name))
+        return FeedCheckpoint(path, feed_file)
+
+    def restore_checkpoint(self, checkpoint: FeedCheckpoint, id_lists: Dict[YmlFeedItemTypes, IdCollector],
+                           delta_trackers: Optional[Dict[YmlFeedItemTypes, DeltaTracker]] = None) -> int:
+        """
+        Fill id lists from the checkpoint and return number of items, that are processed already.
+        """
+        state = checkpoint.load()
+        if state is None:
+            return 0
+
+        for item_type in YmlFeedItemTypes:
+            ids = IdCollector.load(state["id_lists"][item_type.name])
+            id_lists[item_type] = ids
+            if delta_trackers is not None:
+                # Items before checkpoint are not compared again, keep their fingerprints
+                delta_trackers[item_type].mark_seen(ids)
+        logger.info("Resuming from checkpoint %s, %s items are processed already", checkpoint.path, state["item_index"])
+        return state["item_index"]
+
+    def save_checkpoint(self, checkpoint: FeedCheckpoint, item_index: int,
+                        id_lists: Dict[YmlFeedItemTypes, IdCollector]):
+        checkpoint.save({
+            "item_index": item_index,
+            "id_lists": {item_type.name: ids.dump() for item_type, ids in id_lists.items()},
+        })
+        logger.debug("Checkpoint %s saved at item %s", checkpoint.path, item_index)
+
+    async def process_batch(self, batch: PayloadBatch, postprocess_kwargs: Dict,
+                            delta_trackers: Optional[Dict[YmlFeedItemTypes, DeltaTracker]] = None):
+        """
+        Postprocess batch and send it to destination. Batch rows are tagged with
+        ``(item type, original id)``.
+        """
+        batch.payload_class.postprocess_batch(batch, **postprocess_kwargs)
+        if delta_trackers is not None:
+            mask = [
+                original_id is None or delta_trackers[item_type].is_changed_values(original_id, values)
+                for (item_type, original_id), values in zip(batch.tags, batch.iter_values())
+            ]
+            batch = batch.select(mask)
+        if len(batch):
+            await self.send_batch_to_destination(batch)
+
     async def get_feed_file(self, export_url: str, shop_name: str) -> str:
         """
         Download feed or use local cache.
@@ -312,15 +680,18 @@ class YmlOrigin(AbstractOrigin):
         info["shop_name"] = shop_name
         return info
 
-    def parse_feed(self, feed_file: str) -> Iterable[Dict]:
+    def parse_feed(self, feed_file: str, skip_items: int = 0) -> Iterable[Dict]:
         """
         Payload generator. Will yield (presumably) Item and Category payloads, but concrete
         payloads are defined in implementation of the abstracts this class defines.
+
+        First ``skip_items`` items are parsed, but not adapted nor yielded.
         """
+        skip = [skip_items]  # Shared by both generators
         yield from self._parse(
             feed_file,
-            categories_parser=partial(self._generator, "category", "categories"),
-            offers_parser=partial(self._generator, "offer", "offers")
+            categories_parser=partial(self._generator, "category", "categories", skip=skip),
+            offers_parser=partial(self._generator, "offer", "offers", skip=skip)
         )
 
     def _parse(self, feed_file: str, categories_parser=None, offers_parser=None):
@@ -330,7 +701,9 @@ class YmlOrigin(AbstractOrigin):
 
         :param feed_file: Path to the feed file.
         :param categories_parser: Method that will parse all categories in given context.
+            Called with context and <categories> element.
         :param offers_parser: Method that will parse all items in given context.
+            Called with context and <offers> element.
         :return: Doesn"t return anything.
         """
         # Check what caller was intended to parse and put memory cleaning iterators to unneeded
@@ -341,55 +714,105 @@ class YmlOrigin(AbstractOrigin):
             offers_parser = partial(self._dismiss_generator, "offers")
 
         # Start XML parsing process right from the beginning, using configured parsers
-        context = iter(iterparse(feed_file, events=("start", "end")))
+        engine = self.get_parser_engine()
+        context = iter(engine.iterparse(feed_file, events=("start", "end"), tags=self.get_parse_tags()))
         for event, elem in context:
             if event == "start":
                 if elem.tag == "categories":
                     logging.info("Parser enters categories")
-                    for i in categories_parser(context):
+                    for i in categories_parser(context, elem):
                         yield i
                 if elem.tag == "offers":
                     logging.info("Parser enters offers")
-                    for i in offers_parser(context):
+                    for i in offers_parser(context, elem):
                         yield i
             else:
                 if elem.tag == "offers" or elem.tag == "categories":
-                    elem.clear()
+                    engine.release(elem)
 
-    def _dismiss_generator(self, stop_on, context):
-        for event, elem in context:
-            if event == "end":
-                elem.clear()
-                if elem.tag == stop_on:
-                    yield None
-                    raise StopIteration()
+    def get_parser_engine(self) -> AbstractParserEngine:
+        """
+        Parser engine, set by ``parser_engine`` option or ``YML_PARSER_ENGINE`` setting.
+        """
+        if self._engine is None:
+            self._engine = get_parser_engine(
+                self._parser_engine_name or getattr(settings, "YML_PARSER_ENGINE", "auto")
+            )
+        return self._engine
 
-    def _generator(self, key, tag_many, context):
+    def get_parse_tags(self) -> Optional[frozenset]:
+        """
+        Tags, parser must report. Events can be filtered only if every adapter
+        tells which tags it needs.
+        """
+        adapter_tags = [adapter.get_tags() for adapter in self._adapters.values()]
+        if not adapter_tags or any(tags is None for tags in adapter_tags):
+            return None
+        tags = {"categories", "offers"}
+        tags.update(item_type.name for item_type in YmlFeedItemTypes)
+        for item_tags in adapter_tags:
+            tags.update(item_tags)
+        return frozenset(tags)
+
+    def _dismiss_generator(self, stop_on, context, parent=None):
+        engine = self.get_parser_engine()
+        depth = 0
+        for event, elem in context:
+            if event == "start":
+                depth += 1
+                continue
+            if elem.tag == stop_on and depth == 0:
+                engine.release(elem)
+                yield None
+                return
+            depth -= 1
+            engine.release(elem, parent if depth == 0 else None)
+
+    def _generator(self, key, tag_many, context, parent=None, skip=None):
         """
         This should be called with context set to beginning of the <offers> or <categories>
-        tag (or other tag you consider as parent for something).
+        tag (or other tag you consider as parent for something), which is ``parent``.
+        Processed items are removed from it, so that the tree doesn't grow.
 
         Generator will iterate through all children of this parent tag, which would be <key></key>,
         get adapter for the "key" tag, apply it, add some meta and yield adapted item.
+        ``skip`` is one-item list with the number of items to pass over without adapting.
         """
+        engine = self.get_parser_engine()
+        item_type = getattr(YmlFeedItemTypes, key)
+        adapter = self._adapters[item_type]
+        streaming = adapter.STREAMING
         for event, elem in context:
             if event == "start" and elem.tag == key:
-                raw_data_collector = XMLElementsCollection(elem)
+                if skip and skip[0] > 0:
+                    skip[0] -= 1
+                    for key_event, key_elem in context:
+                        if key_event == "end" and key_elem.tag == key:
+                            engine.release(key_elem, parent)
+                            break
+                    continue
+                if streaming:
+                    state = adapter.start_item(elem)
+                else:
+                    raw_data_collector = XMLElementsCollection(elem)
                 for key_event, key_elem in context:
                     if key_event == "end":
                         if key_elem.tag == key:
-                            key_elem.clear()
-                            payload = self._adapters[getattr(YmlFeedItemTypes, key)].adapt_raw_item(
-                                raw_data_collector.get_raw_item()
-                            )
+                            if streaming:
+                                payload = adapter.finish_item(state, key_elem)
+                            else:
+                                payload = adapter.adapt_raw_item(raw_data_collector.get_raw_item())
+                            engine.release(key_elem, parent)
                             yield {
-                                "type": getattr(YmlFeedItemTypes, key),
+                                "type": item_type,
                                 "original_id": payload.get("original_id", None),
                                 "payload": payload,
                             }
                             break
+                        elif streaming:
+                            adapter.feed(state, key_elem)
                         else:
                             raw_data_collector.accept_element(key_elem)
             elif event == "end" and elem.tag == tag_many:
-                elem.clear()
-                raise StopIteration()
+                engine.release(elem)
+                return
@@ -0,0 +1,87 @@
+"""
+XML parser engines for YML feeds. ``lxml`` is used when it is installed, as it is several times
+faster and can skip events of the tags nobody is interested in. Standard library parser is
+the fallback.
+"""
+
+from abc import ABCMeta, abstractmethod
+from typing import Iterable, Iterator, Optional, Tuple
+from xml.etree import cElementTree as ET
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+
+class AbstractParserEngine(object, metaclass=ABCMeta):
+
+    name = None
+
+    @abstractmethod
+    def iterparse(self, source, events: Tuple[str, ...] = ("start", "end"),
+                  tags: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, object]]:
+        """
+        Iterate over ``(event, element)`` pairs. ``tags`` is a hint: engine may skip events of
+        other tags, but may yield them too.
+        """
+
+    @abstractmethod
+    def release(self, elem, parent=None):
+        """
+        Free memory, taken by processed element. If ``parent`` is given, element
+        is its direct child and can be removed from it.
+        """
+
+
+class StdlibParserEngine(AbstractParserEngine):
+
+    name = "stdlib"
+
+    def iterparse(self, source, events=("start", "end"), tags=None):
+        return ET.iterparse(source, events=events)
+
+    def release(self, elem, parent=None):
+        elem.clear()
+        # Cleared element is still referenced by parent, and millions of them add up.
+        # Processed children are removed one by one, so it is always the first one.
+        if parent is not None:
+            parent.remove(elem)
+
+
+class LxmlParserEngine(AbstractParserEngine):
+
+    name = "lxml"
+
+    def __init__(self):
+        if lxml_etree is None:
+            raise ValueError("lxml parser engine requires 'lxml' package installed")
+
+    def iterparse(self, source, events=("start", "end"), tags=None):
+        tag = tuple(tags) if tags is not None else None
+        return lxml_etree.iterparse(source, events=events, tag=tag, huge_tree=True)
+
+    def release(self, elem, parent=None):
+        elem.clear()
+        # Already processed siblings stay in the tree as empty elements, drop them too
+        tree_parent = elem.getparent()
+        if tree_parent is not None:
+            while elem.getprevious() is not None:
+                del tree_parent[0]
+
+
+PARSER_ENGINES = {
+    kls.name: kls for kls in (StdlibParserEngine, LxmlParserEngine)
+}
+
+
+def get_parser_engine(name: Optional[str] = None) -> AbstractParserEngine:
+    """
+    Engine by its name, ``auto`` (default) picks the fastest one available.
+    """
+    name = name or "auto"
+    if name == "auto":
+        name = LxmlParserEngine.name if lxml_etree is not None else StdlibParserEngine.name
+    if name not in PARSER_ENGINES:
+        raise ValueError("Unknown parser engine '{}'".format(name))
+    return PARSER_ENGINES[name]()
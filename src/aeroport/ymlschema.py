@@ -0,0 +1,231 @@
+"""
+Declarative extraction of YML items. Instead of writing ``adapt_raw_item`` by hand, describe
+where payload fields are in the item element:
+
+    class OfferAdapter(SchemaItemAdapter):
+        SCHEMA = ItemSchema(Offer, (
+            Attr("original_id", "id", cast=int),
+            Attr("available", "available", default="true"),
+            Text("name", "name", "model"),
+            Text("price", "price", cast=float),
+            Text("pictures", "picture", many=True),
+            TagAttr("currency", "currencyId", "id"),
+            Mapping("params", "param", "name"),
+        ))
+
+    class CategoryAdapter(SchemaItemAdapter):
+        SCHEMA = ItemSchema(Category, (
+            Attr("original_id", "id", cast=int),
+            Attr("parent_id", "parentId", cast=int),
+            OwnText("name"),
+        ))
+
+Schema is compiled once into ``tag -> handlers`` table, and ``YmlOrigin`` feeds parse events
+of the item directly to the adapter, without copying elements.
+"""
+
+from copy import copy
+from functools import partial
+from typing import Callable, Dict, Optional, Sequence
+
+from aeroport.abc import AbstractPayload
+from aeroport.yml import YMLItemAdapter, cast_value
+
+
+class AbstractRule(object):
+
+    tags = ()
+
+    def __init__(self, field: str, cast=None, default=None):
+        self.field = field
+        self.cast = cast
+        self.default = default
+        # Only int has special fallback, other casts are called directly
+        self._convert = partial(cast_value, cast_type=int) if cast is int else cast
+
+    def apply(self, elem, values: Dict):
+        pass
+
+
+class Attr(AbstractRule):
+    """
+    Attribute of the item element itself. First of the ``names`` found is taken.
+    Applied when the item element ends.
+    """
+
+    def __init__(self, field: str, *names, cast=None, default=None):
+        super().__init__(field, cast, default)
+        self.names = names or (field, )
+
+    def apply(self, elem, values: Dict):
+        attrib = elem.attrib
+        for name in self.names:
+            value = attrib.get(name, None)
+            if value is not None:
+                values[self.field] = self._convert(value) if self._convert else value
+                return
+
+
+class OwnText(AbstractRule):
+    """
+    Text of the item element itself, such as category name.
+    """
+
+    def apply(self, elem, values: Dict):
+        value = elem.text
+        if value is not None:
+            values[self.field] = self._convert(value) if self._convert else value
+
+
+class Text(AbstractRule):
+    """
+    Text of the child tag, on any depth. With several ``tags``, the first one met in the item wins.
+    With ``many``, the field is a list of all texts.
+    """
+
+    def __init__(self, field: str, *tags, cast=None, default=None, many=False):
+        super().__init__(field, cast, [] if many and default is None else default)
+        self.tags = tags or (field, )
+        self.many = many
+
+    def get_value(self, elem):
+        return elem.text
+
+    def apply(self, elem, values: Dict):
+        value = self.get_value(elem)
+        if value is None:
+            return
+        if self._convert:
+            value = self._convert(value)
+        if self.many:
+            values.setdefault(self.field, []).append(value)
+        elif self.field not in values:
+            values[self.field] = value
+
+
+class TagAttr(Text):
+    """
+    Attribute of the child tag.
+    """
+
+    def __init__(self, field: str, tag: str, attr: str, cast=None, default=None, many=False):
+        super().__init__(field, tag, cast=cast, default=default, many=many)
+        self.attr = attr
+
+    def get_value(self, elem):
+        return elem.attrib.get(self.attr, None)
+
+
+class Mapping(AbstractRule):
+    """
+    Dict of ``key attribute -> text`` of the child tags, such as ``<param name="Color">Red</param>``.
+    """
+
+    def __init__(self, field: str, tag: str = "param", key_attr: str = "name", cast=None):
+        super().__init__(field, cast, {})
+        self.tags = (tag, )
+        self.key_attr = key_attr
+
+    def apply(self, elem, values: Dict):
+        key = elem.attrib.get(self.key_attr, None)
+        if key is None:
+            return
+        value = elem.text
+        if self._convert and value is not None:
+            value = self._convert(value)
+        mapping = values.get(self.field, None)
+        if mapping is None:
+            mapping = values[self.field] = {}
+        mapping[key] = value
+
+
+class ItemSchema(object):
+    """
+    Rules for one payload class, compiled to the dispatch table.
+    """
+
+    def __init__(self, payload_class: type, rules: Sequence[AbstractRule]):
+        self.payload_class = payload_class
+        self.rules = tuple(rules)
+
+        unknown = [rule.field for rule in self.rules if rule.field not in payload_class.fields]
+        if unknown:
+            raise ValueError("{} does not support fields: {}".format(payload_class.__name__, ", ".join(unknown)))
+
+        self._item_rules = tuple(rule.apply for rule in self.rules if isinstance(rule, (Attr, OwnText)))
+        handlers = {}
+        for rule in self.rules:
+            for tag in rule.tags:
+                handlers.setdefault(tag, []).append(rule.apply)
+        self._handlers = {tag: self._compile_handlers(funcs) for tag, funcs in handlers.items()}
+        self._defaults = tuple((rule.field, rule.default) for rule in self.rules if rule.default is not None)
+
+    @staticmethod
+    def _compile_handlers(funcs: Sequence[Callable]) -> Callable:
+        if len(funcs) == 1:
+            return funcs[0]
+
+        def apply_all(elem, values):
+            for apply in funcs:
+                apply(elem, values)
+
+        return apply_all
+
+    @property
+    def tags(self):
+        """
+        All child tags, that schema needs to see.
+        """
+        return frozenset(self._handlers)
+
+    def start(self, elem) -> Dict:
+        return {}
+
+    def feed(self, values: Dict, elem):
+        apply = self._handlers.get(elem.tag, None)
+        if apply is not None:
+            apply(elem, values)
+
+    def finish(self, values: Dict, elem) -> AbstractPayload:
+        for apply in self._item_rules:
+            apply(elem, values)
+        for field, default in self._defaults:
+            if field not in values:
+                values[field] = copy(default)
+        return self.payload_class(values)
+
+
+class SchemaItemAdapter(YMLItemAdapter):
+    """
+    Adapter, made from ``SCHEMA``. Also works with raw items (lists of elements), as any other adapter.
+    """
+
+    STREAMING = True
+    SCHEMA = None  # type: Optional[ItemSchema]
+
+    def __init__(self, schema: Optional[ItemSchema] = None):
+        self._schema = schema or self.SCHEMA
+        if self._schema is None:
+            raise ValueError("{} must define SCHEMA".format(self.__class__.__name__))
+        # Skip one call level on the hot path
+        self.start_item = self._schema.start
+        self.feed = self._schema.feed
+        self.finish_item = self._schema.finish
+
+    def start_item(self, elem) -> Dict:
+        return self._schema.start(elem)
+
+    def feed(self, state: Dict, elem):
+        self._schema.feed(state, elem)
+
+    def finish_item(self, state: Dict, elem) -> AbstractPayload:
+        return self._schema.finish(state, elem)
+
+    def get_tags(self) -> frozenset:
+        return self._schema.tags
+
+    def adapt_raw_item(self, raw_item) -> AbstractPayload:
+        state = self.start_item(raw_item[0])
+        for elem in raw_item[1:]:
+            self.feed(state, elem)
+        return self.finish_item(state, raw_item[0])